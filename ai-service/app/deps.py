@@ -1,14 +1,54 @@
 # ai-service/app/deps.py
+import hashlib
 import os
+import time
+from collections import OrderedDict
 from fastapi import Depends, HTTPException, Header
 from jose import jwt, JWTError
 from dotenv import load_dotenv
+from app.services.metrics import Counter
 
 load_dotenv()
 
 JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
 JWT_ALGORITHM = "HS256"
 
+# Caché de tokens ya verificados: el polling de /jobs manda el mismo token
+# cientos de veces. Clave = sha256 del token (no se guarda el token); cada
+# entrada vence en su `exp` (o a los TOKEN_CACHE_MAX_AGE s si no tiene) y
+# las menos usadas salen primero cuando se llena.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))  # 0 = sin caché
+TOKEN_CACHE_MAX_AGE = float(os.getenv("TOKEN_CACHE_MAX_AGE", "300"))
+AUTH_TOKENS = Counter("fitai_auth_token_total", "Validaciones de token por resultado", ("result",))
+
+_token_cache = OrderedDict()  # digest -> (usuario, vence_en)
+
+
+def _cache_get(key, now):
+    entry = _token_cache.get(key)
+    if entry is None:
+        return None
+    user, expires_at = entry
+    if now >= expires_at:
+        del _token_cache[key]
+        return None
+    _token_cache.move_to_end(key)
+    return user
+
+
+def _cache_put(key, user, payload, now):
+    if TOKEN_CACHE_SIZE <= 0:
+        return
+    expires_at = now + TOKEN_CACHE_MAX_AGE
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)):
+        expires_at = min(expires_at, float(exp))
+    _token_cache[key] = (user, expires_at)
+    _token_cache.move_to_end(key)
+    while len(_token_cache) > TOKEN_CACHE_SIZE:
+        _token_cache.popitem(last=False)
+
+
 async def get_current_user(authorization: str | None = Header(None)):
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(401, "Missing Bearer token")
@@ -16,6 +56,13 @@ async def get_current_user(authorization: str | None = Header(None)):
     token = authorization.split(" ")[1]
     token = token.replace('"', '').strip()
 
+    now = time.time()
+    key = hashlib.sha256(token.encode()).digest()
+    user = _cache_get(key, now)
+    if user is not None:
+        AUTH_TOKENS.inc(result="hit")
+        return user
+
     try:
         payload = jwt.decode(
             token,
@@ -23,10 +70,11 @@ async def get_current_user(authorization: str | None = Header(None)):
             algorithms=[JWT_ALGORITHM],
             options={"verify_aud": False},
         )
-        print("Token validado y firma verificada correctamente.")
-        
-    except Exception as e:
-        print(f"Error validando: {e}")
+    except Exception:
+        AUTH_TOKENS.inc(result="invalid")
         raise HTTPException(401, "Invalid token")
     
-    return {"id": payload.get("sub"), "email": payload.get("email")}
+    AUTH_TOKENS.inc(result="miss")
+    user = {"id": payload.get("sub"), "email": payload.get("email")}
+    _cache_put(key, user, payload, now)
+    return user
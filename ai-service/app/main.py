@@ -1,5 +1,9 @@
-from fastapi import FastAPI
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
 from app.routes import analyze, jobs, webhooks
+from app.services.metrics import CONTENT_TYPE, HTTP_LATENCY, render
 
 app = FastAPI(title="FitAI Backend")
 
@@ -7,6 +11,24 @@ app.include_router(analyze.router)
 app.include_router(jobs.router)
 app.include_router(webhooks.router)
 
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Plantilla de la ruta (/jobs/{job_id}) para no crear una serie por id
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        HTTP_LATENCY.observe(time.perf_counter() - t0, method=request.method, route=path, status=status)
+
 @app.get("/")
 def root():
     return {"service": "fitai-backend", "status": "ok"}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(render(), media_type=CONTENT_TYPE)
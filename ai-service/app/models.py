@@ -10,6 +10,19 @@ class JobOut(BaseModel):
     job_id: str
     status: str
 
+class AnalyzeBatchInput(BaseModel):
+    # Cada video se valida por separado: uno inválido no rechaza el lote
+    videos: list[Any]
+
+class BatchJobOut(BaseModel):
+    index: int
+    job_id: str | None = None
+    status: str              # "queued" | "invalid"
+    error: str | None = None
+
+class BatchOut(BaseModel):
+    jobs: list[BatchJobOut]
+
 class AnalysisOut(BaseModel):
     id: str
     job_id: str
@@ -1,30 +1,76 @@
-import uuid, os
-from fastapi import APIRouter, Depends
-from sqlalchemy import text
-from app.models import AnalyzeInput, JobOut
-from app.services.db import get_db
+import os, uuid
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import ValidationError
+from sqlalchemy import bindparam, text
+from app.models import AnalyzeBatchInput, AnalyzeInput, BatchJobOut, BatchOut, JobOut
+from app.services.db import get_async_db
+from app.services.job_status import stage_status
+from app.services.rq_async import ANALYSIS_TASK, add_to_pipeline, get_redis
 from app.deps import get_current_user
-import redis, rq
 
 router = APIRouter(prefix="/analyze", tags=["analyze"])
-q = rq.Queue("fitai", connection=redis.from_url(os.getenv("REDIS_URL")))
+ANALYZE_BATCH_MAX = int(os.getenv("ANALYZE_BATCH_MAX", "100"))
+
+async def _insert_jobs(db, user_id, jobs):
+    """ Filas 'queued' de todos los jobs [(job_id, AnalyzeInput)] en un solo INSERT multi-fila y un commit. """
+    rows = ", ".join(f"(:id{k},:uid,'queued',:url{k})" for k in range(len(jobs)))
+    params = {"uid": user_id}
+    for k, (job_id, item) in enumerate(jobs):
+        params[f"id{k}"], params[f"url{k}"] = job_id, item.video_route
+    await db.execute(text(f"INSERT INTO jobs(id,user_id,status,input_video_url) VALUES {rows}"), params)
+    await db.commit()
+
+async def _enqueue_jobs(user_id, jobs):
+    # Estado 'queued' en la caché + mismo job que q.enqueue("app.tasks.run_analysis", ...),
+    # todo en una sola transacción de redis.asyncio
+    async with get_redis().pipeline(transaction=True) as pipe:
+        for job_id, item in jobs:
+            stage_status(pipe, job_id, "queued", user_id, item.video_route)
+            add_to_pipeline(pipe, ANALYSIS_TASK, (job_id, item.video_route, item.exercise, item.video_id))
+        await pipe.execute()
+
+async def _queue_jobs(db, user_id, jobs):
+    """ Inserta y encola; si Redis falla, los jobs ya insertados quedan 'failed' (no 'queued' para siempre). """
+    await _insert_jobs(db, user_id, jobs)
+    try:
+        await _enqueue_jobs(user_id, jobs)
+    except Exception as e:
+        await db.execute(
+            text("UPDATE jobs SET status='failed', updated_at=now() WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+            {"ids": [job_id for job_id, _ in jobs]},
+        )
+        await db.commit()
+        raise HTTPException(503, "Cola de análisis no disponible") from e
+
+def _describe(error: ValidationError):
+    return "; ".join(f"{'.'.join(map(str, e['loc'])) or 'video'}: {e['msg']}" for e in error.errors())
 
 @router.post("/", response_model=JobOut)
-def create_job(payload: AnalyzeInput, user=Depends(get_current_user), db=Depends(get_db)):
-    job_id = str(uuid.uuid4())
-    
-    db.execute(
-        text("INSERT INTO jobs(id,user_id,status,input_video_url) VALUES (:id,:uid,'queued',:url)"),
-        {"id": job_id, "uid": user["id"], "url": payload.video_route}, 
-    )
-    db.commit()
-    
-    q.enqueue(
-        "app.tasks.run_analysis", 
-        job_id, 
-        payload.video_route, 
-        payload.exercise,
-        payload.video_id
-    )
-    
-    return JobOut(job_id=job_id, status="queued")
\ No newline at end of file
+async def create_job(payload: AnalyzeInput, user=Depends(get_current_user), db=Depends(get_async_db)):
+    jobs = [(str(uuid.uuid4()), payload)]
+    await _queue_jobs(db, user["id"], jobs)
+    return JobOut(job_id=jobs[0][0], status="queued")
+
+@router.post("/batch", response_model=BatchOut)
+async def create_jobs(payload: AnalyzeBatchInput, user=Depends(get_current_user), db=Depends(get_async_db)):
+    """
+    Varios videos en un pedido (p. ej. una sesión completa). Cada item se
+    valida por separado: los inválidos vuelven con status "invalid" y su
+    error, el resto se inserta en un solo INSERT y se encola en un solo
+    pipeline de Redis. `jobs` respeta el orden de `videos`.
+    """
+    if len(payload.videos) > ANALYZE_BATCH_MAX:
+        raise HTTPException(413, f"Máximo {ANALYZE_BATCH_MAX} videos por lote")
+    results, jobs = [], []
+    for i, raw in enumerate(payload.videos):
+        try:
+            item = AnalyzeInput.model_validate(raw)
+        except ValidationError as e:
+            results.append(BatchJobOut(index=i, status="invalid", error=_describe(e)))
+            continue
+        job_id = str(uuid.uuid4())
+        jobs.append((job_id, item))
+        results.append(BatchJobOut(index=i, job_id=job_id, status="queued"))
+    if jobs:
+        await _queue_jobs(db, user["id"], jobs)
+    return BatchOut(jobs=results)
@@ -1,27 +1,149 @@
-from fastapi import APIRouter, Depends
+import json, os, time
+from fastapi import APIRouter, Depends, Header, Query
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy import text
 from app.models import AnalysisOut
-from app.services.db import get_db
+from app.services.db import get_async_db
+from app.services import job_status
+from app.services.events import FINAL_EVENTS, get_bus
 from app.deps import get_current_user
 
 router = APIRouter(prefix="/jobs", tags=["jobs"])
+STREAM_MAX_SECONDS = float(os.getenv("STREAM_MAX_SECONDS", "900"))
+JOB_WAIT_MAX = float(os.getenv("JOB_WAIT_MAX_SECONDS", "30"))
+
+async def _recheck(job_id, db, state):
+    """
+    Estado no final que no se confirma hace rato: se mira la BD. Un estado
+    final de la BD pisa la caché (el worker no pudo publicarlo); si no, solo
+    se renueva checked_at. A lo sumo una consulta por job cada
+    JOB_STATUS_RECHECK_SECONDS, compartida entre todos los que hacen polling.
+    """
+    row = (await db.execute(text("SELECT status FROM jobs WHERE id=:id"), {"id": job_id})).first()
+    await db.close()  # no retener la conexión durante un long-poll
+    state = dict(state, checked_at=repr(time.time()))
+    if row and row[0] in job_status.FINAL_STATUSES:
+        state["status"] = row[0]
+        await job_status.cache_status(job_id, row[0], keep_newer=False)
+    else:
+        await job_status.cache_status(job_id, state["status"])
+    return state
+
+
+async def _job_state(job_id, user, db, if_none_match, wait, kind):
+    """
+    Estado del job (status, user_id, input_video_url) desde la caché de Redis;
+    si falta se lee de la BD y se rellena, y si es un estado no final viejo
+    se reconfirma (_recheck). Con `wait` y un If-None-Match que coincide,
+    espera hasta `wait` s a que el estado cambie. None si no existe.
+    """
+    state = await job_status.get_cached(job_id)
+    if state is None:
+        row = (await db.execute(
+            text("SELECT status,user_id,input_video_url FROM jobs WHERE id=:id"),
+            {"id": job_id},
+        )).mappings().first()
+        await db.close()
+        if not row:
+            return None
+        state = {k: str(v) if v is not None else None for k, v in row.items()}
+        state["checked_at"] = repr(time.time())
+        await job_status.cache_status(job_id, state["status"], state["user_id"], state["input_video_url"])
+    if state["user_id"] != str(user["id"]):
+        return None
+    if job_status.is_stale(state):
+        state = await _recheck(job_id, db, state)
+    if wait and job_status.etag_matches(if_none_match, job_status.etag(job_id, state["status"], kind)):
+        recheck = lambda current: _recheck(job_id, db, current)
+        state = await job_status.wait_for_change(job_id, state["status"], min(wait, JOB_WAIT_MAX), recheck) or state
+    return state
+
+
+def _not_modified(job_id, state, kind, if_none_match, response):
+    """ 304 si el cliente ya tiene este estado; si no, deja el ETag en la respuesta. """
+    tag = job_status.etag(job_id, state["status"], kind)
+    if job_status.etag_matches(if_none_match, tag):
+        return Response(status_code=304, headers={"ETag": tag, "Cache-Control": "no-cache"})
+    response.headers["ETag"] = tag
+    response.headers["Cache-Control"] = "no-cache"
+    return None
+
 
 @router.get("/{job_id}")
-def get_job(job_id: str, user=Depends(get_current_user), db=Depends(get_db)):
-    row = db.execute(
-        text("SELECT id,status,input_video_url FROM jobs WHERE id=:id AND user_id=:uid"),
-        {"id": job_id, "uid": user["id"]},
-    ).mappings().first()
-    if not row:
+async def get_job(job_id: str, response: Response, wait: float = Query(0, ge=0),
+                  user=Depends(get_current_user), db=Depends(get_async_db),
+                  if_none_match: str | None = Header(None)):
+    """
+    Estado del job. Con If-None-Match responde 304 si no cambió; con
+    `?wait=<s>` además espera (hasta JOB_WAIT_MAX_SECONDS) a que cambie.
+    """
+    state = await _job_state(job_id, user, db, if_none_match, wait, "job")
+    if state is None:
         return {"error": "not_found"}
-    return dict(row)
+    cached = _not_modified(job_id, state, "job", if_none_match, response)
+    if cached:
+        return cached
+    return {"id": job_id, "status": state["status"], "input_video_url": state["input_video_url"]}
 
 @router.get("/{job_id}/analysis", response_model=AnalysisOut | dict)
-def get_analysis(job_id: str, user=Depends(get_current_user), db=Depends(get_db)):
-    row = db.execute(
-        text("SELECT * FROM analyses a JOIN jobs j ON j.id=a.job_id WHERE a.job_id=:id AND j.user_id=:uid"),
-        {"id": job_id, "uid": user["id"]},
-    ).mappings().first()
+async def get_analysis(job_id: str, response: Response, wait: float = Query(0, ge=0),
+                       user=Depends(get_current_user), db=Depends(get_async_db),
+                       if_none_match: str | None = Header(None)):
+    """ Resultado del análisis; mientras el job no terminó responde pending sin consultar analyses. """
+    state = await _job_state(job_id, user, db, if_none_match, wait, "analysis")
+    if state is None:
+        return {"status": "pending"}
+    cached = _not_modified(job_id, state, "analysis", if_none_match, response)
+    if cached:
+        return cached
+    if state["status"] != "succeeded":
+        return {"status": "pending"}
+    row = (await db.execute(
+        text("SELECT id,job_id,exercise,reps,score,details FROM analyses WHERE job_id=:id"),
+        {"id": job_id},
+    )).mappings().first()
     if not row:
+        del response.headers["ETag"]  # estado y tabla desfasados: que el cliente no lo guarde
         return {"status": "pending"}
     return dict(row)
+
+
+@router.get("/{job_id}/stream")
+async def stream_job(job_id: str, user=Depends(get_current_user), db=Depends(get_async_db),
+                     last_event_id: str | None = Header(None)):
+    """
+    Server-Sent Events con el avance del job: `rep` por cada repetición
+    terminada, `progress` con el porcentaje de frames procesados y
+    `done`/`failed` al final. Acepta Last-Event-ID para reconectar.
+    """
+    row = (await db.execute(
+        text("SELECT status FROM jobs WHERE id=:id AND user_id=:uid"),
+        {"id": job_id, "uid": user["id"]},
+    )).mappings().first()
+    if not row:
+        return {"error": "not_found"}
+    status = row["status"]
+    await db.close()  # la conexión vuelve al pool; el stream puede durar minutos
+    bus = get_bus()
+
+    async def events():
+        last = last_event_id or "0"
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            # Job ya terminado y sin eventos (p. ej. expiraron): solo el estado final
+            timeout = 0.1 if status in ("succeeded", "failed") else 15.0
+            batch = await bus.aread(job_id, last, timeout=timeout)
+            if not batch:
+                if timeout < 1:
+                    final = "done" if status == "succeeded" else "failed"
+                    yield f"event: {final}\ndata: {json.dumps({'type': final})}\n\n"
+                    return
+                yield ": keepalive\n\n"
+                continue
+            for event_id, event in batch:
+                last = event_id
+                yield f"id: {event_id}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                if event["type"] in FINAL_EVENTS:
+                    return
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
@@ -4,7 +4,8 @@ Unified pipeline (classification + squat evaluation)
 1) Entrena un clasificador desde angulos_dataset.csv (por video).
 2) Procesa un video nuevo y calcula ángulos por frame.
 3) Predice el ejercicio.
-4) Si detecta/sospecha "Sentadilla", corre SquatEvaluator y entrega feedback.
+4) Si detecta/sospecha "Sentadilla", corre evaluate_squat (SquatEvaluator, o
+   StreamingSquatEvaluator en videos largos) y entrega feedback.
 
 Requisitos:
     pip install numpy pandas scikit-learn mediapipe opencv-python
@@ -13,13 +14,14 @@ Requisitos:
 """
 
 from pathlib import Path
-import cv2
 import numpy as np
 import pandas as pd
 from dataclasses import dataclass
 
-import mediapipe as mp
-mp_pose = mp.solutions.pose
+from app.services.angles import angles_between, batch_angles
+from app.services.frame_store import FrameStore
+from app.services.landmark_cache import load_landmarks
+from app.services.pose_engine import PoseSettings, mp_pose
 
 CSV_PATH      = "/home/imsebs/mediapipe-env/angulos_dataset.csv"
 VIDEO_PATH    = "/home/imsebs/mediapipe-env/videos/Sentadilla/sentadilla1.mp4"
@@ -46,6 +48,10 @@ ANGLE_DEFS = {
     "ankle_left":     (mp_pose.PoseLandmark.LEFT_KNEE,      mp_pose.PoseLandmark.LEFT_ANKLE,  mp_pose.PoseLandmark.LEFT_FOOT_INDEX),
 }
 
+# Grupos para los agregados de rango (parte superior vs inferior)
+UPPER_BODY = ["elbow_right", "elbow_left", "shoulder_right", "shoulder_left"]
+LOWER_BODY = ["hip_right", "hip_left", "knee_right", "knee_left", "ankle_right", "ankle_left"]
+
 LM_KEYS = {
     "LS":  mp_pose.PoseLandmark.LEFT_SHOULDER,
     "RS":  mp_pose.PoseLandmark.RIGHT_SHOULDER,
@@ -63,75 +69,61 @@ def compute_angle(a, b, c):
     """
     Calcula el ángulo en grados ∠ABC a partir de 3 puntos 3D (x,y,z).
     Maneja casos degenerados devolviendo NaN si no hay magnitud.
+    Para muchos frames usar angles.batch_angles.
     """
-    a, b, c = np.array(a), np.array(b), np.array(c)
-    ba, bc = a - b, c - b
-    nba, nbc = np.linalg.norm(ba), np.linalg.norm(bc)
-    if nba == 0 or nbc == 0:
-        return np.nan
-    cos_ang = np.dot(ba, bc) / (nba * nbc)
-    cos_ang = np.clip(cos_ang, -1.0, 1.0)
-    return float(np.degrees(np.arccos(cos_ang)))
+    return float(angles_between(a, b, c))
 
 def lm_point(landmarks, lm_enum):
-    """ Convierte un landmark de MediaPipe a tupla (x, y, z). """
+    """ Convierte un landmark (fila del arreglo (33, 4) del motor de pose) a tupla (x, y, z). """
     lm = landmarks[lm_enum.value]
-    return (lm.x, lm.y, lm.z)
+    return (float(lm[0]), float(lm[1]), float(lm[2]))
 
-def process_video(video_path, skip=SKIP_FRAMES):
+def process_video(video_path, skip=SKIP_FRAMES, sampling=None, workers=1):
     """
     Procesa el video con MediaPipe Pose y devuelve:
       - df_angles: DataFrame con ángulos por frame (columnas = ANGLE_DEFS.keys()).
       - df_lm:     DataFrame con x,y de landmarks clave (sufijos _x/_y).
-    Solo se procesan frames cada 'skip' para acelerar.
+    El índice de ambos es el número de frame en el video (seq.frame_index).
+    Solo se procesan frames cada 'skip' para acelerar. Los landmarks salen de
+    la caché en disco si el mismo video ya se procesó con los mismos parámetros.
+    Con `sampling` (sampling.AdaptiveSampling) el paso fijo se reemplaza por
+    muestreo adaptativo; ojo que el clasificador se entrenó con paso fijo y
+    las medias/desvíos quedan sesgados hacia los frames con movimiento.
+    `workers` > 1 extrae por tramos en paralelo (segments.py).
     """
-    angle_cols = list(ANGLE_DEFS.keys())
-    rows_angles, rows_lm = [], []
+    seq = load_landmarks(video_path, pose_settings(skip, sampling), workers=workers)
+    return sequence_tables(seq)
 
-    with mp_pose.Pose(
-        static_image_mode=False,
+def pose_settings(skip=SKIP_FRAMES, sampling=None):
+    """ Parámetros de pose del pipeline (los mismos con que se arma el dataset). """
+    return PoseSettings(
         model_complexity=1,
         min_detection_confidence=0.5,
-        min_tracking_confidence=0.5
-    ) as pose:
-        cap = cv2.VideoCapture(str(video_path))
-        idx = 0
-        while cap.isOpened():
-            ok, frame = cap.read()
-            if not ok:
-                break
-            idx += 1
-            if idx % skip != 0:
-                continue
-
-            img_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            results = pose.process(img_rgb)
-            if results.pose_landmarks is None:
-                continue
-
-            lms = results.pose_landmarks.landmark
-
-            # Ángulos por frame
-            angle_row = {}
-            for name, (p1, p2, p3) in ANGLE_DEFS.items():
-                a = lm_point(lms, p1); b = lm_point(lms, p2); c = lm_point(lms, p3)
-                ang = compute_angle(a, b, c)
-                angle_row[name] = np.nan if np.isnan(ang) else round(ang, 3)
-            rows_angles.append(angle_row)
-
-            # Landmarks clave (x,y) por frame
-            lm_row = {}
-            for key, enumv in LM_KEYS.items():
-                x, y, _ = lm_point(lms, enumv)
-                lm_row[f"{key}_x"] = x
-                lm_row[f"{key}_y"] = y
-            rows_lm.append(lm_row)
-
-        cap.release()
-
-    # Construcción de DataFrames (evitando filas con NaN en ángulos)
-    df_angles = pd.DataFrame(rows_angles).dropna(axis=0, how="any") if rows_angles else pd.DataFrame(columns=angle_cols)
-    df_lm     = pd.DataFrame(rows_lm) if rows_lm else pd.DataFrame(columns=[f"{k}_{c}" for k in LM_KEYS.keys() for c in ("x","y")])
+        min_tracking_confidence=0.5,
+        stride=skip,
+        sampling=sampling,
+    )
+
+def sequence_tables(seq):
+    """ (df_angles, df_lm) de process_video a partir de un PoseSequence ya extraído. """
+    angle_cols = list(ANGLE_DEFS.keys())
+    lms = seq.landmarks[seq.detected]
+    frames = pd.Index(seq.frame_index[seq.detected], name="frame")
+
+    # Un solo bloque float32 (ángulos + x,y de landmarks clave); los
+    # DataFrames son vistas sobre él, sin copias por frame ni al convertir
+    lm_cols = [f"{key}_{c}" for key in LM_KEYS for c in ("x", "y")]
+    store = FrameStore(columns=angle_cols + lm_cols, capacity=len(lms))
+    block = store.append_rows(len(lms))
+
+    # Ángulos de todos los frames en una sola llamada
+    _, angles = batch_angles(lms, ANGLE_DEFS, dims=3)
+    block[:, :len(angle_cols)] = np.round(angles, 3)
+    block[:, len(angle_cols):] = lms[:, [e.value for e in LM_KEYS.values()], :2].reshape(len(lms), -1)
+
+    df_angles, df_lm = store.to_frame(angle_cols), store.to_frame(lm_cols)
+    df_angles.index = df_lm.index = frames
+    df_angles = df_angles.dropna(axis=0, how="any")
     return df_angles, df_lm
 
 def extract_basic_features(df_angles):
@@ -150,47 +142,26 @@ def extract_basic_features(df_angles):
         feats[f"{col}_std"]  = float(np.nanstd(s))
         feats[f"{col}_rng"]  = float(np.nanmax(s) - np.nanmin(s))
 
-    upper = ["elbow_right","elbow_left","shoulder_right","shoulder_left"]
-    lower = ["hip_right","hip_left","knee_right","knee_left","ankle_right","ankle_left"]
-
     def agg(cols):
         vals = [feats.get(f"{c}_rng", 0.0) for c in cols]
         return float(np.mean(vals)) if vals else 0.0
 
-    feats["upper_body_range_mean"] = agg(upper)
-    feats["lower_body_range_mean"] = agg(lower)
+    feats["upper_body_range_mean"] = agg(UPPER_BODY)
+    feats["lower_body_range_mean"] = agg(LOWER_BODY)
     feats["lower_minus_upper_range"] = feats["lower_body_range_mean"] - feats["upper_body_range_mean"]
     return feats
 
 def train_model(csv_path):
     """
     Entrena RandomForest por video:
-      - Lee CSV (frames con ángulos y label).
-      - Agrupa por (video,label) y calcula features del grupo.
+      - Lee el dataset por bloques (CSV o Parquet) y calcula las features
+        de cada (video,label) con reducciones agrupadas (ver training.py).
       - Ajusta el modelo y retorna (modelo, columnas_features).
     """
     from sklearn.ensemble import RandomForestClassifier
-    df = pd.read_csv(csv_path)
-    if "video" not in df.columns or "label" not in df.columns:
-        raise ValueError("Invalid CSV: missing 'video' or 'label'.")
-
-    # Columnas de ángulos = todo excepto metadatos
-    angle_cols = [c for c in df.columns if c not in ["video","frame","label"]]
-    for c in angle_cols:
-        df[c] = pd.to_numeric(df[c], errors="coerce")
-    df = df.dropna(axis=0, how="any")
-
-    groups = []
-    for (video, label), sub in df.groupby(["video","label"]):
-        feats = extract_basic_features(sub[angle_cols])
-        if feats:
-            feats["video"] = video
-            feats["label"] = label
-            groups.append(feats)
-    if not groups:
-        raise ValueError("Could not build per-video features from CSV.")
-
-    feats_df = pd.DataFrame(groups)
+    from app.services.training import build_training_features
+
+    feats_df = build_training_features(csv_path)
     X = feats_df.drop(columns=["video","label"])
     y = feats_df["label"]
 
@@ -228,6 +199,16 @@ class EvalResult:
     score: float
     messages: list  # feedback textual
 
+def _trunk_tilt_deg(sh_cx, sh_cy, hip_cx, hip_cy):
+    """ Inclinación del tronco (cadera→hombros) contra la vertical, agudo en 0..90°. """
+    vx = sh_cx - hip_cx
+    vy = sh_cy - hip_cy
+    # Compara el vector tronco con la vertical hacia abajo (0,1)
+    cosines = np.clip(vy / (np.sqrt(vx**2 + vy**2) + 1e-6), -1.0, 1.0)
+    trunk_deg = np.degrees(np.arccos(cosines))
+    # Hacerlo agudo (0..90) para que sea interpretable (evita 146°, etc.)
+    return np.minimum(trunk_deg, 180.0 - trunk_deg)
+
 class SquatEvaluator:
     """
     Reglas simples:
@@ -240,9 +221,10 @@ class SquatEvaluator:
     BACK_TILT_MAX_DEG  = 12.0
     KNEE_MIN_ANGLE     = 85.0
     HIP_KNEE_Y_MARGIN  = 0.02  # coordenadas normalizadas; y crece hacia abajo
+    BOTTOM_PERCENTILE  = 15
+    TRUNK_PERCENTILE   = 25
 
     def evaluate(self, df_angles: pd.DataFrame, df_lm: pd.DataFrame) -> EvalResult:
-        msgs = []
         if df_angles.empty or df_lm.empty:
             return EvalResult(False, 0.0, ["No se detectó pose suficiente para evaluar."])
 
@@ -250,6 +232,34 @@ class SquatEvaluator:
         feet_w = np.abs(df_lm["RFI_x"] - df_lm["LFI_x"])
         sh_w   = np.abs(df_lm["RS_x"]  - df_lm["LS_x"])
         ratio  = np.median((feet_w / (sh_w + 1e-6)).clip(0, 5))
+
+        # --- B) Frames "bottom": donde el ángulo de rodilla es mínimo
+        knee_cols = [c for c in df_angles.columns if "knee" in c]
+        knee_mean = df_angles[knee_cols].mean(axis=1) if knee_cols else pd.Series(np.full(len(df_angles), 180.0))
+        thresh = np.percentile(knee_mean, self.BOTTOM_PERCENTILE)
+        bottom_idx = knee_mean.index[knee_mean <= thresh]
+        if len(bottom_idx) == 0:
+            bottom_idx = knee_mean.index
+
+        # --- C) Inclinación de espalda en los frames bottom
+        bottom = df_lm.loc[bottom_idx]
+        hip_cy = ((bottom["LH_y"] + bottom["RH_y"]) / 2.0).values
+        trunk_deg = _trunk_tilt_deg(
+            ((bottom["LS_x"] + bottom["RS_x"]) / 2.0).values, ((bottom["LS_y"] + bottom["RS_y"]) / 2.0).values,
+            ((bottom["LH_x"] + bottom["RH_x"]) / 2.0).values, hip_cy,
+        )
+        trunk_stat = np.percentile(trunk_deg, self.TRUNK_PERCENTILE)
+
+        # --- D) Profundidad: por rodilla y por línea cadera/rodilla
+        min_knee = float(np.min(knee_mean)) if len(knee_mean) else 180.0
+        hip_y_bottom = np.median(hip_cy) if len(hip_cy) else 0.0
+        knee_y_bottom = np.median(((bottom["LK_y"] + bottom["RK_y"]) / 2.0).values) if len(bottom_idx) else 0.0
+
+        return self.score(ratio, trunk_stat, min_knee, hip_y_bottom, knee_y_bottom)
+
+    def score(self, ratio, trunk_stat, min_knee, hip_y_bottom, knee_y_bottom) -> EvalResult:
+        """ Reglas y mensajes a partir de los estadísticos del video (comparten batch y streaming). """
+        msgs = []
         if ratio < self.FEET_SHOULDERS_MIN:
             msgs.append(f"Base muy angosta: pies/hombros={ratio:.2f} (<{self.FEET_SHOULDERS_MIN}). Abre un poco más los pies.")
             base_ok = False
@@ -260,29 +270,6 @@ class SquatEvaluator:
             msgs.append(f"✅ Base adecuada (pies/hombros≈{ratio:.2f}).")
             base_ok = True
 
-        # --- B) Frames "bottom": donde el ángulo de rodilla es mínimo
-        knee_cols = [c for c in df_angles.columns if "knee" in c]
-        knee_mean = df_angles[knee_cols].mean(axis=1) if knee_cols else pd.Series(np.full(len(df_angles), 180.0))
-        thresh = np.percentile(knee_mean, 15)
-        bottom_idx = knee_mean.index[knee_mean <= thresh]
-        if len(bottom_idx) == 0:
-            bottom_idx = knee_mean.index
-
-        # --- C) Inclinación de espalda (medida como ángulo agudo contra vertical)
-        sh_cx = (df_lm.loc[bottom_idx, "LS_x"] + df_lm.loc[bottom_idx, "RS_x"]) / 2.0
-        sh_cy = (df_lm.loc[bottom_idx, "LS_y"] + df_lm.loc[bottom_idx, "RS_y"]) / 2.0
-        hip_cx = (df_lm.loc[bottom_idx, "LH_x"] + df_lm.loc[bottom_idx, "RH_x"]) / 2.0
-        hip_cy = (df_lm.loc[bottom_idx, "LH_y"] + df_lm.loc[bottom_idx, "RH_y"]) / 2.0
-
-        vx = sh_cx.values - hip_cx.values
-        vy = sh_cy.values - hip_cy.values
-        # Compara el vector tronco con la vertical hacia abajo (0,1)
-        cosines = np.clip(vy / (np.sqrt(vx**2 + vy**2) + 1e-6), -1.0, 1.0)
-        trunk_deg = np.degrees(np.arccos(cosines))
-        # Hacerlo agudo (0..90) para que sea interpretable (evita 146°, etc.)
-        trunk_deg = np.minimum(trunk_deg, 180.0 - trunk_deg)
-        trunk_stat = np.percentile(trunk_deg, 25)
-
         if trunk_stat > self.BACK_TILT_MAX_DEG:
             msgs.append(f"Espalda inclinada en la fase baja (~{trunk_stat:.1f}°). Mantén el tronco más vertical (<= {self.BACK_TILT_MAX_DEG}°).")
             back_ok = False
@@ -290,11 +277,6 @@ class SquatEvaluator:
             msgs.append(f"✅ Espalda relativamente recta en la fase baja (~{trunk_stat:.1f}°).")
             back_ok = True
 
-        # --- D) Profundidad: por rodilla y por línea cadera/rodilla
-        min_knee = float(np.min(knee_mean)) if len(knee_mean) else 180.0
-        hip_y_bottom = np.median(hip_cy.values) if len(hip_cy) else 0.0
-        knee_y_bottom = np.median(((df_lm.loc[bottom_idx, "LK_y"] + df_lm.loc[bottom_idx, "RK_y"]) / 2.0).values) if len(bottom_idx) else 0.0
-
         depth_ok = False
         if min_knee < self.KNEE_MIN_ANGLE:
             depth_ok = True
@@ -325,6 +307,107 @@ class SquatEvaluator:
         return EvalResult(ok, float(score), msgs)
 
 
+class StreamingSquatEvaluator(SquatEvaluator):
+    """
+    Mismas reglas que SquatEvaluator pero consumiendo frames de a uno (o por
+    lotes) con memoria constante. Por frame se guardan solo 5 números
+    (pies/hombros, rodilla media, inclinación de tronco, y de cadera y
+    rodilla) en un reservorio uniforme de `capacity` filas (algoritmo R);
+    el mínimo de rodilla se lleva exacto. Al cerrar se aplican las mismas
+    medianas y percentiles sobre el reservorio.
+
+    Mientras el video tenga <= capacity frames el reservorio los contiene
+    todos y el resultado es idéntico al batch. Con más frames, por la cota
+    DKW el percentil empírico de k muestras cae a menos de
+    sqrt(ln(2/δ) / 2k) del verdadero con probabilidad 1-δ: con k=4096 y
+    δ=0.01, ±2.5 puntos percentiles (p.ej. el p15 de rodilla queda entre
+    p12.5 y p17.5 del video completo). El p25 de tronco se toma solo sobre
+    los frames bottom (~15% del reservorio, ~600 muestras): ±6.6 puntos.
+    """
+
+    def __init__(self, capacity=4096, seed=0):
+        self.capacity = capacity
+        self.rng = np.random.default_rng(seed)
+        self.sample = np.empty((capacity, 5))
+        self.seen = 0
+        self.min_knee = np.inf
+
+    def update(self, landmarks):
+        """ Un frame con pose: arreglo (33, 3|4) del motor de pose. """
+        self.update_batch(np.asarray(landmarks)[None])
+
+    def update_batch(self, landmarks):
+        """ Varios frames con pose: arreglo (n, 33, 3|4). """
+        lm = np.asarray(landmarks, dtype=np.float64)
+        if not len(lm):
+            return
+        names, angles = batch_angles(lm, ANGLE_DEFS, dims=3)
+        angles = np.round(angles, 3)
+        knee = angles[:, [i for i, n in enumerate(names) if "knee" in n]].mean(axis=1)
+        # Igual que el dropna de process_video: sin todos los ángulos no cuenta como frame de rodilla
+        knee[np.isnan(angles).any(axis=1)] = np.nan
+
+        def pt(key, d):
+            return lm[:, LM_KEYS[key].value, d]
+
+        ratio = np.clip(np.abs(pt("RFI", 0) - pt("LFI", 0)) / (np.abs(pt("RS", 0) - pt("LS", 0)) + 1e-6), 0, 5)
+        hip_cy = (pt("LH", 1) + pt("RH", 1)) / 2.0
+        trunk = _trunk_tilt_deg((pt("LS", 0) + pt("RS", 0)) / 2.0, (pt("LS", 1) + pt("RS", 1)) / 2.0,
+                                (pt("LH", 0) + pt("RH", 0)) / 2.0, hip_cy)
+        knee_cy = (pt("LK", 1) + pt("RK", 1)) / 2.0
+        rows = np.column_stack([ratio, knee, trunk, hip_cy, knee_cy])
+
+        if not np.isnan(knee).all():
+            self.min_knee = min(self.min_knee, float(np.nanmin(knee)))
+        self._reservoir(rows)
+
+    def _reservoir(self, rows):
+        n = len(rows)
+        fill = min(n, max(0, self.capacity - self.seen))
+        self.sample[self.seen:self.seen + fill] = rows[:fill]
+        if fill < n:
+            # Algoritmo R: la fila t (0-based) reemplaza un slot al azar con prob. capacity/(t+1)
+            t = self.seen + np.arange(fill, n)
+            slots = self.rng.integers(0, t + 1)
+            for i in np.flatnonzero(slots < self.capacity):
+                self.sample[slots[i]] = rows[fill + i]
+        self.seen += n
+
+    def result(self) -> EvalResult:
+        sample = self.sample[:min(self.seen, self.capacity)]
+        knee = sample[:, 1]
+        valid = sample[~np.isnan(knee)]
+        if not len(valid):
+            return EvalResult(False, 0.0, ["No se detectó pose suficiente para evaluar."])
+
+        ratio = np.median(sample[:, 0])
+        thresh = np.percentile(valid[:, 1], self.BOTTOM_PERCENTILE)
+        bottom = valid[valid[:, 1] <= thresh]
+        trunk_stat = np.percentile(bottom[:, 2], self.TRUNK_PERCENTILE)
+        return self.score(ratio, trunk_stat, self.min_knee, np.median(bottom[:, 3]), np.median(bottom[:, 4]))
+
+
+# Frames con pose a partir de los cuales la sentadilla se evalúa en streaming
+STREAM_CAPACITY = 4096
+STREAM_CHUNK = 1024
+
+def evaluate_squat(seq, capacity=STREAM_CAPACITY, chunk=STREAM_CHUNK):
+    """
+    Evalúa la sentadilla de un PoseSequence. Con hasta `capacity` frames
+    con pose arma las tablas de process_video y usa SquatEvaluator (el
+    streaming daría lo mismo). Con más recorre la secuencia en bloques de
+    `chunk` frames con StreamingSquatEvaluator: nunca arma la tabla
+    completa, y con la caché de landmarks los arreglos son memory-mapped.
+    """
+    if int(np.count_nonzero(seq.detected)) <= capacity:
+        return SquatEvaluator().evaluate(*sequence_tables(seq))
+    evaluator = StreamingSquatEvaluator(capacity)
+    for i in range(0, len(seq), chunk):
+        part = seq[i:i + chunk]
+        evaluator.update_batch(part.landmarks[part.detected])
+    return evaluator.result()
+
+
 if __name__ == "__main__":
     # Validación de rutas
     csv_path = Path(CSV_PATH).expanduser().resolve()
@@ -334,13 +417,17 @@ if __name__ == "__main__":
     if not vid_path.exists():
         raise FileNotFoundError(f"No existe el video: {vid_path}")
 
-    # 1) Entrenamiento del modelo
-    print(f"[INFO] Entrenando clasificador con: {csv_path}")
-    model, feat_cols = train_model(str(csv_path))
+    # 1) Clasificador: se entrena solo si el dataset cambió desde el último artefacto
+    from app.services.classifier import load_artifact, train_and_save
+    print(f"[INFO] Clasificador para: {csv_path}")
+    artifact = load_artifact(train_and_save(str(csv_path)))
+    model, feat_cols = artifact["model"], artifact["feat_cols"]
+    print(f"[INFO] Artefacto v{artifact['version']} (dataset {artifact['dataset_sha256'][:12]})")
 
     # 2) Procesamiento del video nuevo
     print(f"[INFO] Procesando video: {vid_path}")
-    df_angles, df_lm = process_video(str(vid_path), skip=SKIP_FRAMES)
+    seq = load_landmarks(str(vid_path), pose_settings(SKIP_FRAMES))
+    df_angles, _ = sequence_tables(seq)
     print(f"[INFO] Frames válidos con pose: {len(df_angles)}")
     if df_angles.empty:
         print("[ERROR] MediaPipe no detectó pose suficiente en el video.")
@@ -376,8 +463,7 @@ if __name__ == "__main__":
 
     if should_eval_squat:
         print("\n=== EVALUACIÓN DE SENTADILLA ===")
-        evaluator = SquatEvaluator()
-        result = evaluator.evaluate(df_angles, df_lm)
+        result = evaluate_squat(seq)
         for m in result.messages:
             print(m)
     else:
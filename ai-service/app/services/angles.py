@@ -0,0 +1,54 @@
+"""
+Cálculo vectorizado de ángulos articulares.
+
+En vez de calcular un ángulo por articulación y por frame, se calculan
+todos los ángulos de todos los frames en una sola llamada sobre arreglos
+(frames, joints, dims). Los vectores degenerados (magnitud 0 o NaN)
+devuelven NaN, igual que compute_angle.
+"""
+
+import numpy as np
+
+
+def angles_between(a, b, c):
+    """
+    Ángulo ∠ABC en grados para arreglos (..., dims).
+    Devuelve un arreglo con la forma de entrada sin la última dimensión.
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    c = np.asarray(c, dtype=np.float64)
+    ba = a - b
+    bc = c - b
+    nba = np.sqrt(np.einsum("...d,...d->...", ba, ba))
+    nbc = np.sqrt(np.einsum("...d,...d->...", bc, bc))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cos_ang = np.einsum("...d,...d->...", ba, bc) / (nba * nbc)
+    ang = np.degrees(np.arccos(np.clip(cos_ang, -1.0, 1.0)))
+    return np.where((nba == 0) | (nbc == 0), np.nan, ang)
+
+
+def angle_index_table(angle_defs):
+    """
+    Convierte una tabla {nombre: (p1, p2, p3)} (índices o PoseLandmark)
+    en (nombres, arreglo int (K, 3)).
+    """
+    names = list(angle_defs.keys())
+    idx = np.array([[int(p) for p in angle_defs[n]] for n in names], dtype=np.intp).reshape(-1, 3)
+    return names, idx
+
+
+def batch_angles(points, angle_defs, dims=None):
+    """
+    Calcula todos los ángulos de `angle_defs` para todos los frames.
+      - points: arreglo (frames, joints, D); se usan las primeras `dims`
+        coordenadas (todas si dims es None).
+      - angle_defs: {nombre: (p1, p2, p3)} con el vértice en p2.
+    Devuelve (nombres, arreglo float64 (frames, K)).
+    """
+    points = np.asarray(points)
+    if dims is not None:
+        points = points[..., :dims]
+    names, idx = angle_index_table(angle_defs)
+    ang = angles_between(points[:, idx[:, 0]], points[:, idx[:, 1]], points[:, idx[:, 2]])
+    return names, ang
@@ -0,0 +1,322 @@
+"""
+Artefacto versionado del clasificador de ejercicios.
+
+Se entrena una vez y se guarda (joblib, sin compresión) junto con el
+orden de `feat_cols`, el hash del dataset y
+la versión. En el worker se carga perezosamente una sola vez por proceso y
+se reutiliza entre jobs; clasificar cuesta milisegundos en vez de un
+entrenamiento completo. Los artefactos cuyo esquema de features no
+coincide con extract_basic_features(ANGLE_DEFS) se rechazan.
+
+Uso:
+    python -m app.services.classifier train --csv angulos_dataset.csv
+    python -m app.services.classifier train --csv angulos_dataset/   (salida de dataset_builder)
+    python -m app.services.classifier info
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from app.services.analizar_postura import ANGLE_DEFS, CONFIDENCE_THRESHOLD, LOWER_BODY, UPPER_BODY, train_model
+
+ARTIFACT_FORMAT = 1
+MODEL_DIR = Path(os.getenv("CLASSIFIER_DIR", Path(__file__).resolve().parents[2] / "models"))
+MODEL_PATH = os.getenv("CLASSIFIER_PATH")  # fija un artefacto concreto; si no, el de mayor versión
+# Clasificación en streaming: frames mínimos antes de opinar y chequeos
+# consecutivos con el mismo top-1 sobre el umbral para darla por decidida
+CLASSIFY_MIN_FRAMES = int(os.getenv("CLASSIFY_MIN_FRAMES", "30"))
+CLASSIFY_STABLE_CHECKS = int(os.getenv("CLASSIFY_STABLE_CHECKS", "3"))
+_NAME_RE = re.compile(r"exercise_clf-v(\d+)\.joblib$")
+
+def feature_columns(angle_cols=None):
+    """ Nombres de features que produce extract_basic_features, en su orden. """
+    angle_cols = list(ANGLE_DEFS.keys()) if angle_cols is None else list(angle_cols)
+    cols = [f"{c}_{stat}" for c in angle_cols for stat in ("mean", "std", "rng")]
+    return cols + ["upper_body_range_mean", "lower_body_range_mean", "lower_minus_upper_range"]
+
+
+def dataset_hash(path):
+    """ SHA-256 del CSV; para un directorio de dataset_builder, el de su manifiesto. """
+    path = Path(path)
+    if path.is_dir():
+        path = path / "manifest.jsonl"
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _versions(model_dir):
+    out = []
+    for p in Path(model_dir).glob("exercise_clf-v*.joblib"):
+        m = _NAME_RE.search(p.name)
+        if m:
+            out.append((int(m.group(1)), p))
+    return sorted(out)
+
+
+def latest_artifact(model_dir=MODEL_DIR):
+    if MODEL_PATH:
+        return Path(MODEL_PATH)
+    versions = _versions(model_dir)
+    return versions[-1][1] if versions else None
+
+
+def check_schema(artifact):
+    """ Lanza ValueError si el artefacto no sirve con el extractor de features actual. """
+    if artifact.get("format") != ARTIFACT_FORMAT:
+        raise ValueError(f"Formato de artefacto no soportado: {artifact.get('format')}")
+    expected = set(feature_columns())
+    got = set(artifact["feat_cols"])
+    if got != expected:
+        missing, extra = sorted(expected - got), sorted(got - expected)
+        raise ValueError(f"Esquema de features incompatible (faltan {missing}, sobran {extra})")
+
+
+def save_artifact(model, feat_cols, data_hash, model_dir=MODEL_DIR):
+    """ Guarda el modelo como exercise_clf-v<N+1>.joblib y devuelve la ruta. """
+    import joblib
+    import sklearn
+
+    model_dir = Path(model_dir)
+    model_dir.mkdir(parents=True, exist_ok=True)
+    versions = _versions(model_dir)
+    version = versions[-1][0] + 1 if versions else 1
+    artifact = {
+        "format": ARTIFACT_FORMAT,
+        "version": version,
+        "model": model,
+        "feat_cols": list(feat_cols),
+        "dataset_sha256": data_hash,
+        "sklearn_version": sklearn.__version__,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    check_schema(artifact)
+    path = model_dir / f"exercise_clf-v{version}.joblib"
+    tmp = path.with_suffix(".tmp")
+    joblib.dump(artifact, tmp)  # sin compresión: se carga más rápido
+    os.replace(tmp, path)
+    return path
+
+
+def train_and_save(csv_path, model_dir=MODEL_DIR):
+    """ Entrena desde el CSV y guarda el artefacto; si el dataset no cambió, reutiliza el último. """
+    data_hash = dataset_hash(csv_path)
+    latest = latest_artifact(model_dir)
+    if latest is not None and latest.exists():
+        try:
+            current = load_artifact(latest)
+            if current["dataset_sha256"] == data_hash:
+                return latest
+        except ValueError:
+            pass
+    model, feat_cols = train_model(csv_path)
+    return save_artifact(model, feat_cols, data_hash, model_dir)
+
+
+def load_artifact(path):
+    """
+    Carga un artefacto y valida su esquema. Sin mmap_mode: los árboles de
+    RandomForest copian sus nodos al deserializarse, así que el modelo
+    queda en memoria del proceso de todas formas.
+
+    Un artefacto que no se puede deserializar (falta scikit-learn/joblib o
+    la versión no es compatible) se reporta como ValueError, igual que un
+    esquema incompatible.
+    """
+    try:
+        import joblib
+        artifact = joblib.load(path)
+    except (ImportError, AttributeError) as e:
+        raise ValueError(f"No se pudo cargar el clasificador {path}: {e} (ver scikit-learn/joblib en requirements.txt)") from e
+    check_schema(artifact)
+    return artifact
+
+
+_loaded = None
+_lock = threading.Lock()
+
+def get_classifier():
+    """
+    (modelo, feat_cols) del artefacto vigente, cargado una vez por proceso.
+    Lanza FileNotFoundError si no hay artefacto entrenado y ValueError si
+    no se puede usar (esquema o dependencias).
+    """
+    global _loaded
+    with _lock:
+        if _loaded is None:
+            path = latest_artifact()
+            if path is None or not path.exists():
+                raise FileNotFoundError(f"No hay clasificador entrenado en {MODEL_DIR} (ver 'python -m app.services.classifier train')")
+            artifact = load_artifact(path)
+            _loaded = (artifact["model"], artifact["feat_cols"])
+        return _loaded
+
+
+# --- CLASIFICACIÓN EN LOTE Y EN STREAMING ---
+
+def _features_from_stats(n, mean, m2, vmin, vmax):
+    """
+    Matriz (V, features) en el orden de feature_columns() a partir de
+    estadísticos por video (arreglos (V, K) en el orden de ANGLE_DEFS).
+    Mismos valores que extract_basic_features (std con ddof=0).
+    """
+    n = np.asarray(n, dtype=np.float64).reshape(-1, 1)
+    std = np.sqrt(np.maximum(m2 / np.maximum(n, 1.0), 0.0))
+    rng = vmax - vmin
+    per_angle = np.stack([mean, std, rng], axis=2).reshape(len(n), -1)
+    cols = list(ANGLE_DEFS.keys())
+    upper = rng[:, [cols.index(c) for c in UPPER_BODY]].mean(axis=1)
+    lower = rng[:, [cols.index(c) for c in LOWER_BODY]].mean(axis=1)
+    return np.column_stack([per_angle, upper, lower, lower - upper])
+
+
+def _as_angle_array(video):
+    """ df_angles de process_video o arreglo (frames, K) → float64 sin filas con NaN. """
+    if isinstance(video, pd.DataFrame):
+        video = video[list(ANGLE_DEFS.keys())].to_numpy(dtype=np.float64)
+    arr = np.asarray(video, dtype=np.float64).reshape(-1, len(ANGLE_DEFS))
+    return arr[~np.isnan(arr).any(axis=1)]
+
+
+def batch_features(videos, feat_cols):
+    """
+    Features de muchos videos a la vez, en el orden `feat_cols` del modelo.
+    Concatena todos los frames y reduce por tramos (np.*.reduceat). Los
+    videos sin frames válidos quedan como fila NaN.
+    """
+    arrays = [_as_angle_array(v) for v in videos]
+    lengths = np.array([len(a) for a in arrays])
+    valid = lengths > 0
+    out = np.full((len(arrays), len(feature_columns())), np.nan)
+    if valid.any():
+        data = np.concatenate([a for a in arrays if len(a)])
+        counts = lengths[valid]
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        mean = np.add.reduceat(data, starts, axis=0) / counts[:, None]
+        dev = data - np.repeat(mean, counts, axis=0)
+        m2 = np.add.reduceat(dev * dev, starts, axis=0)
+        vmin = np.minimum.reduceat(data, starts, axis=0)
+        vmax = np.maximum.reduceat(data, starts, axis=0)
+        out[valid] = _features_from_stats(counts, mean, m2, vmin, vmax)
+    order = [feature_columns().index(c) for c in feat_cols]
+    return out[:, order]
+
+
+def _topk(classes, probs, k):
+    order = np.argsort(probs)[::-1][:k]
+    return [(classes[i], float(probs[i])) for i in order]
+
+
+def predict_batch(model, feat_cols, videos, k=3):
+    """
+    Como predict_topk pero para muchos videos con una sola llamada al
+    modelo. Devuelve [(pred, conf, topk)]; (None, None, []) si un video
+    no tiene frames con pose.
+    """
+    X = batch_features(videos, feat_cols)
+    valid = ~np.isnan(X).any(axis=1)
+    results = [(None, None, [])] * len(X)
+    if valid.any():
+        probs = model.predict_proba(pd.DataFrame(X[valid], columns=feat_cols))
+        for i, p in zip(np.flatnonzero(valid), probs):
+            topk = _topk(model.classes_, p, k)
+            results[i] = (topk[0][0], topk[0][1], topk)
+    return results
+
+
+class StreamingClassifier:
+    """
+    Clasifica mientras llegan los frames: mantiene media, M2, mínimo y
+    máximo por ángulo (actualización por lotes con la fórmula de Chan) y en
+    cada update vuelve a predecir. Queda decidida (`done`) cuando el mismo
+    top-1 supera `threshold` en `stable_checks` chequeos seguidos; después
+    ya no consulta el modelo.
+    """
+
+    def __init__(self, model, feat_cols, threshold=CONFIDENCE_THRESHOLD,
+                 stable_checks=CLASSIFY_STABLE_CHECKS, min_frames=CLASSIFY_MIN_FRAMES):
+        self.model = model
+        self.feat_cols = list(feat_cols)
+        self.order = [feature_columns().index(c) for c in feat_cols]
+        self.threshold = threshold
+        self.stable_checks = stable_checks
+        self.min_frames = min_frames
+        k = len(ANGLE_DEFS)
+        self.n = 0
+        self.mean = np.zeros(k)
+        self.m2 = np.zeros(k)
+        self.vmin = np.full(k, np.inf)
+        self.vmax = np.full(k, -np.inf)
+        self.label, self.conf, self.topk = None, None, []
+        self.streak = 0
+        self.done = False
+
+    def update(self, angles):
+        """ Agrega frames (arreglo (m, K) en el orden de ANGLE_DEFS); devuelve `done`. """
+        arr = _as_angle_array(angles)
+        if len(arr):
+            m = len(arr)
+            mb = arr.mean(axis=0)
+            delta = mb - self.mean
+            total = self.n + m
+            self.m2 += ((arr - mb) ** 2).sum(axis=0) + delta ** 2 * (self.n * m / total)
+            self.mean += delta * (m / total)
+            self.n = total
+            np.minimum(self.vmin, arr.min(axis=0), out=self.vmin)
+            np.maximum(self.vmax, arr.max(axis=0), out=self.vmax)
+        if not self.done and self.n >= self.min_frames and len(arr):
+            self._check()
+        return self.done
+
+    def features(self):
+        x = _features_from_stats([self.n], self.mean[None], self.m2[None], self.vmin[None], self.vmax[None])
+        return x[:, self.order]
+
+    def _check(self):
+        topk = _topk(self.model.classes_, self.model.predict_proba(pd.DataFrame(self.features(), columns=self.feat_cols))[0], 3)
+        label, conf = topk[0]
+        if conf >= self.threshold:
+            self.streak = self.streak + 1 if label == self.label else 1
+        else:
+            self.streak = 0
+        self.label, self.conf, self.topk = label, conf, topk
+        self.done = self.streak >= self.stable_checks
+
+    def result(self):
+        """ (pred, conf, topk) con lo visto hasta ahora; fuerza una predicción si aún no hubo. """
+        if self.n and not self.done:
+            self._check()
+        return self.label, self.conf, self.topk
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clasificador de ejercicios")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_train = sub.add_parser("train", help="entrena y guarda un artefacto versionado")
+    p_train.add_argument("--csv", required=True)
+    p_train.add_argument("--out", default=str(MODEL_DIR))
+    p_info = sub.add_parser("info", help="muestra el artefacto vigente")
+    p_info.add_argument("--dir", default=str(MODEL_DIR))
+    args = parser.parse_args()
+
+    if args.cmd == "train":
+        t0 = time.perf_counter()
+        path = train_and_save(args.csv, args.out)
+        print(f"[INFO] Artefacto: {path} ({time.perf_counter() - t0:.1f}s)")
+    else:
+        path = latest_artifact(args.dir)
+        if path is None:
+            raise SystemExit(f"[ERROR] No hay artefactos en {args.dir}")
+        a = load_artifact(path)
+        print(f"[INFO] {path}\n  versión {a['version']} · sklearn {a['sklearn_version']} · {a['created_at']}")
+        print(f"  dataset sha256 {a['dataset_sha256']}\n  clases {list(a['model'].classes_)}")
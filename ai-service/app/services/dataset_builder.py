@@ -0,0 +1,169 @@
+"""
+Genera el dataset de ángulos (entrada de train_model) desde carpetas de videos.
+
+Estructura esperada:
+    videos/
+      Sentadilla/sentadilla1.mp4
+      Flexion/flexion_03.mov
+      ...
+La carpeta es la etiqueta. Cada video se procesa con process_video en un
+pool de procesos y sus ángulos por frame se escriben en un archivo parte
+propio (Parquet; CSV solo si falta pyarrow) dentro de `<out>/parts/`. Al
+terminar cada video se agrega una línea a `<out>/manifest.jsonl`; al
+relanzar se saltan los videos ya registrados con el mismo tamaño, mtime,
+paso y definición de ángulos, así un corte a mitad no obliga a empezar de
+nuevo y un cambio en ANGLE_DEFS rehace todo. train_model/classifier
+aceptan el directorio `<out>` directamente.
+
+Uso:
+    python -m app.services.dataset_builder videos/ --out angulos_dataset --procs 4
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from pathlib import Path
+
+from app.services.analizar_postura import ANGLE_DEFS, SKIP_FRAMES, process_video
+
+VIDEO_EXTS = {".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v"}
+DATASET_WORKERS = int(os.getenv("DATASET_WORKERS", "0"))  # 0 = uno por núcleo
+MANIFEST = "manifest.jsonl"
+
+
+def schema_hash():
+    """ Identifica la definición de ángulos con la que se generaron las partes. """
+    spec = {name: [int(p.value) for p in pts] for name, pts in ANGLE_DEFS.items()}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _columnar():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def find_videos(root):
+    """ [(label, ruta)] de root/<label>/<video>, en orden estable. """
+    root = Path(root)
+    out = []
+    for label_dir in sorted(p for p in root.iterdir() if p.is_dir()):
+        for video in sorted(label_dir.rglob("*")):
+            if video.is_file() and video.suffix.lower() in VIDEO_EXTS:
+                out.append((label_dir.name, video))
+    return out
+
+
+def _video_id(root, path):
+    return Path(path).relative_to(root).as_posix()
+
+
+def _fingerprint(path, skip):
+    st = Path(path).stat()
+    return {"size": st.st_size, "mtime": int(st.st_mtime), "skip": skip, "schema": schema_hash()}
+
+
+def load_manifest(out_dir):
+    """ {video_id: entrada} con la última entrada registrada por video. """
+    done = {}
+    path = Path(out_dir) / MANIFEST
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # línea truncada por un corte: ese video se rehace
+                done[entry["video"]] = entry
+    return done
+
+
+def _process_one(args):
+    """ Corre en el pool: procesa un video y escribe su parte de forma atómica. """
+    video_id, label, path, part, skip = args
+    t0 = time.perf_counter()
+    # Cada proceso corre un solo estimador: sin tramos en paralelo dentro del video
+    df_angles, _ = process_video(str(path), skip=skip, workers=1)
+    df = df_angles.reset_index()  # columna `frame`: número de frame en el video
+    df.insert(0, "label", label)
+    df.insert(0, "video", video_id)
+
+    part = Path(part)
+    tmp = part.with_name(part.name + ".tmp")
+    if part.suffix == ".parquet":
+        df.to_parquet(tmp, index=False)
+    else:
+        df.to_csv(tmp, index=False)
+    os.replace(tmp, part)
+    return {"rows": len(df), "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def build_dataset(root, out_dir, procs=DATASET_WORKERS, skip=SKIP_FRAMES, force=False):
+    """ Procesa los videos pendientes; devuelve un resumen con throughput. """
+    root, out_dir = Path(root), Path(out_dir)
+    parts_dir = out_dir / "parts"
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    ext = ".parquet" if _columnar() else ".csv"
+
+    done = {} if force else load_manifest(out_dir)
+    pending = []
+    for label, path in find_videos(root):
+        vid = _video_id(root, path)
+        fp = _fingerprint(path, skip)
+        prev = done.get(vid)
+        if prev and all(prev.get(k) == v for k, v in fp.items()) and (parts_dir / prev["part"]).exists():
+            continue
+        part = f"{hashlib.sha256(vid.encode()).hexdigest()[:16]}{ext}"
+        pending.append((vid, label, path, parts_dir / part, skip, fp))
+
+    total = len(pending)
+    print(f"[INFO] {total} videos pendientes ({len(done)} ya en el manifiesto)")
+    stats = {"videos": 0, "failed": 0, "rows": 0, "seconds": 0.0}
+    if not total:
+        return stats
+
+    t0 = time.perf_counter()
+    workers = procs or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=min(workers, total), mp_context=get_context("spawn")) as pool, \
+            open(out_dir / MANIFEST, "a", encoding="utf-8") as manifest:
+        futures = {pool.submit(_process_one, job[:5]): job for job in pending}
+        for fut in as_completed(futures):
+            vid, label, _, part, _, fp = futures[fut]
+            try:
+                res = fut.result()
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"[ERROR] {vid}: {e}")
+                continue
+            entry = {"video": vid, "label": label, "part": part.name, **fp, **res}
+            manifest.write(json.dumps(entry) + "\n")
+            manifest.flush()
+            stats["videos"] += 1
+            stats["rows"] += res["rows"]
+            elapsed = time.perf_counter() - t0
+            print(f"[{stats['videos'] + stats['failed']}/{total}] {vid}: {res['rows']} frames en {res['seconds']:.1f}s "
+                  f"· {stats['videos'] / elapsed:.2f} videos/s, {stats['rows'] / elapsed:.0f} frames/s")
+
+    stats["seconds"] = round(time.perf_counter() - t0, 3)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construye el dataset de ángulos desde carpetas de videos")
+    parser.add_argument("root", help="carpeta con una subcarpeta por etiqueta")
+    parser.add_argument("--out", default="angulos_dataset", help="directorio de salida (partes + manifiesto)")
+    parser.add_argument("--procs", type=int, default=DATASET_WORKERS, help="procesos (0 = uno por núcleo)")
+    parser.add_argument("--skip", type=int, default=SKIP_FRAMES, help="procesar 1 de cada N frames")
+    parser.add_argument("--force", action="store_true", help="ignorar el manifiesto y rehacer todo")
+    args = parser.parse_args()
+
+    s = build_dataset(args.root, args.out, procs=args.procs, skip=args.skip, force=args.force)
+    if s["seconds"]:
+        print(f"[INFO] {s['videos']} videos ({s['failed']} con error), {s['rows']} frames en {s['seconds']:.1f}s "
+              f"· {s['videos'] / s['seconds']:.2f} videos/s, {s['rows'] / s['seconds']:.0f} frames/s")
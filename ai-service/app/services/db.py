@@ -1,10 +1,54 @@
+"""
+Capa de base de datos compartida por la API y el worker.
+
+El pool se dimensiona según el rol del proceso (DB_ROLE):
+  - api:    varias requests concurrentes por proceso (pool 5 + 10 extra).
+  - worker: un SimpleWorker corre un job a la vez y escribe de a una
+            sentencia; le alcanza una conexión (pool 1 + 1 extra).
+DB_POOL_SIZE / DB_MAX_OVERFLOW pisan esos valores.
+
+Las rutas de la API son async: usan get_async_db (AsyncSession sobre
+psycopg async, el mismo driver de psycopg que el worker) con un pool
+propio del event loop del proceso, dimensionado igual que el síncrono.
+
+Cada transición del job es una sola sentencia en autocommit, escrita en
+el momento: 'running' con mark_running, 'succeeded' con save_result y
+'failed' con mark_failed.
+"""
+
 import os
-from sqlalchemy import create_engine
+
+from sqlalchemy import create_engine, exc, make_url, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
+
 load_dotenv()
+
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+if not DATABASE_URL:
+    raise ValueError("❌ Error: DATABASE_URL no encontrada en el archivo .env")
+
+DB_ROLE = os.getenv("DB_ROLE", "api")
+POOL_DEFAULTS = {
+    "api": {"pool_size": 5, "max_overflow": 10, "pool_pre_ping": True},
+    # En el worker no se hace ping en cada checkout (un round-trip más por
+    # escritura); las conexiones caídas se reintentan en execute_write
+    "worker": {"pool_size": 1, "max_overflow": 1, "pool_pre_ping": False},
+}
+
+
+def pool_options(role=DB_ROLE):
+    opts = dict(POOL_DEFAULTS.get(role, POOL_DEFAULTS["api"]))
+    if os.getenv("DB_POOL_SIZE"):
+        opts["pool_size"] = int(os.getenv("DB_POOL_SIZE"))
+    if os.getenv("DB_MAX_OVERFLOW"):
+        opts["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW"))
+    opts["pool_recycle"] = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    return opts
+
+
+engine = create_engine(DATABASE_URL, **pool_options())
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
 def get_db():
@@ -13,3 +57,76 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def async_url(url=DATABASE_URL):
+    """ Misma base con el driver async de psycopg (postgresql+psycopg). """
+    return make_url(url).set(drivername="postgresql+psycopg")
+
+
+_async_engine = None
+_AsyncSessionLocal = None
+
+def get_async_engine():
+    """ Engine async del proceso; se crea al primer uso (el worker nunca lo abre). """
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        _async_engine = create_async_engine(async_url(), **pool_options())
+        _AsyncSessionLocal = async_sessionmaker(bind=_async_engine, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+async def get_async_db():
+    get_async_engine()
+    async with _AsyncSessionLocal() as db:
+        yield db
+
+
+def execute_write(statement, params=None):
+    """
+    Ejecuta una sentencia de escritura en autocommit (un solo round-trip,
+    sin BEGIN/COMMIT aparte). Si la conexión del pool estaba caída se
+    reintenta una vez con una nueva.
+    """
+    for attempt in (0, 1):
+        try:
+            with engine.connect() as conn:
+                conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+                return conn.execute(statement, params or {})
+        except exc.DBAPIError as e:
+            if attempt or not e.connection_invalidated:
+                raise
+
+
+# Resultado final del job en una sola sentencia: las CTE que modifican datos
+# se ejecutan siempre, aunque la consulta principal no las lea.
+SAVE_RESULT_SQL = text("""
+    WITH ins AS (
+        INSERT INTO analyses(job_id, exercise, reps, score, details)
+        VALUES (:j, :e, :r, :s, :d)
+        RETURNING job_id
+    ), vid AS (
+        UPDATE video SET analysis = :ana WHERE id = :vid
+        RETURNING id
+    )
+    UPDATE jobs SET status = 'succeeded', updated_at = now() WHERE id = :j
+""")
+
+def save_result(job_id, exercise, reps, score, details_json, video_id=None, video_json=None):
+    """ INSERT en analyses + UPDATE de video (si hay video_id) + job 'succeeded', atómico. """
+    execute_write(SAVE_RESULT_SQL, {
+        "j": job_id, "e": exercise, "r": reps, "s": score, "d": details_json,
+        "vid": video_id, "ana": video_json,
+    })
+
+
+def mark_failed(job_id):
+    """ Job 'failed'. """
+    execute_write(text("UPDATE jobs SET status = 'failed', updated_at = now() WHERE id = :id"), {"id": job_id})
+
+
+# 'running' nunca pisa un estado final: si el job ya terminó, se ignora
+RUNNING_SQL = text("UPDATE jobs SET status = 'running', updated_at = now() WHERE id = :id AND status = 'queued'")
+
+def mark_running(job_id):
+    """ Job 'running' (solo si sigue en 'queued'). """
+    execute_write(RUNNING_SQL, {"id": job_id})
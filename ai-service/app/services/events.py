@@ -0,0 +1,176 @@
+"""
+Eventos de progreso por job (repeticiones y porcentaje procesado).
+
+El worker publica mientras analiza; la API los retransmite por SSE en
+GET /jobs/{job_id}/stream. En Redis cada job tiene un stream
+(`fitai:job:<id>:events`), así un cliente que se conecta tarde recibe lo
+ya publicado y después bloquea esperando lo nuevo. Para pruebas locales
+EVENTS_BACKEND=memory usa un bus en proceso con la misma interfaz.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+
+import redis
+
+from app.services.reps import analyze_reps, resume_row
+from app.services.rq_async import get_blocking_redis, get_redis
+
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "redis")
+EVENTS_TTL = int(os.getenv("EVENTS_TTL_SECONDS", "3600"))
+EVENTS_MAXLEN = 1000
+STREAM_EVENTS = os.getenv("STREAM_EVENTS", "1") not in ("0", "false", "no")
+STREAM_INTERVAL = float(os.getenv("STREAM_INTERVAL_SECONDS", "1.0"))
+
+FINAL_EVENTS = ("done", "failed")
+
+
+def channel(job_id):
+    return f"fitai:job:{job_id}:events"
+
+
+class RedisEventBus:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def publish(self, job_id, event):
+        key = channel(job_id)
+        pipe = self.conn.pipeline(transaction=False)
+        pipe.xadd(key, {"data": json.dumps(event)}, maxlen=EVENTS_MAXLEN, approximate=True)
+        pipe.expire(key, EVENTS_TTL)
+        pipe.execute()
+
+    def read(self, job_id, last_id="0", timeout=15.0):
+        """ Eventos posteriores a `last_id`; bloquea hasta `timeout` s si no hay. Devuelve [(id, evento)]. """
+        res = self.conn.xread({channel(job_id): last_id}, block=int(timeout * 1000), count=100)
+        return self._decode(res)
+
+    async def aread(self, job_id, last_id="0", timeout=15.0):
+        """ Como read, con el cliente async de lecturas bloqueantes (no ocupa un hilo ni el pool de comandos). """
+        res = await get_blocking_redis().xread({channel(job_id): last_id}, block=int(timeout * 1000), count=100)
+        return self._decode(res)
+
+    async def alast_id(self, job_id):
+        """ Id del último evento publicado ("0" si no hay): punto de partida para esperar solo lo nuevo. """
+        res = await get_redis().xrevrange(channel(job_id), count=1)
+        if not res:
+            return "0"
+        entry_id = res[0][0]
+        return entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+
+    @staticmethod
+    def _decode(res):
+        out = []
+        for _, entries in res or []:
+            for entry_id, fields in entries:
+                entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+                data = fields.get(b"data", fields.get("data"))
+                out.append((entry_id, json.loads(data)))
+        return out
+
+
+class InMemoryEventBus:
+    """ Reemplazo en proceso de RedisEventBus (pruebas / desarrollo sin Redis). """
+
+    def __init__(self):
+        self._events = {}
+        self._cond = threading.Condition()
+
+    def publish(self, job_id, event):
+        with self._cond:
+            events = self._events.setdefault(str(job_id), [])
+            events.append((str(len(events) + 1), event))
+            self._cond.notify_all()
+
+    def read(self, job_id, last_id="0", timeout=15.0):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                events = self._events.get(str(job_id), [])
+                pending = events[int(last_id):]
+                remaining = deadline - time.monotonic()
+                if pending or remaining <= 0:
+                    return pending
+                self._cond.wait(remaining)
+
+    async def aread(self, job_id, last_id="0", timeout=15.0):
+        return await asyncio.to_thread(self.read, job_id, last_id, timeout)
+
+    async def alast_id(self, job_id):
+        with self._cond:
+            return str(len(self._events.get(str(job_id), [])))
+
+
+_bus = None
+
+def get_bus():
+    global _bus
+    if _bus is None:
+        if EVENTS_BACKEND == "memory":
+            _bus = InMemoryEventBus()
+        else:
+            _bus = RedisEventBus(redis.from_url(os.getenv("REDIS_URL")))
+    return _bus
+
+
+class RepStreamer:
+    """
+    Callback de progreso para extract_landmarks: cada `interval` segundos
+    cuenta las repeticiones de `spec` (reps.RepSpec) cerradas en los frames
+    ya procesados y las publica junto con el porcentaje. Solo se analiza la
+    cola desde `offset` (la repetición abierta, ver reps.resume_row), no
+    todo lo procesado hasta ahora. Las repeticiones se cierran en el frame
+    donde termina la fase, así lo publicado nunca cambia después.
+    Si el bus falla se desactiva: el streaming nunca hace fallar un job.
+    """
+
+    def __init__(self, job_id, spec, bus=None, interval=STREAM_INTERVAL):
+        self.job_id = job_id
+        self.spec = spec
+        self.bus = bus
+        self.interval = interval
+        self.sent = 0
+        self.offset = 0  # primera fila de la secuencia que falta analizar
+        self.enabled = True
+        self._last = 0.0
+
+    def _publish(self, event):
+        if not self.enabled:
+            return
+        try:
+            (self.bus or get_bus()).publish(self.job_id, event)
+        except Exception as e:
+            print(f"⚠️ Streaming desactivado para job {self.job_id}: {e}")
+            self.enabled = False
+
+    def __call__(self, frames_done, frame_count, snapshot):
+        now = time.monotonic()
+        if not self.enabled or now - self._last < self.interval:
+            return
+        self._last = now
+        self.advance(snapshot())
+        pct = round(100.0 * frames_done / frame_count, 1) if frame_count else None
+        self._publish({"type": "progress", "frames": frames_done, "total": frame_count, "percent": pct})
+
+    def advance(self, seq):
+        """ Publica las repeticiones cerradas en seq[offset:] y corre `offset`. """
+        tail = seq[self.offset:]
+        for item in analyze_reps(tail, self.spec, first_rep=self.sent + 1)["details"]["feedback_list"]:
+            self._publish({"type": "rep", "feedback": item})
+            self.sent += 1
+        self.offset += resume_row(tail, self.spec)
+
+    def emit_reps(self, result):
+        for item in result["details"]["feedback_list"][self.sent:]:
+            self._publish({"type": "rep", "feedback": item})
+            self.sent += 1
+
+    def finish(self, result):
+        self.emit_reps(result)
+        self._publish({"type": "done", "reps": result["reps"], "score": result["score"]})
+
+    def fail(self, message):
+        self._publish({"type": "failed", "error": message})
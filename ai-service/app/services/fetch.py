@@ -0,0 +1,283 @@
+"""
+Descarga de videos a disco local antes de analizarlos.
+
+En vez de pasarle la URL pública a cv2.VideoCapture (donde una pausa de red
+frena la decodificación y un reintento vuelve a bajar todo), el video se
+baja a un directorio local compartido por los jobs del mismo host:
+  - descarga con lecturas por rangos (Range) que se reanudan si se corta,
+  - verificación de tamaño (Content-Length / esperado) y SHA-256 opcional,
+  - caché LRU acotada en tamaño (VIDEO_CACHE_MAX_MB),
+  - lock por archivo para que dos jobs no bajen el mismo video a la vez,
+  - revalidación con ETag / Last-Modified antes de reutilizar un video
+    (si el objeto se sobrescribió se vuelve a bajar, y como la caché de
+    landmarks usa el SHA-256 del archivo, tampoco se reutilizan esos).
+Los analizadores reciben una ruta local, que además permite saltar frames
+barato (segments.py) y hashear para la caché de landmarks.
+
+Cada entrada usa dos archivos de lock:
+  - `.lock`: exclusivo y corto, solo mientras se baja o revalida.
+  - `.lease`: fetch() es un context manager y mientras el job usa el
+    archivo tiene un lock compartido sobre él. Varios jobs del mismo video
+    corren a la vez; evict() solo borra entradas cuyo `.lease` (y `.lock`)
+    puede bloquear en exclusiva sin esperar, así otro ejecutor que comparte
+    VIDEO_CACHE_DIR no borra un video entre el fetch y los
+    cv2.VideoCapture del job (uno por tramo en segments.py). Si el objeto
+    cambió, la versión nueva espera a que terminen los jobs que usan la
+    vieja antes de reemplazarla.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import urlparse
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos, el rename atómico evita archivos corruptos
+    fcntl = None
+
+VIDEO_CACHE_DIR = os.getenv("VIDEO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "fitai-videos"))
+VIDEO_CACHE_MAX_BYTES = int(float(os.getenv("VIDEO_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT_SECONDS", "30"))
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", "3"))
+# Segundos durante los que un video revalidado se reutiliza sin volver a preguntar (0 = siempre)
+VIDEO_REVALIDATE_SECONDS = float(os.getenv("VIDEO_REVALIDATE_SECONDS", "0"))
+CHUNK_SIZE = 1 << 20
+
+
+@dataclass
+class FetchResult:
+    path: Path
+    size: int
+    sha256: str
+    cached: bool
+
+
+def is_remote(source):
+    return urlparse(str(source)).scheme in ("http", "https")
+
+
+class VideoFetcher:
+    def __init__(self, root=VIDEO_CACHE_DIR, max_bytes=VIDEO_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        ext = Path(urlparse(url).path).suffix[:8] or ".bin"
+        return self.root / f"{key}{ext}", self.root / f"{key}.json", self.root / f"{key}.part"
+
+    def _locks(self, key):
+        return self.root / f"{key}.lock", self.root / f"{key}.lease"
+
+    @staticmethod
+    def _flock(fh, mode):
+        if fcntl:
+            fcntl.flock(fh, getattr(fcntl, mode))
+
+    @contextmanager
+    def fetch(self, url, expected_size=None, expected_sha256=None):
+        """
+        Presta el video local (bajándolo o revalidándolo si hace falta)
+        mientras dure el bloque `with`. Lanza RuntimeError si no se puede verificar.
+        """
+        final, meta_path, part = self._paths(url)
+        lock_path, lease_path = self._locks(meta_path.stem)
+        with open(lock_path, "a+") as lock, open(lease_path, "a+") as lease:
+            self._flock(lock, "LOCK_EX")
+            try:
+                result = self._cached(url, final, meta_path, part, expected_size, expected_sha256)
+                if result is None:
+                    result = self._store(url, final, meta_path, part, lease, expected_size, expected_sha256)
+                # Préstamo compartido mientras se usa: otros jobs pueden leerlo, evict() no lo borra
+                self._flock(lease, "LOCK_SH")
+            finally:
+                self._flock(lock, "LOCK_UN")
+            try:
+                if not result.cached:
+                    self.evict(keep=final)
+                yield result
+            finally:
+                self._flock(lease, "LOCK_UN")
+
+    def _store(self, url, final, meta_path, part, lease, expected_size, expected_sha256):
+        size, digest, validators = self._download(url, part)
+        if expected_size is not None and size != int(expected_size):
+            part.unlink(missing_ok=True)
+            raise RuntimeError(f"Tamaño inesperado para {url}: {size} != {expected_size}")
+        if expected_sha256 and digest != expected_sha256.lower():
+            part.unlink(missing_ok=True)
+            raise RuntimeError(f"SHA-256 no coincide para {url}")
+        if final.exists():
+            # Versión vieja: se espera a que la suelten los jobs que la están usando
+            self._flock(lease, "LOCK_EX")
+        os.replace(part, final)
+        meta_path.write_text(json.dumps({"url": url, "size": size, "sha256": digest, "checked_at": time.time(), **validators}))
+        return FetchResult(final, size, digest, cached=False)
+
+    def _cached(self, url, final, meta_path, part, expected_size, expected_sha256):
+        try:
+            meta = json.loads(meta_path.read_text())
+            size = final.stat().st_size
+        except (OSError, ValueError):
+            return None
+        if size != meta["size"] or (expected_size is not None and size != int(expected_size)):
+            return None
+        if expected_sha256 and meta["sha256"] != expected_sha256.lower():
+            return None
+        if not expected_sha256 and not self._still_valid(url, meta, meta_path):
+            part.unlink(missing_ok=True)  # una descarga a medias puede ser de la versión vieja
+            return None
+        os.utime(final)  # marca de uso para el LRU
+        return FetchResult(final, size, meta["sha256"], cached=True)
+
+    def _still_valid(self, url, meta, meta_path):
+        """
+        Pregunta al origen (HEAD condicional) si el objeto cambió desde la
+        descarga. Sin ETag ni Last-Modified guardados no hay cómo saberlo y
+        se vuelve a bajar. Si el origen no responde (red o 5xx) se usa la
+        copia local; un 4xx (p. ej. objeto borrado) la invalida.
+        """
+        if time.time() - meta.get("checked_at", 0) < VIDEO_REVALIDATE_SECONDS:
+            return True
+        etag, modified = meta.get("etag"), meta.get("last_modified")
+        if not etag and not modified:
+            return False
+        req = urllib.request.Request(url, method="HEAD")
+        if etag:
+            req.add_header("If-None-Match", etag)
+        if modified:
+            req.add_header("If-Modified-Since", modified)
+        try:
+            with urllib.request.urlopen(req, timeout=FETCH_TIMEOUT) as resp:
+                same = self._validators(resp) == {k: meta[k] for k in ("etag", "last_modified") if meta.get(k)}
+                length = resp.headers.get("Content-Length")
+                if length and length.isdigit() and int(length) != meta["size"]:
+                    same = False
+        except urllib.error.HTTPError as e:
+            same = e.code == 304 or e.code >= 500
+            if e.code >= 500:
+                print(f"⚠️ No se pudo revalidar {url} (HTTP {e.code}); se usa la copia local")
+        except OSError as e:
+            print(f"⚠️ No se pudo revalidar {url} ({e}); se usa la copia local")
+            same = True
+        if same:
+            meta["checked_at"] = time.time()
+            meta_path.write_text(json.dumps(meta))
+        return same
+
+    @staticmethod
+    def _validators(resp):
+        out = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+        return {k: v for k, v in out.items() if v}
+
+    def _download(self, url, part):
+        """ Baja `url` a `part` reanudando con Range; devuelve (tamaño, sha256, ETag/Last-Modified). """
+        for attempt in range(FETCH_RETRIES + 1):
+            offset = part.stat().st_size if part.exists() else 0
+            h = hashlib.sha256()
+            if offset:
+                with open(part, "rb") as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                        h.update(chunk)
+
+            req = urllib.request.Request(url)
+            if offset:
+                req.add_header("Range", f"bytes={offset}-")
+            try:
+                with urllib.request.urlopen(req, timeout=FETCH_TIMEOUT) as resp:
+                    if offset and resp.status != 206:
+                        # El servidor ignoró el rango: se empieza de cero
+                        offset, h = 0, hashlib.sha256()
+                    total = self._total_size(resp, offset)
+                    validators = self._validators(resp)
+                    with open(part, "ab" if offset else "wb") as out:
+                        for chunk in iter(lambda: resp.read(CHUNK_SIZE), b""):
+                            out.write(chunk)
+                            h.update(chunk)
+                size = part.stat().st_size
+                if total is not None and size != total:
+                    raise OSError(f"descarga incompleta ({size}/{total} bytes)")
+                return size, h.hexdigest(), validators
+            except urllib.error.HTTPError as e:
+                if e.code == 416:  # rango inválido: la parte local no sirve
+                    part.unlink(missing_ok=True)
+                elif e.code < 500:
+                    raise RuntimeError(f"No se pudo descargar {url}: HTTP {e.code}") from e
+                err = e
+            except OSError as e:
+                err = e
+            if attempt < FETCH_RETRIES:
+                time.sleep(min(8, 2 ** attempt))
+        raise RuntimeError(f"No se pudo descargar {url}: {err}")
+
+    @staticmethod
+    def _total_size(resp, offset):
+        content_range = resp.headers.get("Content-Range")
+        if content_range and "/" in content_range:
+            total = content_range.rsplit("/", 1)[1]
+            return int(total) if total.isdigit() else None
+        length = resp.headers.get("Content-Length")
+        return offset + int(length) if length and length.isdigit() else None
+
+    def evict(self, keep=None):
+        """
+        Borra los videos menos usados hasta quedar bajo max_bytes, salteando
+        `keep` y los que algún job tiene prestados (lock compartido de fetch()).
+        """
+        entries = []
+        for meta_path in self.root.glob("*.json"):
+            matches = [p for p in self.root.glob(f"{meta_path.stem}.*")
+                       if p.suffix not in (".json", ".part", ".lock", ".lease")]
+            for video in matches:
+                try:
+                    st = video.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, video, meta_path))
+
+        total = sum(size for _, size, _, _ in entries)
+        for _, size, video, meta_path in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            if video != keep and self._remove_unused(video, meta_path):
+                total -= size
+
+    def _remove_unused(self, video, meta_path):
+        lock_path, lease_path = self._locks(meta_path.stem)
+        with open(lock_path, "a+") as lock, open(lease_path, "a+") as lease:
+            held = []
+            try:
+                for fh in (lock, lease):
+                    if fcntl:
+                        try:
+                            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        except OSError:
+                            return False  # bajándose o en uso por un job
+                        held.append(fh)
+                video.unlink()
+                meta_path.unlink(missing_ok=True)
+                return True
+            except OSError:
+                return False  # en uso (Windows): se intentará en la próxima descarga
+            finally:
+                for fh in held:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+_default_fetcher = None
+
+def fetch_video(url, expected_size=None, expected_sha256=None):
+    """ Context manager: `with fetch_video(url) as fetched:` presta fetched.path durante el bloque. """
+    global _default_fetcher
+    if _default_fetcher is None:
+        _default_fetcher = VideoFetcher()
+    return _default_fetcher.fetch(url, expected_size, expected_sha256)
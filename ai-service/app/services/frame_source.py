@@ -0,0 +1,173 @@
+"""
+Lectura de frames en un hilo productor.
+
+Un hilo decodifica (cap.read), convierte BGR->RGB y opcionalmente reescala
+en buffers preasignados, y los deja en una cola acotada mientras el hilo
+principal corre la inferencia. OpenCV libera el GIL al decodificar y
+convertir, así las dos etapas se solapan de verdad.
+
+Los buffers se reciclan: el frame entregado por el iterador es válido
+hasta pedir el siguiente (pose.process copia la imagen al grafo).
+"""
+
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+PREFETCH_DEPTH = int(os.getenv("POSE_PREFETCH_DEPTH", "4"))
+
+_END = object()
+
+
+def target_size(width, height, max_side):
+    """ (w, h) escalado para que el lado mayor no supere max_side (None = sin cambio). """
+    if not max_side or max(width, height) <= max_side:
+        return width, height
+    scale = max_side / float(max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class FramePrefetcher:
+    """
+    Itera (idx, timestamp_ms, rgb) de `cap` desde el frame `start`.
+      - want(idx) -> bool: frames que hay que decodificar y convertir; el
+        resto solo se avanza con grab(). None = todos.
+      - stop: índice de frame donde cortar (None = hasta el final).
+      - max_side: reescalar para que el lado mayor no supere este valor.
+    """
+
+    def __init__(self, cap, want=None, start=0, stop=None, depth=PREFETCH_DEPTH, max_side=None):
+        self.cap = cap
+        self.want = want
+        self.start = start
+        self.stop = stop
+        self.max_side = max_side
+        self.depth = max(1, depth)
+        self.next_idx = start  # primer frame que el productor no llegó a leer
+
+        self._ready = queue.Queue(maxsize=self.depth)
+        self._free = queue.Queue()
+        self._buffers = []
+        self._halt = threading.Event()
+        self._error = None
+
+        self.decode_seconds = 0.0
+        self.convert_seconds = 0.0
+        self.producer_blocked_seconds = 0.0
+        self.consumer_wait_seconds = 0.0
+        self.starved = 0
+        self.delivered = 0
+
+        self._thread = threading.Thread(target=self._produce, name="frame-prefetch", daemon=True)
+        self._thread.start()
+
+    def _slot(self, shape):
+        """ Toma un buffer libre (o lo crea hasta `depth + 1`) con la forma pedida. """
+        if len(self._buffers) <= self.depth and self._free.empty():
+            self._buffers.append(np.empty(shape, dtype=np.uint8))
+            return len(self._buffers) - 1
+        t0 = time.perf_counter()
+        while True:
+            try:
+                slot = self._free.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self._halt.is_set():
+                    return None
+        self.producer_blocked_seconds += time.perf_counter() - t0
+        if self._buffers[slot].shape != shape:
+            self._buffers[slot] = np.empty(shape, dtype=np.uint8)
+        return slot
+
+    def _put(self, item):
+        t0 = time.perf_counter()
+        while not self._halt.is_set():
+            try:
+                self._ready.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.producer_blocked_seconds += time.perf_counter() - t0
+
+    def _produce(self):
+        bgr = small = None
+        idx = self.start
+        try:
+            while not self._halt.is_set():
+                if self.stop is not None and idx >= self.stop:
+                    break
+                if self.want is not None and not self.want(idx):
+                    if not self.cap.grab():
+                        break
+                    idx += 1
+                    continue
+
+                t0 = time.perf_counter()
+                ok, bgr = self.cap.read(bgr)
+                if not ok:
+                    break
+                ts = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+                t1 = time.perf_counter()
+                self.decode_seconds += t1 - t0
+
+                h, w = bgr.shape[:2]
+                tw, th = target_size(w, h, self.max_side)
+                src = bgr
+                if (tw, th) != (w, h):
+                    if small is None or small.shape[:2] != (th, tw):
+                        small = np.empty((th, tw, 3), dtype=np.uint8)
+                    cv2.resize(bgr, (tw, th), dst=small, interpolation=cv2.INTER_AREA)
+                    src = small
+                self.convert_seconds += time.perf_counter() - t1
+                slot = self._slot(src.shape)
+                if slot is None:
+                    break
+                t2 = time.perf_counter()
+                cv2.cvtColor(src, cv2.COLOR_BGR2RGB, dst=self._buffers[slot])
+                self.convert_seconds += time.perf_counter() - t2
+
+                self._put((idx, ts, slot))
+                idx += 1
+        except Exception as e:  # se relanza en el consumidor
+            self._error = e
+        finally:
+            self.next_idx = idx
+            self._put(_END)
+
+    def __iter__(self):
+        prev = None
+        while True:
+            if prev is not None:
+                self._free.put(prev)
+                prev = None
+            if self._ready.empty():
+                self.starved += 1
+            t0 = time.perf_counter()
+            item = self._ready.get()
+            self.consumer_wait_seconds += time.perf_counter() - t0
+            if item is _END:
+                break
+            idx, ts, prev = item
+            self.delivered += 1
+            yield idx, ts, self._buffers[prev]
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        self._halt.set()
+        self._thread.join(timeout=5)
+
+    def stats(self):
+        """ Métricas de la etapa: tiempos y cuántas veces la inferencia esperó frames. """
+        return {
+            "frames_delivered": self.delivered,
+            "starved": self.starved,
+            "consumer_wait_seconds": round(self.consumer_wait_seconds, 4),
+            "producer_blocked_seconds": round(self.producer_blocked_seconds, 4),
+            "decode_seconds": round(self.decode_seconds, 4),
+            "convert_seconds": round(self.convert_seconds, 4),
+        }
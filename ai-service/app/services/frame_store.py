@@ -0,0 +1,88 @@
+"""
+Almacenamiento compacto por frame.
+
+Un FrameStore es un arreglo NumPy preasignado (float32 por defecto) que
+crece por duplicación, en vez de una lista de arrays/dicts por frame que
+después se apilan en otra copia. Cada fila es un frame; la fila puede ser
+un escalar, un vector con columnas con nombre, o un bloque como (33, 4).
+
+  - `array` / `column(nombre)` son vistas sin copia de las filas escritas.
+  - `to_frame()` arma un DataFrame sobre esas mismas vistas (sin copiar),
+    para código que espera pandas (SquatEvaluator, extract_basic_features).
+  - Las vistas tomadas antes de que el store crezca siguen siendo válidas
+    pero apuntan al buffer anterior: sirven como snapshot, no ven filas nuevas.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class FrameStore:
+    def __init__(self, columns=None, row_shape=None, dtype=np.float32, capacity=256):
+        if columns is not None:
+            self.columns = list(columns)
+            row_shape = (len(self.columns),)
+        else:
+            self.columns = None
+        self.row_shape = tuple(row_shape or ())
+        self._data = np.empty((max(1, int(capacity)),) + self.row_shape, dtype=dtype)
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes
+
+    def reserve(self, capacity):
+        """ Asegura lugar para `capacity` filas (una sola realocación). """
+        if capacity > len(self._data):
+            data = np.empty((int(capacity),) + self.row_shape, dtype=self._data.dtype)
+            data[:self._n] = self._data[:self._n]
+            self._data = data
+
+    def append_rows(self, n):
+        """ Reserva `n` filas al final y devuelve la vista para escribirlas en su lugar. """
+        end = self._n + n
+        if end > len(self._data):
+            self.reserve(max(end, 2 * len(self._data)))
+        block = self._data[self._n:end]
+        self._n = end
+        return block
+
+    def append(self, row):
+        self.append_rows(1)[0] = row
+
+    def extend(self, rows):
+        rows = np.asarray(rows)
+        self.append_rows(len(rows))[:] = rows
+
+    @property
+    def array(self):
+        return self._data[:self._n]
+
+    def column(self, name):
+        return self._data[:self._n, self.columns.index(name)]
+
+    def to_frame(self, columns=None):
+        """ DataFrame sin copia sobre las filas escritas (todas o algunas columnas contiguas). """
+        names = self.columns if columns is None else list(columns)
+        first = self.columns.index(names[0])
+        if self.columns[first:first + len(names)] != names:
+            raise ValueError("to_frame necesita columnas contiguas del store")
+        view = self._data[:self._n, first:first + len(names)]
+        return pd.DataFrame(view, columns=names, copy=False)
+
+    def compact(self):
+        """
+        Arreglo final de las filas escritas: la vista si el buffer está casi
+        lleno, o una copia ajustada si sobra más de un cuarto de la capacidad.
+        """
+        if self._n * 4 >= 3 * len(self._data):
+            return self.array
+        return self.array.copy()
@@ -0,0 +1,167 @@
+"""
+Caché del estado de los jobs en Redis, para que el polling no llegue a Postgres.
+
+Cada job tiene un hash `fitai:job:<id>:status` con status, user_id e
+input_video_url:
+  - la API lo crea en 'queued' al encolar (en el mismo pipeline que RQ);
+  - el worker actualiza `status` en cada transición (publish_status) y
+    publica un evento `status` en el bus de eventos del job;
+  - GET /jobs lo lee primero y solo va a la BD si falta (read-through,
+    sin pisar un estado que el worker ya haya escrito).
+
+Solo los estados finales se creen sin más: si un estado no final
+('queued'/'running') se confirmó hace más de JOB_STATUS_RECHECK_SECONDS
+(`checked_at`), la API lo vuelve a mirar en la BD. Así, si el worker
+guardó el resultado pero no pudo publicar el estado, el cliente lo ve
+en segundos y no cuando vence el hash.
+
+El ETag de una respuesta depende solo del estado, así que un poll con
+If-None-Match responde 304 sin tocar la BD, y `?wait=` espera un evento
+del bus hasta que el estado cambie.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+
+import redis
+
+from app.services.events import FINAL_EVENTS, get_bus
+from app.services.rq_async import get_redis
+
+JOB_STATUS_TTL = int(os.getenv("JOB_STATUS_TTL_SECONDS", "86400"))
+JOB_STATUS_RECHECK = float(os.getenv("JOB_STATUS_RECHECK_SECONDS", "5"))
+FIELDS = ("status", "user_id", "input_video_url", "checked_at")
+FINAL_STATUSES = ("succeeded", "failed")
+WAKE_EVENTS = ("status",) + FINAL_EVENTS
+
+_conn = None
+
+
+def status_key(job_id):
+    return f"fitai:job:{job_id}:status"
+
+
+def stage_status(pipe, job_id, status, user_id=None, input_video_url=None, keep_newer=False):
+    """
+    Agrega a un pipeline (síncrono o de redis.asyncio) la escritura del estado.
+    keep_newer=True (relleno desde la BD) no pisa un status ya escrito por el worker.
+    """
+    key = status_key(job_id)
+    if keep_newer:
+        pipe.hsetnx(key, "status", status)
+    else:
+        pipe.hset(key, "status", status)
+    extra = {k: str(v) for k, v in (("user_id", user_id), ("input_video_url", input_video_url)) if v is not None}
+    extra["checked_at"] = repr(time.time())
+    pipe.hset(key, mapping=extra)
+    pipe.expire(key, JOB_STATUS_TTL)
+
+
+def is_stale(state):
+    """ True si el estado no es final y hace más de JOB_STATUS_RECHECK s que no se confirma. """
+    if state["status"] in FINAL_STATUSES:
+        return False
+    try:
+        checked = float(state.get("checked_at") or 0)
+    except ValueError:
+        checked = 0.0
+    return time.time() - checked > JOB_STATUS_RECHECK
+
+
+def etag(job_id, status, kind="job"):
+    digest = hashlib.sha1(f"{kind}:{job_id}:{status}".encode()).hexdigest()[:16]
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match, tag):
+    if not if_none_match:
+        return False
+    candidates = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return tag in candidates or "*" in candidates
+
+
+# --- WORKER (síncrono) ---
+
+def publish_status(job_id, status):
+    """ Transición de estado desde el worker: caché + evento `status`. Nunca hace fallar el job. """
+    global _conn
+    try:
+        if _conn is None:
+            _conn = redis.from_url(os.getenv("REDIS_URL"))
+        pipe = _conn.pipeline(transaction=False)
+        stage_status(pipe, job_id, status)
+        pipe.execute()
+        get_bus().publish(job_id, {"type": "status", "status": status})
+    except Exception as e:
+        print(f"⚠️ No se pudo publicar el estado '{status}' del job {job_id}: {e}")
+
+
+# --- API (async) ---
+
+async def get_cached(job_id):
+    """ Hash del job con las claves de FIELDS, o None si falta (o Redis no responde). """
+    try:
+        raw = await get_redis().hgetall(status_key(job_id))
+    except Exception:
+        return None
+    data = {k.decode(): v.decode() for k, v in raw.items()}
+    if "status" not in data or "user_id" not in data:
+        return None
+    return data
+
+
+async def cache_status(job_id, status, user_id=None, input_video_url=None, keep_newer=True):
+    """
+    Escribe lo leído de la BD: relleno tras un miss (keep_newer) o un
+    estado final encontrado al reconfirmar (keep_newer=False). En ambos
+    casos renueva checked_at.
+    """
+    try:
+        async with get_redis().pipeline(transaction=True) as pipe:
+            stage_status(pipe, job_id, status, user_id, input_video_url, keep_newer=keep_newer)
+            await pipe.execute()
+    except Exception:
+        pass
+
+
+async def wait_for_change(job_id, known_status, timeout, recheck=None):
+    """
+    Espera hasta `timeout` s a que el estado deje de ser `known_status`,
+    despertando con los eventos del bus del job. `recheck(state)` (async)
+    se llama cuando el estado en caché queda viejo (is_stale), por si la
+    transición nunca se publicó. Devuelve el hash actual (o None).
+    """
+    bus = get_bus()
+    deadline = time.monotonic() + timeout
+    try:
+        last = await bus.alast_id(job_id)
+    except Exception:
+        last = None
+    current = await get_cached(job_id)
+    while current and current["status"] == known_status:
+        if recheck and is_stale(current):
+            current = await recheck(current)
+            continue
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if last is None:
+            # Sin bus: se consulta la caché cada segundo
+            await asyncio.sleep(min(1.0, remaining))
+            current = await get_cached(job_id)
+            continue
+        try:
+            block = min(remaining, JOB_STATUS_RECHECK) if recheck else remaining
+            batch = await bus.aread(job_id, last, timeout=block)
+        except Exception:
+            last = None
+            continue
+        if batch:
+            last = batch[-1][0]
+            if any(event.get("type") in WAKE_EVENTS for _, event in batch):
+                current = await get_cached(job_id)
+        elif recheck:
+            current = await get_cached(job_id) or current
+    return current
@@ -0,0 +1,155 @@
+"""
+Caché en disco de landmarks, direccionada por contenido.
+
+La clave es el hash SHA-256 del video + los parámetros del modelo de pose
+(PoseSettings) sin el muestreo adaptativo, que depende del ejercicio
+(ángulo y banda vigilados). Solo se guardan secuencias sin muestreo
+adaptativo; un pedido con muestreo adaptativo usa la de paso 1 si existe
+(tiene todos los frames que habría inferido) y, si no, extrae sin guardar.
+Así el mismo video con otro ejercicio (o en "auto") no duplica entradas.
+Cada entrada es un directorio con arreglos .npy que se
+abren con memory-map, así un acierto cuesta milisegundos en vez de volver
+a decodificar el video y correr MediaPipe. El tamaño total se acota
+expulsando las entradas menos usadas (LRU por mtime).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import asdict, replace
+from pathlib import Path
+
+import numpy as np
+
+from app.services.pose_engine import PoseSequence, extract_landmarks
+from app.services.segments import extract_landmarks_parallel
+
+CACHE_DIR = os.getenv("LANDMARK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "fitai-landmarks"))
+CACHE_MAX_BYTES = int(float(os.getenv("LANDMARK_CACHE_MAX_MB", "512")) * 1024 * 1024)
+CACHE_ENABLED = os.getenv("LANDMARK_CACHE", "1") not in ("0", "false", "no")
+
+_ARRAYS = ("landmarks", "timestamps", "frame_index", "detected")
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """ SHA-256 del contenido del archivo (hex). """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(digest, settings):
+    """
+    Clave = hash(contenido del video + parámetros del modelo de pose). Con
+    muestreo adaptativo es la clave de la secuencia completa (paso 1).
+    """
+    if settings.sampling is not None:
+        settings = replace(settings, sampling=None, stride=1)
+    params = json.dumps(asdict(settings), sort_keys=True, default=str)
+    return hashlib.sha256(f"{digest}:{params}".encode()).hexdigest()
+
+
+class LandmarkCache:
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key):
+        """ Devuelve el PoseSequence cacheado (arreglos memory-mapped) o None. """
+        entry = self.root / key
+        meta_path = entry / "meta.json"
+        try:
+            meta = json.loads(meta_path.read_text())
+            arrays = {name: np.load(entry / f"{name}.npy", mmap_mode="r") for name in _ARRAYS}
+        except (OSError, ValueError):
+            return None
+        os.utime(meta_path)  # marca de uso para el LRU
+        return PoseSequence(**arrays, fps=meta["fps"], frame_count=meta["frame_count"], stats=meta.get("stats", {}))
+
+    def put(self, key, seq):
+        """ Guarda el PoseSequence de forma atómica y aplica el límite de tamaño. """
+        entry = self.root / key
+        if entry.exists():
+            return
+        tmp = Path(tempfile.mkdtemp(prefix=f".tmp-{key[:12]}-", dir=self.root))
+        try:
+            for name in _ARRAYS:
+                np.save(tmp / f"{name}.npy", np.ascontiguousarray(getattr(seq, name)))
+            meta = {"fps": float(seq.fps), "frame_count": int(seq.frame_count), "stats": seq.stats}
+            (tmp / "meta.json").write_text(json.dumps(meta, default=str))
+            os.replace(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        """ Borra las entradas menos usadas hasta quedar bajo max_bytes. """
+        entries = []
+        for entry in self.root.iterdir():
+            if entry.name.startswith(".tmp-"):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                used = (entry / "meta.json").stat().st_mtime
+            except OSError:
+                continue
+            entries.append((used, size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+_default_cache = None
+
+def default_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = LandmarkCache()
+    return _default_cache
+
+
+def load_landmarks(source, settings, cache=None, workers=1, on_progress=None, digest=None):
+    """
+    extract_landmarks con caché: si `source` es un archivo local se busca
+    primero por (hash del contenido, settings). Las URLs remotas se procesan
+    directamente. Con workers > 1 los archivos locales se extraen por
+    tramos en paralelo (segments.py), con `on_progress` por tramo terminado.
+    Si el SHA-256 del archivo ya se conoce (fetch.py lo calcula al bajar)
+    se pasa en `digest` para no volver a leerlo.
+    """
+    local = os.path.isfile(str(source))
+    if cache is None and CACHE_ENABLED:
+        cache = default_cache()
+
+    def extract():
+        if local and workers > 1:
+            return extract_landmarks_parallel(source, settings, workers=workers, on_progress=on_progress)
+        return extract_landmarks(source, settings, on_progress=on_progress)
+
+    if cache is None or not local:
+        return extract()
+
+    t0 = time.perf_counter()
+    key = cache_key(digest or file_digest(source), settings)
+    seq = cache.get(key)
+    if seq is not None:
+        seq.stats["cache_hit"] = True
+        seq.stats["cache_seconds"] = time.perf_counter() - t0
+        return seq
+
+    seq = extract()
+    seq.stats["cache_hit"] = False
+    if settings.sampling is None:
+        cache.put(key, seq)
+    return seq
@@ -0,0 +1,246 @@
+"""
+Métricas en formato de texto de Prometheus, sin dependencias.
+
+  - API: un middleware en main.py mide la latencia por ruta y GET /metrics
+    expone el registro del proceso.
+  - Worker: run_analysis mide cada etapa del job con JobTimer y cada
+    ejecutor sirve sus métricas en WORKER_METRICS_PORT + slot
+    (start_exporter); Prometheus los scrapea por separado.
+
+Las métricas viven en memoria del proceso: se reinician con él.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9108"))  # 0 = sin exporter
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+FPS_BUCKETS = (1, 5, 10, 15, 30, 60, 120, 240, 480, 1000)
+RATIO_BUCKETS = (0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 1.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _fmt_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_one(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_one(self, key, value):
+        return [f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(value)}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _render_one(self, key, value):
+        return [f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def _render_one(self, key, value):
+        counts, total, n = value
+        lines, acc = [], 0
+        for bound, c in zip(self.buckets, counts):
+            acc += c
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, {'le': _fmt_value(float(bound))})} {acc}")
+        lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(total)}")
+        lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+def render():
+    """ Todas las métricas del proceso en formato de texto de Prometheus. """
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for m in metrics:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- MÉTRICAS DE LA API ---
+
+HTTP_LATENCY = Histogram("fitai_http_request_seconds", "Latencia de la API por ruta", ("method", "route", "status"))
+
+# --- MÉTRICAS DEL WORKER ---
+
+JOB_STAGE = Histogram("fitai_job_stage_seconds", "Duración de cada etapa de un job de análisis", ("stage",))
+JOB_FPS = Histogram("fitai_job_frames_per_second", "Frames de video procesados por segundo de extracción", buckets=FPS_BUCKETS)
+JOB_DETECTION = Histogram("fitai_job_pose_detection_ratio", "Fracción de frames inferidos con pose detectada", buckets=RATIO_BUCKETS)
+JOBS = Counter("fitai_jobs_total", "Jobs terminados por estado", ("status",))
+FRAMES = Counter("fitai_frames_total", "Frames procesados", ("kind",))
+LANDMARK_CACHE = Counter("fitai_landmark_cache_total", "Consultas a la caché de landmarks", ("result",))
+
+
+def queue_wait_seconds(job):
+    """ Tiempo entre el enqueue y el inicio del job de RQ (None fuera de un worker). """
+    enqueued = getattr(job, "enqueued_at", None)
+    if enqueued is None:
+        return None
+    now = datetime.now(timezone.utc) if enqueued.tzinfo else datetime.now(timezone.utc).replace(tzinfo=None)
+    return max(0.0, (now - enqueued).total_seconds())
+
+
+class JobTimer:
+    """ Junta las duraciones de las etapas de un job y las registra al final. """
+
+    def __init__(self):
+        self.stages = {}
+        self.t0 = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def add(self, name, seconds):
+        if seconds is not None:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_pose_stats(self, seq, extract_seconds):
+        """ Etapas, fps y tasa de detección a partir de PoseSequence.stats. """
+        stats = seq.stats
+        cached = stats.get("cache_hit", False)
+        LANDMARK_CACHE.inc(result="hit" if cached else "miss")
+        if cached:
+            self.add("landmark_cache", extract_seconds)
+        else:
+            self.add("extract", extract_seconds)
+            prefetch = stats.get("prefetch", {})
+            self.add("decode", prefetch.get("decode_seconds"))
+            self.add("convert", prefetch.get("convert_seconds"))
+            self.add("inference", stats.get("inference_seconds"))
+            frames = stats.get("frames_total", 0)
+            FRAMES.inc(frames, kind="decoded")
+            FRAMES.inc(stats.get("frames_inferred", 0), kind="inferred")
+            if frames and extract_seconds > 0:
+                JOB_FPS.observe(frames / extract_seconds)
+        if len(seq):
+            JOB_DETECTION.observe(float(seq.detected.mean()))
+
+    def finish(self, status):
+        self.add("total", time.perf_counter() - self.t0)
+        for name, seconds in self.stages.items():
+            JOB_STAGE.observe(seconds, stage=name)
+        JOBS.inc(status=status)
+
+    def summary(self):
+        return " ".join(f"{k}={v:.2f}s" for k, v in self.stages.items())
+
+
+# --- EXPORTER DEL WORKER ---
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_exporter(port):
+    """ Sirve /metrics en un hilo daemon; devuelve el servidor o None si no se pudo. """
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+    except OSError as e:
+        print(f"⚠️ No se pudo abrir el exporter de métricas en :{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+    return server
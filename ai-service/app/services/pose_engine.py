@@ -0,0 +1,286 @@
+"""
+Motor único de extracción de pose.
+
+Decodifica el video una sola vez, corre MediaPipe Pose sobre los frames
+muestreados y devuelve un PoseSequence con los landmarks en un arreglo
+denso (frames, 33, 4) -> (x, y, z, visibility) más sus timestamps.
+Los analizadores de ejercicios consumen ese arreglo en vez de abrir el
+video por su cuenta.
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import cv2
+import numpy as np
+import mediapipe as mp
+
+from app.services import pose_pool
+from app.services.frame_source import FramePrefetcher
+from app.services.frame_store import FrameStore
+from app.services.preprocess import POSE_MAX_SIDE, POSE_ROI, crop, roi_box, roi_keeps, to_full_frame
+from app.services.sampling import AdaptiveSampler, AdaptiveSampling
+
+mp_pose = mp.solutions.pose
+
+NUM_LANDMARKS = 33
+LANDMARK_DIMS = 4  # x, y, z, visibility
+
+
+@dataclass
+class PoseSettings:
+    """ Parámetros del modelo de pose (también forman parte de la clave de caché). """
+    model_complexity: int = 1
+    min_detection_confidence: float = 0.5
+    min_tracking_confidence: float = 0.5
+    stride: int = 1  # inferir 1 de cada N frames (el último de cada bloque)
+    sampling: Optional[AdaptiveSampling] = None  # si se define, reemplaza a stride
+    max_side: int = POSE_MAX_SIDE  # reescalar antes de inferir (0 = tamaño original)
+    roi: bool = POSE_ROI           # recortar a la persona según el frame anterior
+
+
+@dataclass
+class PoseSequence:
+    """
+    Resultado de la extracción:
+      - landmarks:    float32 (n, 33, 4); NaN en frames sin pose detectada.
+      - timestamps:   float64 (n,) en ms (CAP_PROP_POS_MSEC tras leer el frame).
+      - frame_index:  int64 (n,) índice del frame en el video original.
+      - detected:     bool (n,) si MediaPipe devolvió landmarks.
+    """
+    landmarks: np.ndarray
+    timestamps: np.ndarray
+    frame_index: np.ndarray
+    detected: np.ndarray
+    fps: float = 0.0
+    frame_count: int = 0
+    stats: dict = field(default_factory=dict)
+
+    def __len__(self):
+        return len(self.frame_index)
+
+    def __getitem__(self, sl):
+        """ Vista de un rango de frames (sin copiar los arreglos). """
+        if not isinstance(sl, slice):
+            raise TypeError("PoseSequence solo admite slices")
+        return PoseSequence(
+            self.landmarks[sl], self.timestamps[sl], self.frame_index[sl], self.detected[sl],
+            fps=self.fps, frame_count=self.frame_count, stats=self.stats,
+        )
+
+    @classmethod
+    def empty(cls, fps=0.0, frame_count=0):
+        return cls(
+            np.empty((0, NUM_LANDMARKS, LANDMARK_DIMS), dtype=np.float32),
+            np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=bool),
+            fps=fps, frame_count=frame_count,
+        )
+
+
+def landmarks_to_array(pose_landmarks, out=None):
+    """ Copia los landmarks de MediaPipe a un arreglo (33, 4) float32. """
+    if out is None:
+        out = np.empty((NUM_LANDMARKS, LANDMARK_DIMS), dtype=np.float32)
+    for i, lm in enumerate(pose_landmarks.landmark):
+        out[i] = (lm.x, lm.y, lm.z, lm.visibility)
+    return out
+
+
+def video_info(source):
+    """ (fps, frame_count) según los metadatos del contenedor. """
+    cap = cv2.VideoCapture(str(source))
+    if not cap.isOpened():
+        raise RuntimeError(f"No abre video: {source}")
+    try:
+        return cap.get(cv2.CAP_PROP_FPS) or 0.0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    finally:
+        cap.release()
+
+
+def _build_sequence(landmarks, stamps, indices, hits, fps, frame_count, stats=None):
+    """ PoseSequence sobre los arreglos dados (sin copiarlos). """
+    if not len(landmarks):
+        seq = PoseSequence.empty(fps=fps, frame_count=frame_count)
+        seq.stats.update(stats or {})
+        return seq
+    return PoseSequence(
+        np.asarray(landmarks, dtype=np.float32),
+        np.asarray(stamps, dtype=np.float64),
+        np.asarray(indices, dtype=np.int64),
+        np.asarray(hits, dtype=bool),
+        fps=fps, frame_count=frame_count, stats=stats or {},
+    )
+
+
+class _SequenceStore:
+    """ Buffers preasignados de landmarks/timestamps/índices/detección de extract_landmarks. """
+
+    def __init__(self, capacity):
+        self.landmarks = FrameStore(row_shape=(NUM_LANDMARKS, LANDMARK_DIMS), dtype=np.float32, capacity=capacity)
+        self.stamps = FrameStore(dtype=np.float64, capacity=capacity)
+        self.indices = FrameStore(dtype=np.int64, capacity=capacity)
+        self.hits = FrameStore(dtype=bool, capacity=capacity)
+
+    def __len__(self):
+        return len(self.landmarks)
+
+    def append(self, lms, ts, idx):
+        self.landmarks.append(np.nan if lms is None else lms)
+        self.stamps.append(ts)
+        self.indices.append(idx)
+        self.hits.append(lms is not None)
+
+    def snapshot(self, fps, frame_count):
+        """ Secuencia parcial como vistas de lo escrito hasta ahora (O(1)). """
+        return _build_sequence(self.landmarks.array, self.stamps.array, self.indices.array, self.hits.array, fps, frame_count)
+
+    def build(self, fps, frame_count, stats):
+        return _build_sequence(self.landmarks.compact(), self.stamps.compact(), self.indices.compact(),
+                               self.hits.compact(), fps, frame_count, stats)
+
+
+def _infer(pose, image, idx):
+    """
+    pose.process(image). Un backend alternativo (pose_pool.set_backend, p. ej.
+    el de bench.py) puede definir process_at(image, idx) para recibir además
+    el índice del frame en el video.
+    """
+    process_at = getattr(pose, "process_at", None)
+    return pose.process(image) if process_at is None else process_at(image, idx)
+
+
+def _expected_rows(frame_count, keep_from, stop, stride, adaptive):
+    """ Filas que se van a guardar según los metadatos (para preasignar de una vez). """
+    if not frame_count:
+        return 256  # contenedor sin conteo: se crece por duplicación
+    end = frame_count if stop is None else min(stop, frame_count)
+    n = max(0, end - keep_from)
+    return n if adaptive else n // stride + 1
+
+
+def _seek(cap, source, start):
+    """
+    Deja `cap` listo para leer el frame `start` y devuelve el índice real
+    del próximo frame (menor solo si el video termina antes). Según backend
+    y contenedor CAP_PROP_POS_FRAMES puede caer en otro frame (p. ej. el
+    keyframe anterior): se lee la posición real y se avanza con grab(); si
+    quedó después, se reabre y se decodifica desde el principio.
+    """
+    if start <= 0:
+        return 0
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    pos = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if not 0 <= pos <= start:
+        cap.open(str(source))
+        pos = 0
+    while pos < start and cap.grab():
+        pos += 1
+    return pos
+
+
+def extract_landmarks(source, settings=None, start=0, stop=None, keep_from=None, on_progress=None):
+    """
+    Abre `source` (ruta o URL), corre Pose sobre 1 de cada `settings.stride`
+    frames (o según el muestreo adaptativo si `settings.sampling` está
+    definido) y devuelve un PoseSequence. La lectura y conversión de color
+    corren en un hilo aparte (frame_source.FramePrefetcher); con paso fijo
+    los frames que no se infieren solo se avanzan con grab().
+    Antes de inferir, los frames se reescalan a `settings.max_side` y, con
+    `settings.roi`, se recortan a la persona con una caja fija mientras
+    siga dentro; al cambiar de caja o volver al frame completo se reinicia
+    el tracking del estimador (ver preprocess.py). Los landmarks siempre
+    quedan normalizados al frame completo.
+    Lanza RuntimeError si el video no abre.
+
+    Para procesar un tramo (ver segments.py): se salta a `start` (ver
+    _seek, que verifica la posición real), se corta antes de `stop` y los
+    frames anteriores a `keep_from` solo sirven para calentar el tracking,
+    la caja ROI y el muestreo (no se devuelven).
+
+    `on_progress(frames_leidos, frame_count, snapshot)` se llama tras cada
+    frame inferido; snapshot() devuelve el PoseSequence parcial como vistas
+    de los buffers (sin copiar).
+    """
+    settings = settings or PoseSettings()
+    stride = max(1, int(settings.stride))
+    sampler = AdaptiveSampler(settings.sampling) if settings.sampling else None
+
+    cap = cv2.VideoCapture(str(source))
+    if not cap.isOpened():
+        raise RuntimeError(f"No abre video: {source}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    start = _seek(cap, source, start)
+    keep_from = start if keep_from is None else max(start, keep_from)
+
+    store = _SequenceStore(_expected_rows(frame_count, keep_from, stop, stride, sampler is not None))
+
+    # Con muestreo adaptativo la decisión depende de la inferencia, así que el
+    # hilo lector prepara todos los frames y aquí se descartan los que sobran.
+    want = None if sampler else (lambda i: (i + 1) % stride == 0)
+    reader = FramePrefetcher(cap, want=want, start=start, stop=stop, max_side=settings.max_side)
+    prev = None  # landmarks del último frame inferido, para armar la caja ROI
+    box = None       # caja ROI vigente (None = frame completo)
+    tracking = None  # caja en cuyas coordenadas está el tracking del estimador
+    roi_hits = roi_misses = roi_boxes = 0
+    infer_seconds = 0.0
+
+    try:
+        with pose_pool.borrow(settings) as pose:
+            for idx, ts, rgb in reader:
+                if sampler and not sampler.should_infer(idx):
+                    continue
+                lms = None
+                t_infer = time.perf_counter()
+                h, w = rgb.shape[:2]
+                if settings.roi and box is None:
+                    box = roi_box(prev, w, h)
+                    roi_boxes += box is not None
+                if box is not None:
+                    if tracking != box:
+                        # Otro sistema de coordenadas: sin ROI ni suavizado del anterior
+                        pose_pool.reset_tracking(pose)
+                        tracking = box
+                    res = _infer(pose, crop(rgb, box), idx)
+                    if res.pose_landmarks is not None:
+                        arr = landmarks_to_array(res.pose_landmarks)
+                        keep = roi_keeps(arr)
+                        lms = to_full_frame(arr, box, w, h)
+                        roi_hits += 1
+                        if not keep:
+                            box = None  # la persona se acerca al borde: caja nueva en el próximo frame
+                    else:
+                        roi_misses += 1  # tracking perdido: se reintenta con el frame completo
+                        box = None
+                if lms is None:
+                    if tracking is not None:
+                        pose_pool.reset_tracking(pose)
+                        tracking = None
+                    res = _infer(pose, rgb, idx)
+                    lms = None if res.pose_landmarks is None else landmarks_to_array(res.pose_landmarks)
+                infer_seconds += time.perf_counter() - t_infer
+                prev = lms
+                if sampler:
+                    sampler.observe(idx, lms)
+                if idx < keep_from:
+                    continue
+                store.append(lms, ts, idx)
+                if on_progress is not None:
+                    on_progress(idx + 1, frame_count, lambda: store.snapshot(fps, frame_count))
+    finally:
+        reader.close()
+        cap.release()
+
+    stats = {
+        "frames_total": max(0, reader.next_idx - keep_from),
+        "frames_inferred": len(store),
+        "inference_seconds": infer_seconds,
+        "prefetch": reader.stats(),
+    }
+    if settings.roi:
+        stats["roi"] = {"hits": roi_hits, "fallbacks": roi_misses, "boxes": roi_boxes}
+
+    return store.build(fps, frame_count, stats)
@@ -0,0 +1,113 @@
+"""
+Pool de estimadores MediaPipe Pose precalentados, por proceso.
+
+Construir un mp_pose.Pose y correr su primer frame inicializa el grafo y
+los modelos; en clips cortos eso es buena parte del job. Aquí los
+estimadores se guardan por (model_complexity, confianzas) y se reutilizan
+entre jobs del mismo proceso del worker.
+
+Entre usos se limpia el estado de tracking pasando un frame negro: sin
+pose detectada, MediaPipe descarta la ROI previa y reinicia el suavizado,
+y el siguiente frame vuelve a la detección completa. Es mucho más barato
+que Pose.reset(), que reinicia el grafo.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import mediapipe as mp
+
+mp_pose = mp.solutions.pose
+
+_BLANK = np.zeros((64, 64, 3), dtype=np.uint8)
+
+_idle = {}
+_lock = threading.Lock()
+_created = 0
+_reused = 0
+_factory = None  # constructor alternativo de estimadores (ver set_backend)
+
+
+def _key(settings):
+    return (settings.model_complexity, settings.min_detection_confidence, settings.min_tracking_confidence)
+
+
+def _create(settings):
+    global _created
+    if _factory is not None:
+        pose = _factory(settings)
+    else:
+        pose = mp_pose.Pose(
+            static_image_mode=False,
+            model_complexity=settings.model_complexity,
+            min_detection_confidence=settings.min_detection_confidence,
+            min_tracking_confidence=settings.min_tracking_confidence,
+        )
+    pose.process(_BLANK)  # fuerza la carga del grafo/modelos ahora
+    _created += 1
+    return pose
+
+
+def reset_tracking(pose):
+    """ Olvida el tracking del job anterior (ver docstring del módulo). """
+    pose.process(_BLANK)
+
+
+@contextmanager
+def borrow(settings):
+    """ Presta un estimador para `settings`; al devolverlo queda sin estado de tracking. """
+    global _reused
+    key = _key(settings)
+    with _lock:
+        idle = _idle.setdefault(key, [])
+        pose = idle.pop() if idle else None
+        if pose is not None:
+            _reused += 1
+    if pose is None:
+        pose = _create(settings)
+
+    ok = False
+    try:
+        yield pose
+        ok = True
+    finally:
+        if ok:
+            reset_tracking(pose)
+            with _lock:
+                _idle[key].append(pose)
+        else:
+            # Si el job falló a mitad de la inferencia no se reutiliza el grafo
+            pose.close()
+
+
+def set_backend(factory):
+    """
+    Reemplaza el constructor de estimadores: `factory(settings)` debe
+    devolver un objeto con process(rgb) y close() como mp_pose.Pose
+    (p.ej. el stub que reproduce landmarks en bench.py). None vuelve a
+    MediaPipe. Cierra y descarta los estimadores ociosos.
+    """
+    global _factory
+    with _lock:
+        for poses in _idle.values():
+            for pose in poses:
+                pose.close()
+        _idle.clear()
+        _factory = factory
+
+
+def warmup(settings_list):
+    """ Hook de arranque del worker: deja un estimador listo por cada config. """
+    t0 = time.perf_counter()
+    for settings in settings_list:
+        pose = _create(settings)
+        with _lock:
+            _idle.setdefault(_key(settings), []).append(pose)
+    return time.perf_counter() - t0
+
+
+def pool_stats():
+    with _lock:
+        return {"created": _created, "reused": _reused, "idle": sum(len(v) for v in _idle.values())}
@@ -0,0 +1,83 @@
+"""
+Preprocesado de frames antes de pose.process.
+
+1) Reescalado: los videos del teléfono llegan en 1080p/4K y MediaPipe
+   reescala internamente a la entrada de su red; reducir antes (en el hilo
+   lector, ver frame_source.py) ahorra la conversión de color y ancho de
+   banda de memoria a tamaño completo. Las coordenadas normalizadas no
+   cambian porque se conserva la relación de aspecto.
+2) Recorte a la persona (ROI): con los landmarks del frame anterior se
+   arma la caja de la persona más un margen, y los landmarks obtenidos
+   se devuelven a coordenadas normalizadas del frame completo. La caja
+   queda fija mientras la persona siga dentro (roi_keeps): el tracking y
+   el suavizado de MediaPipe trabajan en coordenadas de la imagen que
+   reciben, así que cada cambio de caja (o la vuelta al frame completo
+   cuando en el recorte no se detecta pose) reinicia el tracking.
+"""
+
+import os
+
+import numpy as np
+
+POSE_MAX_SIDE = int(os.getenv("POSE_MAX_SIDE", "960"))  # 0 = sin reescalar
+POSE_ROI = os.getenv("POSE_ROI", "0") in ("1", "true", "yes")
+ROI_PADDING = float(os.getenv("POSE_ROI_PADDING", "0.25"))
+ROI_MIN_VISIBILITY = 0.5
+ROI_MIN_SIDE = 64  # px; cajas más chicas no son confiables
+ROI_EDGE_MARGIN = 0.05  # fracción del recorte: más cerca del borde, se rehace la caja
+
+
+def roi_box(landmarks, width, height, padding=ROI_PADDING, min_visibility=ROI_MIN_VISIBILITY):
+    """
+    Caja (x0, y0, x1, y1) en píxeles alrededor de los landmarks visibles,
+    agrandada `padding` veces su tamaño por lado. None si no hay caja útil.
+    """
+    if landmarks is None:
+        return None
+    vis = landmarks[:, 3] >= min_visibility
+    if vis.sum() < 4:
+        return None
+    xs = landmarks[vis, 0] * width
+    ys = landmarks[vis, 1] * height
+    x0, x1, y0, y1 = xs.min(), xs.max(), ys.min(), ys.max()
+    pad_x, pad_y = (x1 - x0) * padding, (y1 - y0) * padding
+    x0 = int(max(0, np.floor(x0 - pad_x)))
+    y0 = int(max(0, np.floor(y0 - pad_y)))
+    x1 = int(min(width, np.ceil(x1 + pad_x)))
+    y1 = int(min(height, np.ceil(y1 + pad_y)))
+    if x1 - x0 < ROI_MIN_SIDE or y1 - y0 < ROI_MIN_SIDE:
+        return None
+    if (x0, y0, x1, y1) == (0, 0, width, height):
+        return None
+    return x0, y0, x1, y1
+
+
+def roi_keeps(landmarks, margin=ROI_EDGE_MARGIN, min_visibility=ROI_MIN_VISIBILITY):
+    """
+    True si los landmarks visibles (normalizados al recorte) quedan a más de
+    `margin` de los bordes: la caja actual sigue sirviendo para el próximo frame.
+    """
+    vis = landmarks[:, 3] >= min_visibility
+    if not vis.any():
+        return False
+    xy = landmarks[vis, :2]
+    return bool((xy >= margin).all() and (xy <= 1.0 - margin).all())
+
+
+def crop(image, box):
+    """ Recorte contiguo (MediaPipe exige memoria C-contigua). """
+    x0, y0, x1, y1 = box
+    return np.ascontiguousarray(image[y0:y1, x0:x1])
+
+
+def to_full_frame(landmarks, box, width, height):
+    """
+    Pasa landmarks (33, 4) normalizados al recorte `box` a coordenadas
+    normalizadas del frame completo (in place). z escala como x.
+    """
+    x0, y0, x1, y1 = box
+    cw, ch = x1 - x0, y1 - y0
+    landmarks[:, 0] = (landmarks[:, 0] * cw + x0) / width
+    landmarks[:, 1] = (landmarks[:, 1] * ch + y0) / height
+    landmarks[:, 2] = landmarks[:, 2] * (cw / width)
+    return landmarks
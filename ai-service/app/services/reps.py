@@ -0,0 +1,200 @@
+"""
+Conteo de repeticiones sobre la serie completa de ángulos, sin bucle por frame.
+
+Cada ejercicio es una fila de REP_SPECS: el ángulo que decide la fase, la
+histéresis (entra a la fase activa con ángulo < enter_below, cierra la
+repetición con ángulo > exit_above), las métricas por repetición y las
+reglas de puntaje. Agregar un ejercicio es agregar una entrada aquí.
+
+La histéresis se resuelve con eventos: cada frame es "entrada", "salida"
+o neutro; el estado es el del último evento no neutro, así que una
+repetición empieza en una entrada precedida por una salida (o por el
+inicio) y termina en la primera salida posterior. Las métricas de cada
+repetición se reducen sobre el tramo [entrada, salida] con
+np.fmin/np.fmax.reduceat (los NaN no cuentan, como en las comparaciones
+del bucle original) o se leen en el frame de salida. El resultado es
+idéntico al de las máquinas de estado por frame que reemplaza.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from app.services.angles import angles_between, batch_angles
+
+# Ángulos que usan los contadores de repeticiones (2D, vértice en el segundo punto)
+REP_ANGLE_DEFS = {
+    "knee":  (24, 26, 28),  # cadera, rodilla, tobillo (derechos)
+    "elbow": (12, 14, 16),  # hombro, codo, muñeca
+    "body":  (12, 24, 28),  # hombro, cadera, tobillo
+}
+
+
+@dataclass(frozen=True)
+class Rule:
+    error: str         # clave en "total_errors"
+    when: object       # métricas (dict de arreglos por rep) -> bool por rep
+    penalty: float
+    message: str
+
+
+@dataclass(frozen=True)
+class RepSpec:
+    name: str            # texto para el resumen ("Sentadilla")
+    keywords: tuple      # palabras del campo `exercise` que lo eligen
+    joint: str           # serie que decide la fase (clave de REP_ANGLE_DEFS)
+    enter_below: float
+    exit_above: float
+    metrics: dict        # nombre -> (serie, "min" | "max" | "exit", valor inicial)
+    rules: tuple
+    success: str = "¡Bien!"
+
+
+REP_SPECS = {
+    "squat": RepSpec(
+        "Sentadilla", ("sentadilla", "squat"), "knee", 160, 165,
+        metrics={"min_knee": ("knee", "min", 180), "max_back": ("back", "max", 0)},
+        rules=(
+            Rule("depth", lambda m: m["min_knee"] > 100, 3.0, "Baja más."),
+            Rule("back", lambda m: m["max_back"] > 45, 2.0, "Pecho arriba."),
+        ),
+    ),
+    "pushup": RepSpec(
+        "Flexiones", ("flexion", "pushup", "lagartija"), "elbow", 150, 160,
+        metrics={"min_elbow": ("elbow", "min", 180), "min_body": ("body", "min", 180)},
+        rules=(
+            Rule("rom", lambda m: m["min_elbow"] > 95, 3.0, "Baja el pecho."),
+            Rule("hip_sag", lambda m: m["min_body"] < 160, 2.0, "Aprieta abdomen."),
+        ),
+    ),
+    "pullup": RepSpec(
+        "Dominadas", ("dominada", "pullup"), "elbow", 150, 150,
+        metrics={"min_elbow": ("elbow", "min", 180), "exit_elbow": ("elbow", "exit", None),
+                 "chin": ("chin", "exit", None)},
+        rules=(
+            Rule("rom_up", lambda m: (m["min_elbow"] > 45) & ~m["chin"], 3.0, "Sube más."),
+            Rule("rom_down", lambda m: m["exit_elbow"] < 160, 2.0, "Estira brazos al bajar."),
+        ),
+        success="¡Potente!",
+    ),
+}
+
+
+def format_time(ms):
+    seconds = int(ms / 1000)
+    minutes = seconds // 60
+    seconds = seconds % 60
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def rep_angles(seq):
+    """
+    Ángulos 2D de REP_ANGLE_DEFS para todos los frames con pose detectada,
+    en una sola llamada vectorizada. Devuelve (dict nombre -> arreglo, landmarks, timestamps).
+    """
+    lm = seq.landmarks[seq.detected].astype(np.float64)
+    names, ang = batch_angles(lm, REP_ANGLE_DEFS, dims=2)
+    return {n: ang[:, i] for i, n in enumerate(names)}, lm, seq.timestamps[seq.detected]
+
+
+def _series(name, ang, lm):
+    if name in ang:
+        return ang[name]
+    if name == "back":
+        # Inclinación del tronco: vertical hacia arriba desde la cadera vs. hombro
+        hip = lm[:, 24, :2]
+        vertical = hip - np.array([0.0, 0.5], dtype=hip.dtype)
+        return angles_between(vertical, hip, lm[:, 12, :2])
+    if name == "chin":
+        return lm[:, 0, 1] < lm[:, 16, 1]  # nariz por encima de la muñeca
+    raise KeyError(f"Serie desconocida: {name}")
+
+
+def _phase_events(joint, enter_below, exit_above):
+    """ (índices, tipos) de los frames de entrada (1) y salida (-1) de la fase activa. """
+    code = np.where(joint < enter_below, 1, np.where(joint > exit_above, -1, 0)).astype(np.int8)
+    events = np.flatnonzero(code)
+    return events, code[events]
+
+
+def segment_reps(joint, enter_below, exit_above):
+    """
+    (inicios, fines) de las repeticiones completas: índices del frame de
+    entrada a la fase activa y del frame donde se cierra (inclusive).
+    """
+    events, kinds = _phase_events(joint, enter_below, exit_above)
+    # Estado antes de cada evento = tipo del evento anterior (al inicio: fuera de la fase)
+    prev = np.concatenate(([-1], kinds[:-1]))
+    starts = events[(kinds == 1) & (prev == -1)]
+    ends = events[(kinds == -1) & (prev == 1)]
+    return starts[:len(ends)], ends
+
+
+def _reduce(values, starts, ends, how, init):
+    if how == "exit":
+        return values[ends]
+    # Tramos [inicio, fin] intercalados; un NaN al final permite fin+1 == len
+    padded = np.append(values.astype(np.float64), np.nan)
+    bounds = np.empty(2 * len(starts), dtype=np.intp)
+    bounds[0::2], bounds[1::2] = starts, ends + 1
+    op = np.fmin if how == "min" else np.fmax
+    return op(op.reduceat(padded, bounds)[0::2], init)
+
+
+def compile_results(reps, scores, errors, log, exercise_name):
+    if reps == 0:
+        return {
+            "reps": 0, "score": 0.0,
+            "details": {"summary": f"No detectamos repeticiones de {exercise_name}. Ajusta la cámara.", "feedback_list": [], "total_errors": errors}
+        }
+    avg = sum(scores) / len(scores)
+    final_score = round(avg, 1)
+    summary = f"Hiciste {reps} {exercise_name}."
+    if final_score >= 8.5: summary += " ¡Técnica sólida!"
+    elif final_score >= 6.0: summary += " Buen esfuerzo, pero cuida los detalles."
+    else: summary += " La técnica necesita trabajo."
+    return {"reps": reps, "score": final_score, "details": {"summary": summary, "feedback_list": log, "total_errors": errors}}
+
+
+def resume_row(seq, spec):
+    """
+    Primera fila de `seq` que todavía puede afectar repeticiones futuras: el
+    frame de entrada de la repetición abierta, o len(seq) si no hay ninguna
+    abierta. Antes de esa fila el estado es "fuera de la fase" (el inicial),
+    así que analizar seq[resume_row:] más los frames que vengan da las mismas
+    repeticiones que volver a analizar todo.
+    """
+    ang, _, _ = rep_angles(seq)
+    events, kinds = _phase_events(ang[spec.joint], spec.enter_below, spec.exit_above)
+    exits = np.flatnonzero(kinds == -1)
+    pending = events[exits[-1] + 1:] if len(exits) else events
+    if not len(pending):
+        return len(seq)
+    return int(np.flatnonzero(seq.detected)[pending[0]])
+
+
+def analyze_reps(seq, spec, first_rep=1):
+    """
+    Analizador genérico: PoseSequence + RepSpec -> resultado de compile_results.
+    `first_rep` numera el feedback (para un tramo que sigue a reps ya contadas).
+    """
+    ang, lm, stamps = rep_angles(seq)
+    starts, ends = segment_reps(ang[spec.joint], spec.enter_below, spec.exit_above)
+    metrics = {
+        name: _reduce(_series(series, ang, lm), starts, ends, how, init)
+        for name, (series, how, init) in spec.metrics.items()
+    }
+    hits = [np.asarray(rule.when(metrics), dtype=bool) for rule in spec.rules]
+    errors = {rule.error: int(hit.sum()) for rule, hit in zip(spec.rules, hits)}
+
+    feedback_log, rep_scores = [], []
+    for k, end in enumerate(ends.tolist()):
+        s, msgs = 10.0, []
+        for rule, hit in zip(spec.rules, hits):
+            if hit[k]:
+                s -= rule.penalty
+                msgs.append(rule.message)
+        rep_scores.append(max(0, s))
+        feedback_log.append({"rep": first_rep + k, "time": format_time(float(stamps[end])), "score": max(0, s),
+                             "type": "correction" if msgs else "success", "message": " ".join(msgs) or spec.success})
+    return compile_results(len(ends), rep_scores, errors, feedback_log, spec.name)
@@ -0,0 +1,93 @@
+"""
+Encolado de jobs de RQ desde la API sin bloquear el event loop.
+
+rq solo habla con un cliente redis síncrono, así que la API arma el job
+con rq (Job.create + to_dict, el mismo hash que guarda Queue.enqueue) y
+escribe las claves con redis.asyncio en una transacción:
+
+    SADD  rq:queues          rq:queue:<cola>
+    HSET  rq:job:<id>        <job.to_dict()>
+    RPUSH rq:queue:<cola>    <id>
+
+El worker (SimpleWorker) ve exactamente lo mismo que con q.enqueue.
+Hay dos clientes async por proceso, cada uno con su pool:
+  - get_redis(): comandos cortos (encolar, caché de estado). Si las
+    REDIS_MAX_CONNECTIONS están ocupadas se espera hasta REDIS_POOL_TIMEOUT s.
+  - get_blocking_redis(): lecturas que se quedan en XREAD BLOCK (SSE y
+    long-polling, hasta decenas de segundos). Van aparte para que muchos
+    clientes esperando no dejen sin conexiones a POST /analyze.
+"""
+
+import os
+from datetime import datetime, timezone
+
+import redis
+import redis.asyncio as aioredis
+from rq import Queue
+from rq.job import Job, JobStatus
+
+QUEUE_NAME = "fitai"
+ANALYSIS_TASK = "app.tasks.run_analysis"
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "100"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_BLOCKING_MAX_CONNECTIONS = int(os.getenv("REDIS_BLOCKING_MAX_CONNECTIONS", "200"))
+
+_client = None
+_blocking_client = None
+_sync_stub = None
+
+
+def get_redis():
+    """ Cliente redis.asyncio del proceso (pool compartido, conexiones perezosas). """
+    global _client
+    if _client is None:
+        pool = aioredis.BlockingConnectionPool.from_url(
+            os.getenv("REDIS_URL"), max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT)
+        _client = aioredis.Redis(connection_pool=pool)
+    return _client
+
+
+def get_blocking_redis():
+    """ Cliente redis.asyncio solo para lecturas bloqueantes (pool separado del de get_redis). """
+    global _blocking_client
+    if _blocking_client is None:
+        pool = aioredis.BlockingConnectionPool.from_url(
+            os.getenv("REDIS_URL"), max_connections=REDIS_BLOCKING_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT)
+        _blocking_client = aioredis.Redis(connection_pool=pool)
+    return _blocking_client
+
+
+def _job_connection():
+    # Job.create exige una conexión síncrona, pero to_dict no la usa:
+    # un cliente sin conectar alcanza (nunca abre un socket)
+    global _sync_stub
+    if _sync_stub is None:
+        _sync_stub = redis.Redis()
+    return _sync_stub
+
+
+def build_job(func, args, queue=QUEUE_NAME, timeout=None):
+    """ (id, hash) de un job en estado 'queued', igual al que escribe Queue.enqueue. """
+    job = Job.create(func, args=args, connection=_job_connection(), origin=queue,
+                     timeout=timeout or Queue.DEFAULT_TIMEOUT, status=JobStatus.QUEUED)
+    job.enqueued_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    mapping = {k: v for k, v in job.to_dict().items() if v is not None}
+    return job.id, mapping
+
+
+def add_to_pipeline(pipe, func, args, queue=QUEUE_NAME):
+    """ Agrega a un pipeline de redis.asyncio los comandos que encolan un job. Devuelve el id de RQ. """
+    queue_key = Queue.redis_queue_namespace_prefix + queue
+    job_id, mapping = build_job(func, args, queue)
+    pipe.sadd(Queue.redis_queues_keys, queue_key)
+    pipe.hset(Job.redis_job_namespace_prefix + job_id, mapping=mapping)
+    pipe.rpush(queue_key, job_id)
+    return job_id
+
+
+async def enqueue(func, *args, queue=QUEUE_NAME):
+    """ Equivalente async de rq.Queue(queue).enqueue(func, *args). Devuelve el id de RQ. """
+    async with get_redis().pipeline(transaction=True) as pipe:
+        job_id = add_to_pipeline(pipe, func, args, queue)
+        await pipe.execute()
+    return job_id
@@ -0,0 +1,90 @@
+"""
+Muestreo adaptativo de frames guiado por movimiento.
+
+Mientras los ángulos vigilados están estables y lejos del próximo umbral
+de cambio de fase (p. ej. 160° al bajar y 165° al subir en sentadilla),
+Pose se corre cada `coarse_stride` frames. Cerca de ese umbral, cuando un
+ángulo cambia rápido o cuando se pierde la pose, se baja a `dense_stride`.
+El margen debe ser mayor a lo que el ángulo puede recorrer en un paso
+grueso sin disparar el control de velocidad, así ningún cruce de umbral
+cae entre dos inferencias.
+
+Se activa con POSE_SAMPLING=adaptive (por defecto se infiere con paso fijo).
+"""
+
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+from app.services.angles import angles_between
+
+POSE_SAMPLING = os.getenv("POSE_SAMPLING", "fixed")
+COARSE_STRIDE = int(os.getenv("POSE_COARSE_STRIDE", "4"))
+MARGIN_DEG = float(os.getenv("POSE_SAMPLING_MARGIN_DEG", "10"))
+MAX_DELTA_DEG = float(os.getenv("POSE_SAMPLING_MAX_DELTA_DEG", "6"))
+
+
+@dataclass(frozen=True)
+class AdaptiveSampling:
+    joints: tuple                   # ((a, b, c), ...) ángulos vigilados, vértice en b
+    band: tuple = ()                # (entra < lo, sale > hi) del primer ángulo; vacío = solo velocidad
+    coarse_stride: int = COARSE_STRIDE
+    dense_stride: int = 1
+    margin_deg: float = MARGIN_DEG
+    max_delta_deg: float = MAX_DELTA_DEG
+
+
+def sampling_for(joints, band=()):
+    """ Config adaptativa para un ejercicio, o None si POSE_SAMPLING no es 'adaptive'. """
+    if POSE_SAMPLING != "adaptive":
+        return None
+    return AdaptiveSampling(tuple(tuple(int(p) for p in j) for j in joints), tuple(float(t) for t in band))
+
+
+class AdaptiveSampler:
+    """ Decide frame a frame si correr Pose, según lo observado en la última inferencia. """
+
+    def __init__(self, config):
+        self.config = config
+        self.idx = np.array(config.joints, dtype=np.intp).reshape(-1, 3)
+        self.band = tuple(config.band)
+        self.flexed = False  # fase según la misma histéresis que el contador
+        self.stride = config.dense_stride
+        self.last_idx = None
+        self.last_angles = None
+        self.frames_dense = 0
+
+    def should_infer(self, frame_idx):
+        return self.last_idx is None or frame_idx - self.last_idx >= self.stride
+
+    def observe(self, frame_idx, landmarks):
+        """ Registra el resultado de la inferencia (landmarks (33, 4) o None) y ajusta el paso. """
+        self.last_idx = frame_idx
+        if landmarks is None:
+            # Pose perdida: muestreo denso hasta recuperarla
+            self.stride, self.last_angles = self.config.dense_stride, None
+            self.frames_dense += 1
+            return
+
+        pts = landmarks[self.idx, :2].astype(np.float64)
+        angles = angles_between(pts[:, 0], pts[:, 1], pts[:, 2])
+
+        near = False
+        if self.band:
+            lo, hi = self.band
+            primary = angles[0]
+            if not self.flexed and primary < lo:
+                self.flexed = True
+            elif self.flexed and primary > hi:
+                self.flexed = False
+            near = abs(primary - (hi if self.flexed else lo)) <= self.config.margin_deg
+        moving = self.last_angles is None or bool(
+            np.any(np.abs(angles - self.last_angles) > self.config.max_delta_deg)
+        )
+        if np.any(np.isnan(angles)) or near or moving:
+            self.stride = self.config.dense_stride
+            self.frames_dense += 1
+        else:
+            self.stride = self.config.coarse_stride
+        self.last_angles = angles
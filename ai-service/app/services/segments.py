@@ -0,0 +1,174 @@
+"""
+Extracción de pose en paralelo por tramos de video.
+
+Un video largo se parte en tramos contiguos de frames. Cada tramo se
+procesa en un proceso aparte: se salta a `inicio - overlap`
+(POSE_SEGMENT_OVERLAP frames), esos frames de solape solo calientan el
+tracking de MediaPipe, la caja ROI y su suavizado, y se descartan; el
+resto se devuelve. Los tramos se cosen en orden antes de correr la lógica
+de repeticiones, que sigue viendo una sola secuencia. La pasada
+secuencial no cambia.
+
+Tolerancia frente a la pasada secuencial (con paso fijo):
+  - frame_index, timestamps y cantidad de filas son idénticos (_seek
+    verifica la posición real tras saltar).
+  - los landmarks solo difieren por el estado con el que el estimador
+    llega a cada frame (tracking/suavizado y caja ROI). El solape deja ese
+    estado en el orden del movimiento entre frames consecutivos; la
+    tolerancia es SEGMENT_TOLERANCE (0.01 en coordenadas normalizadas).
+  - el conteo de repeticiones es el mismo salvo que el extremo de una
+    repetición quede a menos de esa diferencia de un umbral justo en
+    frames donde los dos estados no coinciden.
+Con muestreo adaptativo los frames inferidos dependen de todo lo anterior
+(un tramo podría elegir otros), así que esos pedidos corren secuenciales.
+
+El pool de procesos es persistente: se crea una vez por proceso (el
+worker lo arranca en su warmup con start_pool) y cada proceso del pool
+precarga sus estimadores de pose, así un job no paga el arranque de
+procesos spawn ni la carga del modelo.
+
+Solo para archivos locales (saltar dentro de una URL remota es caro).
+Se activa con POSE_WORKERS > 1.
+"""
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+import numpy as np
+
+from app.services import pose_pool
+from app.services.pose_engine import PoseSequence, extract_landmarks, video_info
+
+POSE_WORKERS = int(os.getenv("POSE_WORKERS", "1"))
+OVERLAP_FRAMES = int(os.getenv("POSE_SEGMENT_OVERLAP", "30"))
+# Por debajo de esto no vale la pena repartir
+MIN_SEGMENT_FRAMES = int(os.getenv("POSE_MIN_SEGMENT_FRAMES", "300"))
+# Diferencia máxima de landmarks (x, y normalizados) frente a la pasada secuencial
+SEGMENT_TOLERANCE = 0.01
+
+_PREFETCH_KEYS = ("frames_delivered", "starved", "decode_seconds", "convert_seconds")
+_ROI_KEYS = ("hits", "fallbacks", "boxes")
+
+_pool = None
+_pool_size = 0
+
+
+def plan_segments(frame_count, workers, overlap=OVERLAP_FRAMES, min_frames=MIN_SEGMENT_FRAMES):
+    """
+    Devuelve [(warm_start, start, stop), ...]. El último tramo tiene stop=None
+    (lee hasta el final, por si CAP_PROP_FRAME_COUNT es inexacto).
+    """
+    n = max(1, min(workers, frame_count // max(1, min_frames)))
+    size = math.ceil(frame_count / n) if frame_count else 0
+    plan = []
+    for i in range(n):
+        start = i * size
+        stop = None if i == n - 1 else (i + 1) * size
+        plan.append((max(0, start - overlap), start, stop))
+    return plan
+
+
+def _init_worker(warm):
+    pose_pool.warmup(warm)
+
+
+def start_pool(workers=POSE_WORKERS, warm=()):
+    """
+    Crea (una vez por proceso) el pool de tramos con `workers` procesos
+    spawn, cada uno con estimadores precargados para los PoseSettings de
+    `warm`. Devuelve el pool, o None si workers <= 1.
+    """
+    global _pool, _pool_size
+    if workers <= 1:
+        return None
+    if _pool is not None and _pool_size >= workers:
+        return _pool
+    shutdown_pool()
+    _pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                                initializer=_init_worker, initargs=(list(warm),))
+    _pool_size = workers
+    # Los procesos se crean a demanda: una tarea por proceso los arranca y precarga ya
+    for pending in [_pool.submit(os.getpid) for _ in range(workers)]:
+        pending.result()
+    return _pool
+
+
+def shutdown_pool():
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+    _pool, _pool_size = None, 0
+
+
+def _extract_segment(args):
+    source, settings, warm_start, start, stop = args
+    return extract_landmarks(source, settings, start=warm_start, stop=stop, keep_from=start)
+
+
+def stitch(parts, fps=0.0, frame_count=0):
+    """ Concatena los PoseSequence de cada tramo, en orden. """
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        seq = PoseSequence.empty(fps=fps, frame_count=frame_count)
+    else:
+        seq = PoseSequence(
+            np.concatenate([p.landmarks for p in parts]),
+            np.concatenate([p.timestamps for p in parts]),
+            np.concatenate([p.frame_index for p in parts]),
+            np.concatenate([p.detected for p in parts]),
+            fps=fps, frame_count=frame_count,
+        )
+    return seq
+
+
+def merge_stats(parts):
+    """ Suma las estadísticas de los tramos (tiempos de CPU, no de reloj). """
+    stats = {
+        "frames_total": sum(p.stats.get("frames_total", 0) for p in parts),
+        "frames_inferred": sum(p.stats.get("frames_inferred", 0) for p in parts),
+        "inference_seconds": sum(p.stats.get("inference_seconds", 0.0) for p in parts),
+        "prefetch": {k: sum(p.stats.get("prefetch", {}).get(k, 0) for p in parts) for k in _PREFETCH_KEYS},
+        "segments": len(parts),
+    }
+    if any("roi" in p.stats for p in parts):
+        stats["roi"] = {k: sum(p.stats.get("roi", {}).get(k, 0) for p in parts) for k in _ROI_KEYS}
+    return stats
+
+
+def extract_landmarks_parallel(source, settings, workers=POSE_WORKERS, overlap=OVERLAP_FRAMES,
+                               min_frames=MIN_SEGMENT_FRAMES, on_progress=None):
+    """
+    Igual que extract_landmarks (dentro de la tolerancia del módulo) pero
+    repartiendo tramos en el pool persistente. Si el video es corto, hay
+    muestreo adaptativo o workers <= 1, corre secuencial.
+
+    `on_progress(frames_leidos, frame_count, snapshot)` se llama cada vez
+    que termina el siguiente tramo en orden; snapshot() devuelve los
+    tramos terminados ya cosidos.
+    """
+    fps, frame_count = video_info(source)
+    plan = plan_segments(frame_count, workers, overlap, min_frames)
+    if len(plan) <= 1 or settings.sampling is not None:
+        return extract_landmarks(source, settings, on_progress=on_progress)
+
+    pool = start_pool(workers)
+    jobs = [(str(source), settings, warm_start, start, stop) for warm_start, start, stop in plan]
+    parts = []
+    try:
+        for (_, _, stop), part in zip(plan, pool.map(_extract_segment, jobs)):
+            parts.append(part)
+            if on_progress is not None:
+                on_progress(stop or frame_count, frame_count,
+                            lambda done=list(parts): stitch(done, fps=fps, frame_count=frame_count))
+    except BrokenProcessPool as e:
+        # Un proceso del pool murió (p. ej. sin memoria): se descarta el pool y el job sigue secuencial
+        print(f"⚠️ Pool de tramos caído ({e}); se extrae secuencial")
+        shutdown_pool()
+        return extract_landmarks(source, settings, on_progress=on_progress)
+
+    seq = stitch(parts, fps=fps, frame_count=frame_count)
+    seq.stats.update(merge_stats(parts))
+    return seq
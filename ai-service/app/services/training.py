@@ -0,0 +1,147 @@
+"""
+Features de entrenamiento por video, calculadas por bloques.
+
+El dataset de ángulos (una fila por frame) no se carga entero: se lee en
+bloques de TRAIN_CHUNK_ROWS filas (CSV con pandas o Parquet con pyarrow),
+los ángulos pasan a float32, y por cada bloque se hacen reducciones
+agrupadas por (video,label): conteo, media, M2 (suma de cuadrados de
+desvíos), mínimo y máximo. Los bloques se combinan con la fórmula de Chan
+para la varianza, así un video partido entre dos bloques da el mismo
+resultado que leído de una vez. La memoria queda acotada por el tamaño de
+bloque más una fila de estadísticos por video.
+
+El resultado tiene las mismas columnas y orden que extract_basic_features
+aplicado a cada grupo (std con ddof=0, como np.nanstd).
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from app.services.analizar_postura import LOWER_BODY, UPPER_BODY
+
+TRAIN_CHUNK_ROWS = int(os.getenv("TRAIN_CHUNK_ROWS", "500000"))
+KEYS = ["video", "label"]
+META_COLS = ["video", "frame", "label"]
+
+
+def dataset_files(path):
+    """
+    Archivos del dataset: el propio archivo, o las partes vigentes de un
+    directorio generado por dataset_builder (según su manifiesto).
+    """
+    path = Path(path)
+    if not path.is_dir():
+        return [path]
+    manifest = path / "manifest.jsonl"
+    if manifest.exists():
+        from app.services.dataset_builder import load_manifest
+        parts = sorted({entry["part"] for entry in load_manifest(path).values()})
+        return [path / "parts" / p for p in parts]
+    return sorted(p for p in (path / "parts").glob("*") if p.suffix in (".csv", ".parquet"))
+
+
+def _iter_chunks(path, chunk_rows):
+    """ Bloques de DataFrame del dataset (CSV, Parquet o directorio de partes). """
+    for f in dataset_files(path):
+        yield from _iter_file_chunks(f, chunk_rows)
+
+
+def _iter_file_chunks(path, chunk_rows):
+    if path.suffix in (".parquet", ".pq"):
+        import pyarrow.parquet as pq  # opcional: solo para datasets columnares
+        pf = pq.ParquetFile(path)
+        for batch in pf.iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows, dtype={"video": str, "label": str})
+
+
+def _prepare(chunk, angle_cols):
+    """ Ángulos a float32 (coerce) y descarta filas incompletas, igual que el entrenamiento original. """
+    chunk = chunk.copy()
+    for c in angle_cols:
+        chunk[c] = pd.to_numeric(chunk[c], errors="coerce").astype(np.float32)
+    for c in KEYS:
+        chunk[c] = chunk[c].astype(object).where(chunk[c].notna())
+    return chunk.dropna(axis=0, how="any")
+
+
+def _chunk_stats(chunk, angle_cols):
+    """ (n, media, M2, min, max) por grupo del bloque; acumulado en float64. """
+    values = chunk[angle_cols].astype(np.float64)
+    g = values.groupby([chunk["video"], chunk["label"]], sort=False)
+    n = g.size().astype(np.float64)
+    mean = g.mean()
+    m2 = g.var(ddof=0).mul(n, axis=0)
+    return n, mean, m2, g.min(), g.max()
+
+
+def _merge(state, new):
+    """ Combina estadísticos de dos conjuntos de grupos (fórmula paralela de Chan). """
+    if state is None:
+        return new
+    index = state[0].index.union(new[0].index)
+    na, ma, m2a, mina, maxa = (x.reindex(index) for x in state)
+    nb, mb, m2b, minb, maxb = (x.reindex(index) for x in new)
+    na, nb = na.fillna(0.0).to_numpy(), nb.fillna(0.0).to_numpy()
+    ma, mb = ma.fillna(0.0).to_numpy(), mb.fillna(0.0).to_numpy()
+    m2a, m2b = m2a.fillna(0.0).to_numpy(), m2b.fillna(0.0).to_numpy()
+
+    n = na + nb
+    wb = (nb / n)[:, None]
+    delta = mb - ma
+    mean = ma + delta * wb
+    m2 = m2a + m2b + delta ** 2 * (na * nb / n)[:, None]
+    cols = state[1].columns
+    return (
+        pd.Series(n, index=index),
+        pd.DataFrame(mean, index=index, columns=cols),
+        pd.DataFrame(m2, index=index, columns=cols),
+        np.fmin(mina, minb),
+        np.fmax(maxa, maxb),
+    )
+
+
+def build_training_features(path, chunk_rows=TRAIN_CHUNK_ROWS):
+    """
+    DataFrame con una fila por (video,label): columnas video, label y las
+    features de extract_basic_features (<ángulo>_mean/_std/_rng y agregados).
+    """
+    state, angle_cols = None, None
+    for chunk in _iter_chunks(path, chunk_rows):
+        if angle_cols is None:
+            if "video" not in chunk.columns or "label" not in chunk.columns:
+                raise ValueError("Invalid CSV: missing 'video' or 'label'.")
+            # Columnas de ángulos = todo excepto metadatos
+            angle_cols = [c for c in chunk.columns if c not in META_COLS]
+        chunk = _prepare(chunk, angle_cols)
+        if not chunk.empty:
+            state = _merge(state, _chunk_stats(chunk, angle_cols))
+    if state is None or state[0].empty:
+        raise ValueError("Could not build per-video features from CSV.")
+
+    n, mean, m2, vmin, vmax = state
+    std = np.sqrt(m2.div(n, axis=0).clip(lower=0.0))
+    rng = vmax - vmin
+
+    feats = {}
+    for c in angle_cols:
+        feats[f"{c}_mean"] = mean[c]
+        feats[f"{c}_std"] = std[c]
+        feats[f"{c}_rng"] = rng[c]
+    out = pd.DataFrame(feats, index=n.index)
+
+    # Ángulos ausentes en el dataset cuentan como rango 0, como en extract_basic_features
+    def agg(cols):
+        parts = [out[f"{c}_rng"] if f"{c}_rng" in out else pd.Series(0.0, index=out.index) for c in cols]
+        return pd.concat(parts, axis=1).mean(axis=1)
+
+    out["upper_body_range_mean"] = agg(UPPER_BODY)
+    out["lower_body_range_mean"] = agg(LOWER_BODY)
+    out["lower_minus_upper_range"] = out["lower_body_range_mean"] - out["upper_body_range_mean"]
+
+    out = out.sort_index().reset_index(names=KEYS)
+    return out[KEYS + list(feats) + ["upper_body_range_mean", "lower_body_range_mean", "lower_minus_upper_range"]]
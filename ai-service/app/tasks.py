@@ -1,178 +1,126 @@
 import os
 import json
-import cv2
+import time
+from contextlib import ExitStack
+from functools import partial
 import numpy as np
-import mediapipe as mp
-from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
-from fastapi import FastAPI, BackgroundTasks
-from pydantic import BaseModel
+from rq import get_current_job
+from app.services.analizar_postura import ANGLE_DEFS
+from app.services.angles import batch_angles
+from app.services.classifier import StreamingClassifier, get_classifier
+from app.services.db import mark_failed, mark_running, save_result
+from app.services.events import STREAM_EVENTS, RepStreamer
+from app.services.fetch import fetch_video, is_remote
+from app.services.job_status import publish_status
+from app.services.landmark_cache import load_landmarks
+from app.services.metrics import JobTimer, queue_wait_seconds
+from app.services.pose_engine import PoseSettings
+from app.services.reps import REP_ANGLE_DEFS, REP_SPECS, analyze_reps
+from app.services.sampling import sampling_for
+from app.services.segments import POSE_WORKERS
 
 # 1. Cargar variables de entorno
 load_dotenv()
 
-# 2. Configuración de Base de Datos
-db_url = os.getenv("DATABASE_URL")
-if not db_url:
-    raise ValueError("❌ Error: DATABASE_URL no encontrada en el archivo .env")
-
-engine = create_engine(db_url, pool_pre_ping=True, pool_size=10, max_overflow=20)
-mp_pose = mp.solutions.pose
-
-# 3. Inicializar la APP (necesario si este archivo también corre FastAPI, si no, se puede omitir)
-app = FastAPI()
-
-# Modelo de datos
-class AnalysisRequest(BaseModel):
-    job_id: str
-    video_url: str
-    exercise: str
-    video_id: str = None
-
-# --- FUNCIONES DE LÓGICA (MATEMÁTICAS) ---
-
-def format_time(ms):
-    seconds = int(ms / 1000)
-    minutes = seconds // 60
-    seconds = seconds % 60
-    return f"{minutes:02d}:{seconds:02d}"
-
-def calculate_angle(a, b, c):
-    a = np.array([a.x, a.y])
-    b = np.array([b.x, b.y])
-    c = np.array([c.x, c.y])
-    ba = a - b
-    bc = c - b
-    cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc))
-    angle = np.arccos(np.clip(cosine_angle, -1.0, 1.0))
-    return np.degrees(angle)
-
-def compile_results(reps, scores, errors, log, exercise_name):
-    if reps == 0:
-        return {
-            "reps": 0, "score": 0.0,
-            "details": {"summary": f"No detectamos repeticiones de {exercise_name}. Ajusta la cámara.", "feedback_list": [], "total_errors": errors}
-        }
-    avg = sum(scores) / len(scores)
-    final_score = round(avg, 1)
-    summary = f"Hiciste {reps} {exercise_name}."
-    if final_score >= 8.5: summary += " ¡Técnica sólida!"
-    elif final_score >= 6.0: summary += " Buen esfuerzo, pero cuida los detalles."
-    else: summary += " La técnica necesita trabajo."
-    return {"reps": reps, "score": final_score, "details": {"summary": summary, "feedback_list": log, "total_errors": errors}}
+# 2. Base de Datos: engine compartido de app.services.db (pool según DB_ROLE)
 
 # --- MOTORES DE ANÁLISIS ---
+# El conteo de repeticiones vive en services/reps.py (tabla REP_SPECS + histéresis
+# vectorizada); los analizadores consumen el PoseSequence de pose_engine y
+# ninguno abre el video ni corre MediaPipe por su cuenta.
 
-def analyze_squat(video_url):
-    cap = cv2.VideoCapture(video_url)
-    if not cap.isOpened(): raise RuntimeError(f"No abre video: {video_url}")
-    reps, phase = 0, "up"
-    feedback_log, rep_scores = [], []
-    min_knee, max_back = 180, 0
-    errors = {"depth": 0, "back": 0}
-
-    with mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5) as pose:
-        while True:
-            ok, frame = cap.read()
-            if not ok: break
-            ts = format_time(cap.get(cv2.CAP_PROP_POS_MSEC))
-            res = pose.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            if not res.pose_landmarks: continue
-            lm = res.pose_landmarks.landmark
-            
-            hip, knee, ankle = lm[24], lm[26], lm[28]
-            shoulder = lm[12]
-            knee_angle = calculate_angle(hip, knee, ankle)
-            vertical = type('o', (object,), {'x': hip.x, 'y': hip.y - 0.5})
-            back_angle = calculate_angle(vertical, hip, shoulder)
-
-            if phase == "up" and knee_angle < 160:
-                phase, min_knee, max_back = "down", 180, 0
-            if phase == "down":
-                if knee_angle < min_knee: min_knee = knee_angle
-                if back_angle > max_back: max_back = back_angle
-                if knee_angle > 165:
-                    phase = "up"
-                    reps += 1
-                    s, msgs = 10.0, []
-                    if min_knee > 100: s -= 3.0; errors["depth"]+=1; msgs.append("Baja más.")
-                    if max_back > 45: s -= 2.0; errors["back"]+=1; msgs.append("Pecho arriba.")
-                    rep_scores.append(max(0, s))
-                    feedback_log.append({"rep": reps, "time": ts, "score": max(0, s), "type": "correction" if msgs else "success", "message": " ".join(msgs) or "¡Bien!"})
-    cap.release()
-    return compile_results(reps, rep_scores, errors, feedback_log, "Sentadilla")
-
-def analyze_pushup(video_url):
-    cap = cv2.VideoCapture(video_url)
-    reps, phase = 0, "up"
-    feedback_log, rep_scores = [], []
-    min_elbow, min_body = 180, 180
-    errors = {"rom": 0, "hip_sag": 0}
-
-    with mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5) as pose:
-        while True:
-            ok, frame = cap.read()
-            if not ok: break
-            ts = format_time(cap.get(cv2.CAP_PROP_POS_MSEC))
-            res = pose.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            if not res.pose_landmarks: continue
-            lm = res.pose_landmarks.landmark
-            
-            sh, el, wr = lm[12], lm[14], lm[16]
-            hip, ank = lm[24], lm[28]
-            elbow_angle = calculate_angle(sh, el, wr)
-            body_angle = calculate_angle(sh, hip, ank)
-
-            if phase == "up" and elbow_angle < 150:
-                phase, min_elbow, min_body = "down", 180, 180
-            if phase == "down":
-                if elbow_angle < min_elbow: min_elbow = elbow_angle
-                if body_angle < min_body: min_body = body_angle
-                if elbow_angle > 160:
-                    phase = "up"
-                    reps += 1
-                    s, msgs = 10.0, []
-                    if min_elbow > 95: s -= 3.0; errors["rom"]+=1; msgs.append("Baja el pecho.")
-                    if min_body < 160: s -= 2.0; errors["hip_sag"]+=1; msgs.append("Aprieta abdomen.")
-                    rep_scores.append(max(0, s))
-                    feedback_log.append({"rep": reps, "time": ts, "score": max(0, s), "type": "correction" if msgs else "success", "message": " ".join(msgs) or "¡Bien!"})
-    cap.release()
-    return compile_results(reps, rep_scores, errors, feedback_log, "Flexiones")
-
-def analyze_pullup(video_url):
-    cap = cv2.VideoCapture(video_url)
-    reps, phase = 0, "down"
-    feedback_log, rep_scores = [], []
-    min_elbow = 180
-    errors = {"rom_up": 0, "rom_down": 0}
-
-    with mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5) as pose:
-        while True:
-            ok, frame = cap.read()
-            if not ok: break
-            ts = format_time(cap.get(cv2.CAP_PROP_POS_MSEC))
-            res = pose.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            if not res.pose_landmarks: continue
-            lm = res.pose_landmarks.landmark
-            
-            wr, el, sh, nose = lm[16], lm[14], lm[12], lm[0]
-            elbow_angle = calculate_angle(sh, el, wr)
-            chin_cleared = nose.y < wr.y
-
-            if phase == "down" and elbow_angle < 150:
-                phase, min_elbow = "up", 180
-            if phase == "up":
-                if elbow_angle < min_elbow: min_elbow = elbow_angle
-                if elbow_angle > 150:
-                    phase = "down"
-                    reps += 1
-                    s, msgs = 10.0, []
-                    if min_elbow > 45 and not chin_cleared: s -= 3.0; errors["rom_up"]+=1; msgs.append("Sube más.")
-                    if elbow_angle < 160: s -= 2.0; errors["rom_down"]+=1; msgs.append("Estira brazos al bajar.")
-                    rep_scores.append(max(0, s))
-                    feedback_log.append({"rep": reps, "time": ts, "score": max(0, s), "type": "correction" if msgs else "success", "message": " ".join(msgs) or "¡Potente!"})
-    cap.release()
-    return compile_results(reps, rep_scores, errors, feedback_log, "Dominadas")
+def analyze_squat(seq):
+    return analyze_reps(seq, REP_SPECS["squat"])
+
+def analyze_pushup(seq):
+    return analyze_reps(seq, REP_SPECS["pushup"])
+
+def analyze_pullup(seq):
+    return analyze_reps(seq, REP_SPECS["pullup"])
+
+ANALYZERS = {"squat": analyze_squat, "pushup": analyze_pushup, "pullup": analyze_pullup}
+
+# Registro de analizadores: (palabras clave, analizador, RepSpec).
+# Sale de REP_SPECS: un ejercicio nuevo solo necesita su entrada allí. El ángulo y
+# la histéresis del spec guían el muestreo adaptativo (POSE_SAMPLING=adaptive) y
+# el conteo incremental de RepStreamer.
+EXERCISES = [
+    (spec.keywords, ANALYZERS.get(key) or partial(analyze_reps, spec=spec), spec)
+    for key, spec in REP_SPECS.items()
+]
+
+def resolve_exercise(ex):
+    for keywords, analyzer, spec in EXERCISES:
+        if any(x in ex for x in keywords):
+            return analyzer, spec
+    return None, None
+
+# Cada cuántos frames se le pasan ángulos nuevos al clasificador
+CLASSIFY_EVERY_FRAMES = int(os.getenv("CLASSIFY_EVERY_FRAMES", "15"))
+
+class ExerciseDetector:
+    """
+    Callback de progreso cuando el ejercicio viene como "auto" o no se
+    reconoce: cada CLASSIFY_EVERY_FRAMES frames pasa los ángulos nuevos al
+    StreamingClassifier y, apenas la predicción se estabiliza, fija el
+    analizador y desde ahí delega en RepStreamer. Todo en la misma pasada
+    de pose; si el video termina antes, decide con lo que vio (finish).
+    La extracción por tramos (segments.py) avisa una vez por tramo: los
+    frames nuevos se pasan igual en bloques de CLASSIFY_EVERY_FRAMES.
+    """
+
+    def __init__(self, job_id, clf):
+        self.job_id = job_id
+        self.clf = clf
+        self.fed_at = 0
+        self.consumed = 0
+        self.analyzer = None
+        self.exercise = None
+        self.streamer = None
+
+    def __call__(self, frames_done, frame_count, snapshot):
+        if self.analyzer is None:
+            if frames_done - self.fed_at >= CLASSIFY_EVERY_FRAMES:
+                self.fed_at = frames_done
+                self._feed(snapshot())
+                if self.clf.done:
+                    self._decide()
+        if self.streamer:
+            self.streamer(frames_done, frame_count, snapshot)
+
+    def _feed(self, seq):
+        for i in range(self.consumed, len(seq), CLASSIFY_EVERY_FRAMES):
+            new = seq[i:i + CLASSIFY_EVERY_FRAMES]
+            self.consumed = i + len(new)
+            lm = new.landmarks[new.detected].astype(np.float64)
+            if len(lm):
+                _, ang = batch_angles(lm, ANGLE_DEFS, dims=3)
+                if self.clf.update(np.round(ang, 3)):
+                    break
+
+    def _decide(self):
+        label, conf, _ = self.clf.result()
+        if label is None:
+            raise ValueError("No se pudo detectar el ejercicio: no hay frames con pose")
+        analyzer, spec = resolve_exercise(str(label).lower())
+        if analyzer is None:
+            raise ValueError(f"Ejercicio detectado no soportado: {label}")
+        self.analyzer, self.exercise = analyzer, str(label).lower()
+        conf_txt = f" (conf {conf:.2f})" if conf is not None else ""
+        print(f"   Ejercicio detectado: {label}{conf_txt} con {self.clf.n} frames")
+        if STREAM_EVENTS:
+            self.streamer = RepStreamer(self.job_id, spec)
+
+    def finish(self, seq):
+        """ Analizador a usar una vez terminada la extracción. """
+        if self.analyzer is None:
+            self._feed(seq)
+            self._decide()
+        return self.analyzer
+
+    def summary(self):
+        return {"label": self.exercise, "confidence": self.clf.conf, "frames": self.clf.n}
 
 # --- FUNCIÓN PRINCIPAL DE EJECUCIÓN (Corregido: renombrado a run_analysis) ---
 
@@ -183,40 +131,75 @@ def run_analysis(job_id: str, video_url: str, exercise: str, video_id: str = Non
     """
     print(f"🔄 Procesando Job {job_id} - {exercise}")
     ex = exercise.lower().strip()
+    timer = JobTimer()
+    timer.add("queue_wait", queue_wait_seconds(get_current_job()))
     
-    # 1. Update running en BD
+    # 1. 'running' en la BD (una sentencia; si falla, el job sigue) y en la caché de estado
     try:
-        with engine.begin() as conn:
-            conn.execute(text("UPDATE jobs SET status = 'running', updated_at = now() WHERE id = :id"), {"id": job_id})
-    except Exception as e:
-        print(f"⚠️ Error BD Inicial: {e}")
-        return
+        mark_running(job_id)
+    except Exception as db_err:
+        print(f"⚠️ Error BD marcando job {job_id} como running: {db_err}")
+    publish_status(job_id, "running")
 
+    streamer = detector = None
     try:
-        # 2. Enrutador de ejercicios
-        if any(x in ex for x in ["sentadilla", "squat"]): result = analyze_squat(video_url)
-        elif any(x in ex for x in ["flexion", "pushup", "lagartija"]): result = analyze_pushup(video_url)
-        elif any(x in ex for x in ["dominada", "pullup"]): result = analyze_pullup(video_url)
-        else: raise ValueError(f"Ejercicio no soportado: {exercise}")
+        # 2. Enrutador de ejercicios + extracción única de pose
+        analyzer, spec = resolve_exercise(ex)
+        if analyzer is None:
+            # "auto" o texto libre: se detecta con el clasificador en la misma pasada
+            try:
+                model, feat_cols = get_classifier()
+            except FileNotFoundError:
+                raise ValueError(f"Ejercicio no soportado: {exercise}")
+            except ValueError as e:
+                raise ValueError(f"Ejercicio no soportado: {exercise} (clasificador no disponible: {e})") from e
+            detector = ExerciseDetector(job_id, StreamingClassifier(model, feat_cols))
+            settings, progress = PoseSettings(), detector
+        else:
+            sampling = sampling_for([REP_ANGLE_DEFS[spec.joint]], (spec.enter_below, spec.exit_above))
+            streamer = RepStreamer(job_id, spec) if STREAM_EVENTS else None
+            settings, progress = PoseSettings(sampling=sampling), streamer
+        source, digest = video_url, None
+        with ExitStack() as lease:
+            if is_remote(video_url):
+                # El video queda prestado (evict no lo borra) hasta terminar de extraer landmarks
+                with timer.stage("fetch"):
+                    fetched = lease.enter_context(fetch_video(video_url))
+                source, digest = fetched.path, fetched.sha256
+                print(f"   Video local: {fetched.path} ({fetched.size} bytes, {'caché' if fetched.cached else 'descargado'})")
+            t0 = time.perf_counter()
+            seq = load_landmarks(source, settings, workers=POSE_WORKERS, on_progress=progress, digest=digest)
+        timer.add_pose_stats(seq, time.perf_counter() - t0)
+        print(f"   Frames inferidos: {seq.stats.get('frames_inferred')}/{seq.stats.get('frames_total')}")
+        with timer.stage("analysis"):
+            if detector:
+                analyzer = detector.finish(seq)
+                ex, streamer = detector.exercise, detector.streamer
+            result = analyzer(seq)
+        if detector:
+            result["details"]["classification"] = detector.summary()
 
         # 3. Guardar Resultados
         final_json = json.dumps({"reps": result["reps"], "score": result["score"], "details": result["details"], "exercise": ex})
         
-        with engine.begin() as conn:
-            conn.execute(
-                text("INSERT INTO analyses(job_id, exercise, reps, score, details) VALUES (:j, :e, :r, :s, :d)"),
-                {"j": job_id, "e": ex, "r": result["reps"], "s": result["score"], "d": json.dumps(result["details"])}
-            )
-            if video_id:
-                conn.execute(text("UPDATE video SET analysis = :ana WHERE id = :vid"), {"ana": final_json, "vid": video_id})
-            
-            conn.execute(text("UPDATE jobs SET status = 'succeeded', updated_at = now() WHERE id = :id"), {"id": job_id})
-            
+        with timer.stage("db_write"):
+            # analyses + video + job 'succeeded' en una sola sentencia (un round-trip)
+            save_result(job_id, ex, result["reps"], result["score"], json.dumps(result["details"]),
+                        video_id=video_id or None, video_json=final_json)
+        publish_status(job_id, "succeeded")
+
+        timer.finish("succeeded")
         print(f"✅ Job {job_id} completado con éxito. Score: {result['score']}")
+        print(f"   Etapas: {timer.summary()}")
+        if streamer: streamer.finish(result)
 
     except Exception as e:
         print(f"❌ Error Job {job_id}: {e}")
+        timer.finish("failed")
+        streamer = streamer or (detector and detector.streamer)
+        if streamer: streamer.fail(str(e))
         try:
-            with engine.begin() as conn:
-                conn.execute(text("UPDATE jobs SET status = 'failed' WHERE id = :id"), {"id": job_id})
-        except: pass
\ No newline at end of file
+            mark_failed(job_id)
+        except Exception as db_err:
+            print(f"⚠️ Error BD marcando job {job_id} como failed: {db_err}")
+        publish_status(job_id, "failed")
\ No newline at end of file
@@ -0,0 +1,325 @@
+# bench.py
+"""
+Benchmark del pipeline de análisis sin GPU ni videos reales.
+
+  1. Genera videos sintéticos (mp4v) en varias resoluciones y duraciones
+     (se guardan en BENCH_VIDEO_DIR y se reutilizan entre corridas).
+  2. Corre el camino real de extract_landmarks (decodificación, reescalado,
+     conversión de color en el hilo lector) con un estimador stub que
+     reproduce landmarks grabados o sintéticos de una sentadilla, en forma
+     determinística (pose_pool.set_backend).
+  3. Mide cada etapa: decode, convert, inference, engine (resto del bucle),
+     angles, reps y db_write (serialización + INSERT en una tabla temporal
+     si hay DATABASE_URL; se hace rollback).
+  4. Escribe JSON y, con --baseline, marca regresiones (etapa más lenta que
+     baseline * (1 + tolerancia) y por más de --min-delta-ms). Sale con
+     código 1 si hay alguna.
+
+Uso:
+    python bench.py --quick
+    python bench.py --out bench.json --save-baseline bench_baseline.json
+    python bench.py --baseline bench_baseline.json --tolerance 0.25
+    python bench.py --landmarks grabados.npy --infer-ms 8
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services import pose_pool
+from app.services.pose_engine import LANDMARK_DIMS, NUM_LANDMARKS, PoseSettings, extract_landmarks
+from app.services.reps import REP_SPECS, analyze_reps, rep_angles
+
+load_dotenv()
+
+BENCH_VIDEO_DIR = os.getenv("BENCH_VIDEO_DIR", os.path.join(tempfile.gettempdir(), "fitai-bench"))
+RESOLUTIONS = {"360p": (640, 360), "720p": (1280, 720), "1080p": (1920, 1080)}
+STAGES = ("decode", "convert", "inference", "engine", "extract_total", "angles", "reps", "db_write")
+
+
+# --- VIDEOS Y LANDMARKS SINTÉTICOS ---
+
+def synthetic_video(width, height, seconds, fps=30):
+    """ Video con fondo cambiante y una figura en movimiento (para que el codec trabaje). """
+    os.makedirs(BENCH_VIDEO_DIR, exist_ok=True)
+    path = os.path.join(BENCH_VIDEO_DIR, f"synth_{width}x{height}_{seconds}s_{fps}fps.mp4")
+    if os.path.exists(path):
+        return path
+    n = int(seconds * fps)
+    tmp = path + ".tmp.mp4"
+    writer = cv2.VideoWriter(tmp, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    yy, xx = np.mgrid[0:height, 0:width]
+    base = ((xx + yy) % 256).astype(np.uint8)
+    for i in range(n):
+        frame = np.dstack([base, np.roll(base, i * 3, axis=1), np.full_like(base, (i * 2) % 256)])
+        cy = int(height * (0.5 + 0.2 * np.sin(2 * np.pi * i / (2 * fps))))
+        cv2.circle(frame, (width // 2, cy), max(8, height // 12), (0, 0, 255), -1)
+        writer.write(frame)
+    writer.release()
+    os.replace(tmp, path)
+    return path
+
+
+def synthetic_landmarks(n, fps=30, period_s=2.0, seed=0):
+    """
+    Landmarks (n, 33, 4) de una persona de perfil haciendo sentadillas: la
+    rodilla oscila entre ~65° y ~175°; el lado izquierdo copia al derecho
+    desplazado. ~3% de frames sin detección.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / fps
+    knee = np.radians(120 + 55 * np.cos(2 * np.pi * t / period_s))
+    lean = np.radians(15 + 10 * (1 - np.cos(2 * np.pi * t / period_s)) / 2)
+    shin, thigh, torso = 0.2, 0.2, 0.3
+
+    lm = np.zeros((n, NUM_LANDMARKS, LANDMARK_DIMS), dtype=np.float32)
+    ankle = np.stack([np.full(n, 0.5), np.full(n, 0.9)], axis=1)
+    shin_dir = np.stack([np.sin(lean), -np.cos(lean)], axis=1)
+    knee_pt = ankle + shin * shin_dir
+    a = np.arctan2(shin_dir[:, 1], shin_dir[:, 0]) + (np.pi - knee)
+    hip = knee_pt + thigh * np.stack([np.cos(a), np.sin(a)], axis=1)
+    shoulder = hip + torso * np.stack([np.sin(lean / 2), -np.cos(lean / 2)], axis=1)
+    elbow = shoulder + np.array([0.12, 0.05])
+    wrist = elbow + np.array([0.12, -0.02])
+    nose = shoulder + np.array([0.02, -0.1])
+    foot = ankle + np.array([0.08, 0.01])
+    right = {0: nose, 12: shoulder, 14: elbow, 16: wrist, 24: hip, 26: knee_pt, 28: ankle, 32: foot}
+    left_of = {12: 11, 14: 13, 16: 15, 24: 23, 26: 25, 28: 27, 32: 31}
+    for idx, pts in right.items():
+        lm[:, idx, :2] = pts
+        if idx in left_of:
+            lm[:, left_of[idx], :2] = pts + np.array([0.1, 0.003])
+    lm[:, :, :2] += rng.normal(0, 0.002, (n, NUM_LANDMARKS, 2)).astype(np.float32)
+    lm[:, :, 3] = 0.99
+    lm[rng.random(n) < 0.03] = np.nan
+    return lm
+
+
+# --- ESTIMADOR STUB ---
+
+class _Point:
+    __slots__ = ("x", "y", "z", "visibility")
+
+    def __init__(self, row):
+        self.x, self.y, self.z, self.visibility = (float(v) for v in row)
+
+
+class _Landmarks:
+    __slots__ = ("landmark",)
+
+    def __init__(self, rows):
+        self.landmark = [_Point(r) for r in rows]
+
+
+class _Result:
+    __slots__ = ("pose_landmarks",)
+
+    def __init__(self, landmarks):
+        self.pose_landmarks = landmarks
+
+
+class ReplayPose:
+    """
+    Reemplazo de mp_pose.Pose: devuelve los landmarks grabados del frame
+    que se está infiriendo (fila = índice del frame en el video, en bucle si
+    el video es más largo), así con --stride o muestreo adaptativo cada
+    frame recibe su propia pose. `infer_ms` simula costo de modelo. Los
+    frames de calentamiento/reset del pool no pasan por process_at.
+    """
+
+    def __init__(self, landmarks, infer_ms=0.0):
+        self.results = [_Result(None if np.isnan(row).any() else _Landmarks(row)) for row in landmarks]
+        self.infer_ms = infer_ms
+        self.calls = 0
+        self.seconds = 0.0
+
+    def process(self, rgb):
+        # Solo lo usan el calentamiento y el reset del pool (frame en negro)
+        return _Result(None)
+
+    def process_at(self, rgb, idx):
+        t0 = time.perf_counter()
+        if self.infer_ms:
+            end = t0 + self.infer_ms / 1000.0
+            while time.perf_counter() < end:
+                pass
+        res = self.results[idx % len(self.results)]
+        self.calls += 1
+        self.seconds += time.perf_counter() - t0
+        return res
+
+    def close(self):
+        pass
+
+
+# --- ETAPAS ---
+
+def _db_engine():
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        return None
+    from sqlalchemy import create_engine, text
+    try:
+        engine = create_engine(url, pool_pre_ping=True)
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        return engine
+    except Exception as e:
+        print(f"⚠️ Sin base de datos para db_write ({e}); solo se mide la serialización", file=sys.stderr)
+        return None
+
+
+def db_write(engine, result):
+    """ Serializa como run_analysis e inserta en una tabla temporal (rollback al final). """
+    t0 = time.perf_counter()
+    details = json.dumps(result["details"])
+    json.dumps({"reps": result["reps"], "score": result["score"], "details": result["details"], "exercise": "sentadilla"})
+    if engine is not None:
+        from sqlalchemy import text
+        with engine.connect() as conn:
+            conn.execute(text("CREATE TEMP TABLE IF NOT EXISTS bench_analyses (job_id text, exercise text, reps int, score float, details jsonb)"))
+            conn.execute(text("INSERT INTO bench_analyses(job_id, exercise, reps, score, details) VALUES (:j, :e, :r, :s, :d)"),
+                         {"j": "bench", "e": "sentadilla", "r": result["reps"], "s": result["score"], "d": details})
+            conn.rollback()
+    return time.perf_counter() - t0
+
+
+def run_case(video, landmarks, stride, infer_ms, engine):
+    stub = ReplayPose(landmarks, infer_ms)
+    pose_pool.set_backend(lambda settings: stub)
+    try:
+        t0 = time.perf_counter()
+        seq = extract_landmarks(video, PoseSettings(stride=stride, roi=False))
+        extract_total = time.perf_counter() - t0
+    finally:
+        pose_pool.set_backend(None)
+    pf = seq.stats["prefetch"]
+
+    t0 = time.perf_counter()
+    rep_angles(seq)
+    angles = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    result = analyze_reps(seq, REP_SPECS["squat"])
+    analysis = time.perf_counter() - t0
+
+    stages = {
+        "decode": pf["decode_seconds"],
+        "convert": pf["convert_seconds"],
+        "inference": stub.seconds,
+        # Bucle del motor sin esperas ni inferencia: ROI, copia de landmarks, buffers
+        "engine": max(0.0, extract_total - pf["consumer_wait_seconds"] - stub.seconds),
+        "extract_total": extract_total,
+        "angles": angles,
+        "reps": max(0.0, analysis - angles),
+        "db_write": db_write(engine, result),
+    }
+    return stages, {"frames": seq.stats["frames_total"], "inferred": seq.stats["frames_inferred"],
+                    "reps": result["reps"], "starved": pf["starved"]}
+
+
+def run_bench(resolutions, durations, repeat, stride, infer_ms, landmarks_path=None, fps=30):
+    engine = _db_engine()
+    recorded = np.load(landmarks_path, mmap_mode="r") if landmarks_path else None
+    cases = []
+    for res in resolutions:
+        w, h = RESOLUTIONS[res]
+        for seconds in durations:
+            video = synthetic_video(w, h, seconds, fps)
+            n = int(seconds * fps)
+            lms = np.asarray(recorded, dtype=np.float32) if recorded is not None else synthetic_landmarks(n, fps)
+            runs, info = [], None
+            for _ in range(repeat):
+                stages, info = run_case(video, lms, stride, infer_ms, engine)
+                runs.append(stages)
+            med = {k: statistics.median(r[k] for r in runs) for k in STAGES}
+            case = {
+                "name": f"{res}_{seconds}s", "width": w, "height": h, "seconds": seconds,
+                **info,
+                "stages_ms": {k: round(v * 1000, 3) for k, v in med.items()},
+                "fps": round(info["frames"] / med["extract_total"], 1) if med["extract_total"] else None,
+            }
+            cases.append(case)
+            print(f"{case['name']}: {case['fps']} fps, " + ", ".join(f"{k}={v:.1f}ms" for k, v in case["stages_ms"].items()),
+                  file=sys.stderr)
+    return {
+        "env": {
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "opencv": cv2.__version__, "numpy": np.__version__,
+            "stride": stride, "infer_ms": infer_ms, "repeat": repeat, "db": engine is not None,
+        },
+        "cases": cases,
+    }
+
+
+def find_regressions(report, baseline, tolerance, min_delta_ms):
+    """ [(caso, etapa, baseline_ms, actual_ms)] de etapas más lentas que el baseline. """
+    base = {c["name"]: c for c in baseline.get("cases", [])}
+    out = []
+    for case in report["cases"]:
+        ref = base.get(case["name"])
+        if not ref:
+            continue
+        for stage, ms in case["stages_ms"].items():
+            ref_ms = ref["stages_ms"].get(stage)
+            if ref_ms is None:
+                continue
+            if ms > ref_ms * (1 + tolerance) and ms - ref_ms > min_delta_ms:
+                out.append({"case": case["name"], "stage": stage, "baseline_ms": ref_ms, "current_ms": ms})
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de análisis (pose stub)")
+    parser.add_argument("--resolutions", default="360p,720p,1080p", help=f"de {list(RESOLUTIONS)}")
+    parser.add_argument("--durations", default="10,30", help="segundos de video, separados por coma")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stride", type=int, default=1)
+    parser.add_argument("--infer-ms", type=float, default=0.0, help="costo simulado por inferencia")
+    parser.add_argument("--landmarks", help=".npy (n, 33, 4) grabado a reproducir en vez del sintético")
+    parser.add_argument("--quick", action="store_true", help="360p, 5 s, 1 repetición")
+    parser.add_argument("--out", help="archivo JSON de salida (por defecto stdout)")
+    parser.add_argument("--baseline", help="JSON de una corrida anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="diferencia mínima para contar como regresión")
+    parser.add_argument("--save-baseline", help="guarda esta corrida como baseline")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.resolutions, args.durations, args.repeat = "360p", "5", 1
+    report = run_bench(
+        [r.strip() for r in args.resolutions.split(",")],
+        [int(d) for d in args.durations.split(",")],
+        args.repeat, args.stride, args.infer_ms, args.landmarks,
+    )
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance, args.min_delta_ms)
+        report["regressions"] = regressions
+        report["tolerance"] = args.tolerance
+
+    text_out = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text_out)
+    else:
+        print(text_out)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            f.write(text_out)
+
+    for r in regressions:
+        print(f"❌ Regresión {r['case']}/{r['stage']}: {r['baseline_ms']:.1f}ms -> {r['current_ms']:.1f}ms", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
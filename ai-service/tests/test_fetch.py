@@ -0,0 +1,99 @@
+"""
+Caché de videos de fetch.py contra un servidor HTTP local: revalidación
+con ETag, préstamo durante el job y expulsión LRU.
+"""
+
+import hashlib
+import http.server
+import threading
+import time
+
+import pytest
+
+from app.services.fetch import VideoFetcher
+
+
+class Origin(http.server.BaseHTTPRequestHandler):
+    body = b""
+    gets = 0
+
+    def _etag(self):
+        return '"%s"' % hashlib.md5(Origin.body).hexdigest()
+
+    def do_HEAD(self):
+        if self.headers.get("If-None-Match") == self._etag():
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", self._etag())
+        self.send_header("Content-Length", str(len(Origin.body)))
+        self.end_headers()
+
+    def do_GET(self):
+        Origin.gets += 1
+        self.send_response(200)
+        self.send_header("ETag", self._etag())
+        self.send_header("Content-Length", str(len(Origin.body)))
+        self.end_headers()
+        self.wfile.write(Origin.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    Origin.body, Origin.gets = b"a" * 1000, 0
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Origin)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_port}"
+    srv.shutdown()
+
+
+def test_revalidates_with_etag(tmp_path, origin):
+    fetcher = VideoFetcher(tmp_path)
+    with fetcher.fetch(origin + "/a.mp4") as first:
+        assert not first.cached
+    with fetcher.fetch(origin + "/a.mp4") as again:
+        assert again.cached and Origin.gets == 1
+
+    Origin.body = b"b" * 900
+    with fetcher.fetch(origin + "/a.mp4") as changed:
+        assert not changed.cached and changed.size == 900
+        assert changed.sha256 == hashlib.sha256(Origin.body).hexdigest()
+
+
+def test_lease_blocks_eviction_but_not_other_jobs(tmp_path, origin):
+    fetcher = VideoFetcher(tmp_path, max_bytes=1500)
+    with fetcher.fetch(origin + "/a.mp4") as leased:
+        # Otro job del mismo video no espera a que termine el primero
+        t0 = time.monotonic()
+        with VideoFetcher(tmp_path, max_bytes=1500).fetch(origin + "/a.mp4") as other:
+            assert other.cached
+        assert time.monotonic() - t0 < 1.0
+        # Pasarse del tamaño no borra el video prestado
+        with fetcher.fetch(origin + "/b.mp4"):
+            pass
+        assert leased.path.exists()
+    with fetcher.fetch(origin + "/c.mp4"):
+        pass
+    assert not leased.path.exists()
+
+
+def test_new_version_waits_for_jobs_on_the_old_one(tmp_path, origin):
+    fetcher = VideoFetcher(tmp_path)
+    with fetcher.fetch(origin + "/a.mp4") as old:
+        Origin.body = b"c" * 800
+        done = {}
+
+        def refetch():
+            with VideoFetcher(tmp_path).fetch(origin + "/a.mp4") as new:
+                done["size"] = new.size
+
+        worker = threading.Thread(target=refetch)
+        worker.start()
+        worker.join(0.5)
+        assert "size" not in done and old.path.read_bytes() == b"a" * 1000
+    worker.join(5)
+    assert done["size"] == 800
@@ -0,0 +1,61 @@
+"""
+Clave de la caché de landmarks con muestreo adaptativo: no depende del
+ejercicio y solo se guardan secuencias completas.
+"""
+
+import numpy as np
+import pytest
+
+from app.services import landmark_cache
+from app.services.landmark_cache import LandmarkCache, cache_key, load_landmarks
+from app.services.pose_engine import PoseSequence, PoseSettings
+from app.services.sampling import AdaptiveSampling
+
+SQUAT = AdaptiveSampling(joints=((24, 26, 28),), band=(160.0, 165.0))
+PUSHUP = AdaptiveSampling(joints=((12, 14, 16),), band=(100.0, 150.0))
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"no es un video, solo contenido para el hash")
+    return str(path)
+
+
+@pytest.fixture
+def extractions(monkeypatch):
+    calls = []
+
+    def fake_extract(source, settings, on_progress=None):
+        calls.append(settings)
+        n = 10 if settings.sampling is None else 4
+        return PoseSequence(np.zeros((n, 33, 4), np.float32), np.arange(n, dtype=np.float64),
+                            np.arange(n), np.ones(n, bool), fps=30.0, frame_count=10)
+
+    monkeypatch.setattr(landmark_cache, "extract_landmarks", fake_extract)
+    return calls
+
+
+def test_key_ignores_sampling():
+    full = cache_key("abc", PoseSettings())
+    assert cache_key("abc", PoseSettings(sampling=SQUAT)) == full
+    assert cache_key("abc", PoseSettings(sampling=PUSHUP, stride=3)) == full
+    assert cache_key("abc", PoseSettings(stride=3)) != full
+
+
+def test_adaptive_miss_is_not_stored(tmp_path, video, extractions):
+    cache = LandmarkCache(tmp_path / "cache")
+    for sampling in (SQUAT, PUSHUP):
+        seq = load_landmarks(video, PoseSettings(sampling=sampling), cache=cache)
+        assert not seq.stats["cache_hit"] and len(seq) == 4
+    assert len(extractions) == 2
+    assert not [p for p in (tmp_path / "cache").iterdir() if not p.name.startswith(".tmp-")]
+
+
+def test_adaptive_request_reuses_full_sequence(tmp_path, video, extractions):
+    cache = LandmarkCache(tmp_path / "cache")
+    load_landmarks(video, PoseSettings(), cache=cache)
+    for sampling in (SQUAT, PUSHUP):
+        seq = load_landmarks(video, PoseSettings(sampling=sampling), cache=cache)
+        assert seq.stats["cache_hit"] and len(seq) == 10
+    assert len(extractions) == 1
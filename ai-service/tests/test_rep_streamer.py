@@ -0,0 +1,42 @@
+"""
+RepStreamer incremental: las repeticiones publicadas durante la extracción
+son las mismas que las del análisis completo, analizando solo la cola.
+"""
+
+import numpy as np
+
+from app.services.events import RepStreamer
+from app.services.pose_engine import PoseSequence
+from app.services.reps import REP_SPECS, analyze_reps
+from bench import synthetic_landmarks
+
+
+class ListBus:
+    def __init__(self):
+        self.events = []
+
+    def publish(self, job_id, event):
+        self.events.append(event)
+
+
+def test_streamed_reps_match_full_analysis():
+    n, spec = 3000, REP_SPECS["squat"]
+    lm = synthetic_landmarks(n, fps=30, period_s=2.0)
+    seq = PoseSequence(lm, np.arange(n) * 1000 / 30, np.arange(n), ~np.isnan(lm).any(axis=(1, 2)))
+    bus = ListBus()
+    streamer = RepStreamer("job", spec, bus=bus, interval=0)
+
+    tails = []
+    for done in range(7, n + 1, 7):
+        tails.append(done - streamer.offset)
+        streamer(done, n, lambda: seq[:done])
+    streamed = [e["feedback"] for e in bus.events if e["type"] == "rep"]
+
+    result = analyze_reps(seq, spec)
+    streamer.finish(result)
+    assert result["reps"] > 20
+    assert streamed == result["details"]["feedback_list"][:len(streamed)]
+    assert len(streamed) >= result["reps"] - 1
+    assert [e["feedback"] for e in bus.events if e["type"] == "rep"] == result["details"]["feedback_list"]
+    # Cada llamada analiza a lo sumo ~una repetición (60 frames) más lo nuevo, no todo el video
+    assert max(tails) < 2 * 60 + 7
@@ -0,0 +1,211 @@
+"""
+extract_landmarks_parallel contra la pasada secuencial sobre el mismo video.
+
+El video sintético lleva el número de frame codificado en el color, y el
+estimador stub lo decodifica de la imagen que recibe: si un tramo lee un
+frame distinto del que dice `frame_index`, sus landmarks no coinciden.
+El stub además suaviza con el resultado anterior hasta perder la pose o
+recibir el frame negro del reset (como el tracking de MediaPipe), así que
+un tramo que llega a un frame con otro estado da otros landmarks; el
+solape tiene que dejarlos dentro de SEGMENT_TOLERANCE.
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+from app.services import pose_engine, pose_pool, preprocess, segments
+from app.services.events import RepStreamer
+from app.services.pose_engine import PoseSettings, _seek, extract_landmarks
+from app.services.reps import REP_SPECS, analyze_reps
+from app.services.sampling import AdaptiveSampling
+from bench import _Landmarks, _Result, synthetic_landmarks
+
+FRAMES = 700
+FPS = 30
+
+
+def frame_color(i):
+    """ RGB de 12 bits por frame, con margen para el error del codec. """
+    return np.array([(i % 16) * 16 + 8, (i // 16 % 16) * 16 + 8, (i // 256) * 16 + 8], dtype=np.uint8)
+
+
+def decode_frame(rgb):
+    r, g, b = (np.clip(rgb.reshape(-1, 3).mean(axis=0), 0, 255) // 16).astype(int)
+    return int(r + 16 * g + 256 * b)
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("video") / "frames.mp4")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), FPS, (320, 240))
+    for i in range(FRAMES):
+        writer.write(np.broadcast_to(frame_color(i)[::-1], (240, 320, 3)).copy())
+    writer.release()
+    return path
+
+
+class Crop(np.ndarray):
+    """ Recorte que recuerda su caja y el tamaño del frame, para que el stub responda en sus coordenadas. """
+
+
+def tagged_crop(image, box):
+    out = preprocess.crop(image, box).view(Crop)
+    out.box, out.frame = box, image.shape[:2]
+    return out
+
+
+class TrackingPose:
+    """ Stub de mp_pose.Pose: landmarks de la sentadilla de bench.py según el frame que ve. """
+
+    def __init__(self, landmarks):
+        self.landmarks = landmarks
+        self.last = None
+
+    def process(self, rgb):
+        if not rgb.any():  # frame negro del pool: se pierde el tracking
+            self.last = None
+            return _Result(None)
+        row = self.landmarks[decode_frame(rgb) % len(self.landmarks)].astype(np.float64)
+        if np.isnan(row).any():
+            self.last = None
+            return _Result(None)
+        if self.last is not None:
+            row[:, :3] = 0.5 * row[:, :3] + 0.5 * self.last[:, :3]
+        self.last = row.copy()
+        box = getattr(rgb, "box", None)
+        if box is not None:
+            # Mismo punto en coordenadas del recorte (inversa de to_full_frame)
+            (h, w), (x0, y0, x1, y1) = rgb.frame, box
+            row[:, 0] = (row[:, 0] * w - x0) / (x1 - x0)
+            row[:, 1] = (row[:, 1] * h - y0) / (y1 - y0)
+            row[:, 2] = row[:, 2] * w / (x1 - x0)
+        return _Result(_Landmarks(row))
+
+    def close(self):
+        pass
+
+
+class InlineExecutor:
+    """ Pool de tramos en el mismo proceso (el stub no llega a procesos spawn). """
+
+    def map(self, fn, items):
+        return map(fn, items)
+
+
+@pytest.fixture
+def stub_backend(monkeypatch):
+    landmarks = synthetic_landmarks(FRAMES, fps=FPS)
+    # Solo los puntos que arma bench.py son visibles (si no, la caja ROI es todo el frame)
+    hidden = np.ones(landmarks.shape[1], dtype=bool)
+    hidden[[0, 11, 12, 13, 14, 15, 16, 23, 24, 25, 26, 27, 28, 31, 32]] = False
+    landmarks[:, hidden, 3] = 0.0
+    pose_pool.set_backend(lambda settings: TrackingPose(landmarks))
+    monkeypatch.setattr(pose_engine, "crop", tagged_crop)
+    monkeypatch.setattr(segments, "_pool", InlineExecutor())
+    monkeypatch.setattr(segments, "_pool_size", 8)
+    yield
+    pose_pool.set_backend(None)
+
+
+def test_frames_match_content(video, stub_backend):
+    seq = extract_landmarks(video, PoseSettings(roi=False, max_side=0))
+    assert len(seq) == FRAMES
+    np.testing.assert_array_equal(seq.frame_index, np.arange(FRAMES))
+
+
+@pytest.mark.parametrize("settings", [
+    PoseSettings(roi=False),
+    PoseSettings(roi=True),
+    PoseSettings(roi=True, stride=3),
+], ids=["stride1", "stride1-roi", "stride3-roi"])
+def test_segmented_matches_sequential(video, stub_backend, settings):
+    sequential = extract_landmarks(video, settings)
+    segmented = segments.extract_landmarks_parallel(video, settings, workers=3, min_frames=1)
+
+    assert segmented.stats["segments"] == 3
+    np.testing.assert_array_equal(segmented.frame_index, sequential.frame_index)
+    np.testing.assert_array_equal(segmented.timestamps, sequential.timestamps)
+    np.testing.assert_array_equal(segmented.detected, sequential.detected)
+    diff = np.abs(segmented.landmarks[..., :2] - sequential.landmarks[..., :2])
+    assert np.nanmax(diff) <= segments.SEGMENT_TOLERANCE
+    for spec in REP_SPECS.values():
+        assert analyze_reps(segmented, spec) == analyze_reps(sequential, spec)
+    assert analyze_reps(sequential, REP_SPECS["squat"])["reps"] > 0
+    if settings.roi:
+        assert sequential.stats["roi"]["hits"] > 0
+        assert segmented.stats["roi"]["hits"] >= sequential.stats["roi"]["hits"]  # más el solape
+    else:
+        # Sin caja ROI el solape borra por completo el estado inicial del stub
+        np.testing.assert_allclose(segmented.landmarks, sequential.landmarks, atol=1e-6)
+
+
+def test_adaptive_sampling_runs_sequential(video, stub_backend):
+    settings = PoseSettings(roi=True, sampling=AdaptiveSampling(joints=((24, 26, 28),), band=(160.0, 165.0)))
+    sequential = extract_landmarks(video, settings)
+    seq = segments.extract_landmarks_parallel(video, settings, workers=3, min_frames=1)
+    assert "segments" not in seq.stats
+    np.testing.assert_array_equal(seq.frame_index, sequential.frame_index)
+    np.testing.assert_array_equal(seq.landmarks, sequential.landmarks)
+
+
+class ListBus:
+    def __init__(self):
+        self.events = []
+
+    def publish(self, job_id, event):
+        self.events.append(event)
+
+
+def test_progress_per_segment(video, stub_backend):
+    spec, bus, calls = REP_SPECS["squat"], ListBus(), []
+    streamer = RepStreamer("job", spec, bus=bus, interval=0)
+
+    def on_progress(frames_done, frame_count, snapshot):
+        calls.append((frames_done, len(snapshot())))
+        streamer(frames_done, frame_count, snapshot)
+
+    seq = segments.extract_landmarks_parallel(video, PoseSettings(roi=False), workers=3,
+                                              min_frames=1, on_progress=on_progress)
+    assert [done for done, _ in calls] == [234, 468, FRAMES]
+    assert calls[-1][1] == len(seq)
+    result = analyze_reps(seq, spec)
+    streamer.finish(result)
+    assert [e["feedback"] for e in bus.events if e["type"] == "rep"] == result["details"]["feedback_list"]
+
+
+def test_pool_is_reused():
+    pool = segments.start_pool(2)
+    try:
+        assert segments.start_pool(2) is pool
+        assert segments.start_pool(1) is None
+    finally:
+        segments.shutdown_pool()
+
+
+class KeyframeCapture:
+    """ VideoCapture que al saltar cae `offset` frames antes (o después) del pedido. """
+
+    def __init__(self, path, offset):
+        self.cap = cv2.VideoCapture(path)
+        self.offset = offset
+        self.opened = 0
+
+    def set(self, prop, value):
+        return self.cap.set(prop, max(0, value + self.offset))
+
+    def open(self, path):
+        self.opened += 1
+        return self.cap.open(path)
+
+    def __getattr__(self, name):
+        return getattr(self.cap, name)
+
+
+@pytest.mark.parametrize("offset", [-7, 5])
+def test_seek_lands_on_requested_frame(video, offset):
+    cap = KeyframeCapture(video, offset)
+    assert _seek(cap, video, 250) == 250
+    ok, bgr = cap.read()
+    assert ok and decode_frame(bgr[..., ::-1]) == 250
+    assert cap.opened == (offset > 0)
@@ -0,0 +1,137 @@
+"""
+StreamingSquatEvaluator contra SquatEvaluator.evaluate sobre las tablas
+de process_video, con el mismo flujo de landmarks sintético.
+"""
+
+import re
+
+import numpy as np
+
+from app.services import analizar_postura
+from app.services.analizar_postura import SquatEvaluator, StreamingSquatEvaluator, evaluate_squat, process_video
+from app.services.pose_engine import LANDMARK_DIMS, NUM_LANDMARKS, PoseSequence, mp_pose
+
+P = mp_pose.PoseLandmark
+
+
+def squat_landmarks(n, seed=0, missing=0.02, degenerate=0.01):
+    """
+    Sentadillas de frente: rodilla entre ~175° y ~70° (flexión en z),
+    base ≈ 1.1 veces el ancho de hombros y tronco casi vertical, con ruido.
+    Devuelve (landmarks (n, 33, 4) float32, detected (n,)). Un `missing` de
+    los frames queda sin pose y en un `degenerate` la muñeca coincide con
+    el codo (ángulo NaN: process_video descarta la fila de ángulos).
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n)
+    knee_deg = 122.5 + 52.5 * np.cos(2 * np.pi * t / 90.0) + rng.normal(0, 2, n)
+    a = np.radians((180.0 - knee_deg) / 2.0)
+    tilt = np.radians(rng.normal(4.0, 2.0, n))
+    L = 0.2
+
+    lm = np.zeros((n, NUM_LANDMARKS, LANDMARK_DIMS))
+    lm[..., 3] = 1.0
+    for side, sx in ((-1, "LEFT"), (1, "RIGHT")):
+        x = 0.5 + side * 0.1
+        ankle = np.column_stack([np.full(n, x), np.full(n, 0.9), np.zeros(n)])
+        knee = ankle + L * np.column_stack([np.zeros(n), -np.cos(a), -np.sin(a)])
+        hip = knee + L * np.column_stack([np.zeros(n), -np.cos(a), np.sin(a)])
+        shoulder = hip + 0.3 * np.column_stack([np.sin(tilt), -np.cos(tilt), np.zeros(n)])
+        elbow = shoulder + [0.0, 0.15, 0.0]
+        wrist = elbow + [0.02, 0.12, 0.05]
+        foot = ankle + [side * 0.012, 0.02, -0.05]
+        for name, pts in (("ANKLE", ankle), ("KNEE", knee), ("HIP", hip), ("SHOULDER", shoulder),
+                          ("ELBOW", elbow), ("WRIST", wrist), ("FOOT_INDEX", foot)):
+            lm[:, P[f"{sx}_{name}"].value, :3] = pts
+    lm[..., :3] += rng.normal(0, 0.003, (n, NUM_LANDMARKS, 3))
+
+    bad = rng.random(n) < degenerate
+    lm[bad, P.LEFT_WRIST.value] = lm[bad, P.LEFT_ELBOW.value]
+    detected = rng.random(n) >= missing
+    lm[~detected] = np.nan
+    return lm.astype(np.float32), detected
+
+
+def batch_eval(monkeypatch, lm, detected):
+    """ SquatEvaluator.evaluate sobre las tablas que arma process_video para esta secuencia. """
+    seq = PoseSequence(lm, np.arange(len(lm)) * 33.3, np.arange(len(lm)), detected)
+    monkeypatch.setattr(analizar_postura, "load_landmarks", lambda *args, **kwargs: seq)
+    df_angles, df_lm = process_video("synthetic.mp4")
+    return SquatEvaluator().evaluate(df_angles, df_lm)
+
+
+def stream_eval(lm, detected, chunk=500, **kwargs):
+    ev = StreamingSquatEvaluator(**kwargs)
+    poses = lm[detected]
+    for i in range(0, len(poses), chunk):
+        ev.update_batch(poses[i:i + chunk])
+    return ev
+
+
+def verdicts(result):
+    """ Mensajes sin los valores numéricos: qué reglas pasan y qué consejos se dan. """
+    return [re.sub(r"\d+(\.\d+)?", "#", m) for m in result.messages]
+
+
+def test_exact_when_all_frames_fit(monkeypatch):
+    lm, detected = squat_landmarks(3000)
+    assert detected.sum() <= 4096
+
+    expected = batch_eval(monkeypatch, lm, detected)
+    got = stream_eval(lm, detected, capacity=4096).result()
+
+    assert got == expected
+
+
+def test_single_frame_updates_match_batches():
+    lm, detected = squat_landmarks(400, seed=1)
+    one = StreamingSquatEvaluator(capacity=128, seed=3)
+    for frame in lm[detected]:
+        one.update(frame)
+    batched = stream_eval(lm, detected, chunk=37, capacity=128, seed=3)
+
+    assert one.seen == batched.seen
+    np.testing.assert_array_equal(one.sample, batched.sample)
+    assert one.result() == batched.result()
+
+
+def test_long_sequence_within_dkw_bound(monkeypatch):
+    lm, detected = squat_landmarks(20_000, seed=2)
+    capacity, delta = 4096, 0.01
+
+    expected = batch_eval(monkeypatch, lm, detected)
+    ev = stream_eval(lm, detected, capacity=capacity)
+    got = ev.result()
+
+    assert ev.seen == detected.sum()
+    assert got.score == expected.score
+    assert got.ok == expected.ok
+    assert verdicts(got) == verdicts(expected)
+
+    # Cota DKW: el percentil del reservorio cae, en la distribución del
+    # video completo, a menos de eps del percentil pedido. Con capacity >=
+    # frames el reservorio guarda todas las filas del video.
+    full = stream_eval(lm, detected, capacity=int(detected.sum())).sample
+    full_knee = full[~np.isnan(full[:, 1]), 1]
+    sample = ev.sample
+    valid = sample[~np.isnan(sample[:, 1])]
+
+    knee_p15 = np.percentile(valid[:, 1], SquatEvaluator.BOTTOM_PERCENTILE)
+    eps = np.sqrt(np.log(2 / delta) / (2 * len(valid)))
+    assert abs(np.mean(full_knee <= knee_p15) - SquatEvaluator.BOTTOM_PERCENTILE / 100) <= eps
+
+    ratio_median = np.median(sample[:, 0])
+    eps = np.sqrt(np.log(2 / delta) / (2 * capacity))
+    assert abs(np.mean(full[:, 0] <= ratio_median) - 0.5) <= eps
+
+
+def test_evaluate_squat_streams_long_videos(monkeypatch):
+    lm, detected = squat_landmarks(3000, seed=4)
+    seq = PoseSequence(lm, np.arange(len(lm)) * 33.3, np.arange(len(lm)), detected)
+
+    assert evaluate_squat(seq, capacity=4096) == batch_eval(monkeypatch, lm, detected)
+
+    # Más frames que el reservorio: StreamingSquatEvaluator, recorriendo la secuencia por bloques
+    monkeypatch.setattr(analizar_postura, "sequence_tables", None)
+    got = evaluate_squat(seq, capacity=1000, chunk=256)
+    assert got == stream_eval(lm, detected, capacity=1000).result()
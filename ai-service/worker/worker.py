@@ -1,24 +1,165 @@
 import os
+import sys
+import time
+import signal
+import argparse
+import multiprocessing as mp
 import redis
 from rq import SimpleWorker
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Pool de BD dimensionado para un proceso que corre un job a la vez (app.services.db)
+os.environ.setdefault("DB_ROLE", "worker")
+
 redis_url = os.getenv("REDIS_URL")
 if not redis_url:
     raise RuntimeError("No se encontró REDIS_URL en el archivo .env")
 
 conn = redis.from_url(redis_url)
 
+# Raíz de ai-service en el path para importar 'app' igual que hace RQ
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+QUEUES = ["fitai"]
+SHUTDOWN_TIMEOUT = float(os.getenv("WORKER_SHUTDOWN_TIMEOUT", "600"))
+THREAD_ENV = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS", "TF_NUM_INTEROP_THREADS", "TF_NUM_INTRAOP_THREADS")
+
+def warmup():
+    """
+    Hook de arranque: importa las tareas y deja estimadores de pose listos
+    en el pool del proceso, así el primer job no paga la carga del modelo.
+    SimpleWorker corre los jobs en este mismo proceso, y el pool se reutiliza.
+    Con POSE_WORKERS > 1 también arranca el pool de tramos (segments.py),
+    que vive mientras viva el worker.
+    """
+    if os.getenv("POSE_WARMUP", "1") in ("0", "false", "no"):
+        return
+    import app.tasks  # noqa: F401
+    from app.services import pose_pool
+    from app.services.pose_engine import PoseSettings
+    secs = pose_pool.warmup([PoseSettings()])
+    print(f"Modelos de pose precargados en {secs:.2f}s")
+    from app.services import segments
+    if segments.start_pool(segments.POSE_WORKERS, warm=[PoseSettings()]):
+        print(f"Pool de tramos con {segments.POSE_WORKERS} procesos")
+    from app.services.classifier import get_classifier
+    try:
+        get_classifier()
+        print("Clasificador de ejercicios cargado")
+    except (FileNotFoundError, ValueError) as e:
+        print(f"⚠️ Sin clasificador de ejercicios: {e}")
+
+def start_metrics(slot=0):
+    """ Exporter Prometheus del proceso en WORKER_METRICS_PORT + slot (0 = desactivado). """
+    from app.services.metrics import WORKER_METRICS_PORT, start_exporter
+    if WORKER_METRICS_PORT and start_exporter(WORKER_METRICS_PORT + slot):
+        print(f"Métricas en :{WORKER_METRICS_PORT + slot}/metrics")
+
+# --- MODO SUPERVISOR: N ejecutores concurrentes ---
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def run_executor(slot, cpus, threads):
+    """
+    Proceso hijo: fija afinidad y límites de hilos ANTES de importar
+    numpy/cv2/mediapipe, y corre un SimpleWorker normal.
+    """
+    if hasattr(os, "setsid"):
+        os.setsid()  # Ctrl+C de la terminal le llega solo al supervisor
+    for var in THREAD_ENV:
+        os.environ[var] = str(threads)
+    os.environ["POSE_WORKERS"] = "1"  # sin pool de tramos dentro de un ejecutor
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    import cv2
+    cv2.setNumThreads(threads)
+
+    warmup()
+    start_metrics(slot)
+    w = SimpleWorker(QUEUES, connection=redis.from_url(redis_url), name=f"fitai-{os.getpid()}-{slot}")
+    # Un solo ejecutor corre el scheduler de RQ
+    w.work(with_scheduler=(slot == 0))
+
+def supervise(procs):
+    """
+    Arranca `procs` ejecutores (procesos spawn), reparte los CPUs entre
+    ellos, reinicia los que se caen y, con SIGINT/SIGTERM, les pide un
+    apagado ordenado (RQ termina el job en curso) antes de forzarlos.
+    """
+    ctx = mp.get_context("spawn")
+    cpus = available_cpus()
+    procs = max(1, procs)
+    threads = max(1, len(cpus) // procs)
+    plan = {slot: cpus[slot::procs] if procs <= len(cpus) else [] for slot in range(procs)}
+    running, started, failures = {}, {}, {}
+    stopping = False
+
+    def start(slot):
+        p = ctx.Process(target=run_executor, args=(slot, plan[slot], threads), name=f"fitai-executor-{slot}")
+        p.start()
+        running[slot], started[slot] = p, time.monotonic()
+        print(f"Ejecutor {slot} iniciado (pid {p.pid}, cpus {plan[slot] or 'todos'}, hilos {threads})")
+
+    def on_signal(signum, _frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    for slot in range(procs):
+        start(slot)
+
+    while not stopping:
+        time.sleep(1)
+        for slot, p in list(running.items()):
+            if p.is_alive() or stopping:
+                continue
+            # Si se cae apenas arranca, esperar más antes de reintentar
+            failures[slot] = failures.get(slot, 0) + 1 if time.monotonic() - started[slot] < 30 else 1
+            delay = min(60, 2 ** (failures[slot] - 1))
+            print(f"⚠️ Ejecutor {slot} terminó (código {p.exitcode}); reinicio en {delay}s")
+            time.sleep(delay)
+            if not stopping:
+                start(slot)
+
+    print("Deteniendo ejecutores (esperando jobs en curso)...")
+    for p in running.values():
+        if p.is_alive():
+            p.terminate()  # SIGTERM = apagado en caliente para RQ
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    for p in running.values():
+        p.join(max(0, deadline - time.monotonic()))
+        if p.is_alive():
+            p.kill()
+            p.join()
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker RQ de FitAI")
+    parser.add_argument("--supervise", action="store_true", help="correr varios ejecutores concurrentes")
+    parser.add_argument("--procs", type=int, default=int(os.getenv("WORKER_PROCS", "0")),
+                        help="ejecutores en modo supervisor (0 = uno por núcleo)")
+    args = parser.parse_args()
+
     try:
-        print(f"Worker (Modo Windows) conectado a Redis...")
-        
-        w = SimpleWorker(["fitai"], connection=conn)
-        
-        print("Escuchando tareas en la cola 'fitai'...")
-        w.work(with_scheduler=True)
-        
+        if args.supervise:
+            n = args.procs or len(available_cpus())
+            print(f"Supervisor conectado a Redis, {n} ejecutores en la cola 'fitai'...")
+            supervise(n)
+        else:
+            print(f"Worker (Modo Windows) conectado a Redis...")
+            warmup()
+            start_metrics()
+
+            w = SimpleWorker(QUEUES, connection=conn)
+
+            print("Escuchando tareas en la cola 'fitai'...")
+            w.work(with_scheduler=True)
+
     except Exception as e:
-        print(f"❌ Error iniciando el worker: {e}")
\ No newline at end of file
+        print(f"❌ Error iniciando el worker: {e}")